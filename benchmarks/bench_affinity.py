@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Compare throughput of pinned and unpinned MuSE calls.
+
+Runs benchmarks/bench_run.py with fake_muse in "work" mode, which does a
+fixed amount of work over a working set, so time lost to contention and
+migrations between cores shows in the wall time. Each configuration runs
+--repeats times, and the median is reported. --noise starts that many
+unpinned busy-looping processes for the duration, standing in for other
+containers on the node.
+
+    python benchmarks/bench_affinity.py --threads 16 --noise 8
+    python benchmarks/bench_affinity.py --configs ";--cpu-affinity --numa"
+"""
+import argparse
+import json
+import os
+import shlex
+import statistics
+import subprocess
+import sys
+
+BENCH_RUN = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_run.py")
+
+DEFAULT_CONFIGS = ";--cpu-affinity;--cpu-affinity --numa"
+
+NOISE = "while True: pass"
+
+
+def bench(args, muse_args) -> dict:
+    env = dict(os.environ, FAKE_MUSE_MODE="work")
+    out = subprocess.check_output(
+        [
+            sys.executable,
+            BENCH_RUN,
+            "--single",
+            str(args.intervals),
+            "--threads",
+            str(args.threads),
+            "--interval-bp",
+            str(args.interval_bp),
+        ]
+        + muse_args,
+        env=env,
+    )
+    return json.loads(out.decode().strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--intervals", type=int, default=200)
+    parser.add_argument("--interval-bp", type=int, default=25000000)
+    parser.add_argument("--threads", type=int, default=os.cpu_count())
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--noise", type=int, default=0)
+    parser.add_argument(
+        "--configs",
+        default=DEFAULT_CONFIGS,
+        help="';'-separated multi_muse placement arguments to compare.",
+    )
+    args = parser.parse_args()
+
+    noise = [
+        subprocess.Popen([sys.executable, "-c", NOISE]) for _ in range(args.noise)
+    ]
+    try:
+        rows = []
+        for config in args.configs.split(";"):
+            walls = [
+                bench(args, shlex.split(config))["wall_s"] for _ in range(args.repeats)
+            ]
+            wall = statistics.median(walls)
+            rows.append(
+                dict(
+                    config=config or "unpinned",
+                    wall_s=wall,
+                    mbp_per_s=args.intervals * args.interval_bp / wall / 1e6,
+                )
+            )
+    finally:
+        for proc in noise:
+            proc.kill()
+            proc.wait()
+
+    print("{:<28} {:>9} {:>10} {:>8}".format("config", "wall_s", "Mbp/s", "speedup"))
+    for row in rows:
+        print(
+            "{:<28} {:>9.2f} {:>10.1f} {:>7.2f}x".format(
+                row["config"],
+                row["wall_s"],
+                row["mbp_per_s"],
+                rows[0]["wall_s"] / row["wall_s"],
+            )
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Benchmark packing exome-sized intervals into region-list batches.
+
+Runs benchmarks/bench_run.py over a synthetic exome BED (by default
+200,000 intervals of about 170 bp) once per batching configuration, with
+fake_muse charging --startup seconds per call for loading the reference
+index and opening the BAMs. One call per interval would take hours here,
+so the unbatched configuration runs over the first --sample intervals and
+its wall time is projected to the whole BED.
+
+    python benchmarks/bench_batching.py --threads 8 --startup 0.2
+    python benchmarks/bench_batching.py --configs "--batch-bp 50000;--batch-bp 5000"
+"""
+import argparse
+import json
+import os
+import shlex
+import subprocess
+import sys
+
+BENCH_RUN = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_run.py")
+
+DEFAULT_CONFIGS = "--batch-bp 20000;--batch-bp 100000;--batch-intervals 1000"
+
+
+def bench(size: int, args, muse_args) -> dict:
+    env = dict(os.environ, FAKE_MUSE_STARTUP_S=str(args.startup))
+    out = subprocess.check_output(
+        [
+            sys.executable,
+            BENCH_RUN,
+            "--single",
+            str(size),
+            "--threads",
+            str(args.threads),
+            "--interval-bp",
+            str(args.interval_bp),
+        ]
+        + muse_args,
+        env=env,
+    )
+    return json.loads(out.decode().strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--intervals", type=int, default=200000)
+    parser.add_argument("--interval-bp", type=int, default=170)
+    parser.add_argument("--sample", type=int, default=2000)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--startup", type=float, default=0.2)
+    parser.add_argument(
+        "--configs",
+        default=DEFAULT_CONFIGS,
+        help="';'-separated multi_muse batching arguments to compare.",
+    )
+    args = parser.parse_args()
+
+    rows = []
+    base = bench(args.sample, args, [])
+    base.update(
+        config="unbatched", projected_s=base["wall_s"] * args.intervals / args.sample
+    )
+    rows.append(base)
+    for config in args.configs.split(";"):
+        row = bench(args.intervals, args, shlex.split(config))
+        row.update(config=config, projected_s=row["wall_s"])
+        rows.append(row)
+
+    print(
+        "{:<24} {:>9} {:>7} {:>9} {:>12} {:>8}".format(
+            "config", "intervals", "calls", "wall_s", "projected_s", "speedup"
+        )
+    )
+    for row in rows:
+        print(
+            "{:<24} {:>9} {:>7} {:>9.1f} {:>12.1f} {:>7.1f}x".format(
+                row["config"],
+                row["intervals"],
+                row["calls"],
+                row["wall_s"],
+                row["projected_s"],
+                base["projected_s"] / row["projected_s"],
+            )
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
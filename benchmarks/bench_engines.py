@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+Compare dispatcher overhead of the thread and asyncio engines.
+
+Runs many short-lived commands through each engine and reports wall time,
+commands per second and the dispatcher's own CPU time.
+
+    python benchmarks/bench_engines.py --commands 5000 --concurrency 32
+"""
+import argparse
+import logging
+import resource
+import time
+
+from muse_tool.aio_engine import aio_submit_commands
+from muse_tool.multi_muse import tpe_submit_commands
+
+ENGINES = {"thread": tpe_submit_commands, "asyncio": aio_submit_commands}
+
+
+def self_cpu() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def bench(engine: str, cmds: list, concurrency: int) -> dict:
+    cpu, start = self_cpu(), time.time()
+    exceptions = ENGINES[engine](cmds, concurrency, 60)
+    wall = time.time() - start
+    return dict(
+        engine=engine,
+        commands=len(cmds),
+        failed=len(exceptions),
+        wall_s=round(wall, 3),
+        cmds_per_s=round(len(cmds) / wall, 1),
+        dispatcher_cpu_s=round(self_cpu() - cpu, 3),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--commands", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--command", default="true", help="Command to run.")
+    args = parser.parse_args()
+
+    # Silence per-command stdout/stderr logging.
+    logging.getLogger("muse_tool").setLevel(logging.WARNING)
+    cmds = [args.command] * args.commands
+    for engine in ENGINES:
+        print(bench(engine, cmds, args.concurrency))
+
+
+if __name__ == "__main__":
+    main()
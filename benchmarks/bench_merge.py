@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Compare merge throughput of the bulk merger with the previous line loop.
+
+Writes `--files` synthetic MuSE outputs totalling `--size-mb`, merges them
+with each implementation and reports MB/s. Inputs are read once first so
+every implementation sees a warm page cache.
+
+    python benchmarks/bench_merge.py --size-mb 4096 --files 256
+"""
+import argparse
+import filecmp
+import gzip
+import os
+import random
+import tempfile
+import time
+
+from muse_tool.bgzf import cpu_count
+from muse_tool.merge import merge_files, open_merged
+
+HEADER = "##MuSE_Version=v1.0rc\n#CHROM\tPOS\tREF\tALT\tT\tN\n"
+
+
+def line_loop_merge(outputs, out_path):
+    """The previous merge_muse / multi_muse implementation."""
+    first = True
+    with open(out_path, "w") as o:
+        for m in outputs:
+            with open(m) as f:
+                for line in f:
+                    if first or not line.startswith("#"):
+                        o.write(line)
+            first = False
+
+
+def bulk_merge_text(outputs, out_path):
+    with open(out_path, "w") as fh:
+        merge_files(outputs, fh)
+
+
+def bulk_merge_binary(outputs, out_path):
+    with open(out_path, "wb") as fh:
+        merge_files(outputs, fh)
+
+
+def bulk_merge_bgzf(outputs, out_path):
+    with open_merged(out_path, bgzf=True, threads=cpu_count()) as fh:
+        merge_files(outputs, fh)
+
+
+IMPLEMENTATIONS = {
+    "line_loop": line_loop_merge,
+    "bulk_text": bulk_merge_text,
+    "bulk_binary": bulk_merge_binary,
+    "bulk_bgzf": bulk_merge_bgzf,
+}
+
+
+def same_content(expected_path: str, path: str) -> bool:
+    """Compare merged outputs, decompressing BGZF output."""
+    if not path.endswith(".gz"):
+        return filecmp.cmp(expected_path, path, shallow=False)
+    with open(expected_path, "rb") as expected, gzip.open(path, "rb") as got:
+        while True:
+            chunk = expected.read(1 << 20)
+            if chunk != got.read(len(chunk) or 1):
+                return False
+            if not chunk:
+                return True
+
+
+def write_outputs(workdir: str, files: int, size_mb: int):
+    rng = random.Random(0)
+    lines = [
+        "chr{}\t{}\tA\tG\t{}\t{}\n".format(
+            rng.randint(1, 22), rng.randint(1, 2 ** 28), rng.randint(0, 99), 0
+        )
+        for _ in range(10000)
+    ]
+    block = "".join(lines)
+    per_file = size_mb * 1e6 / files
+    outputs = []
+    for i in range(files):
+        path = os.path.join(workdir, "{}.MuSE.txt".format(i))
+        with open(path, "w") as fh:
+            fh.write(HEADER)
+            for _ in range(max(1, int(per_file / len(block)))):
+                fh.write(block)
+        outputs.append(path)
+    return outputs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--size-mb", type=int, default=2048)
+    parser.add_argument("--files", type=int, default=128)
+    parser.add_argument("--scratch", default=None, help="Parent of scratch dir.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.scratch) as workdir:
+        outputs = write_outputs(workdir, args.files, args.size_mb)
+        size = sum(os.path.getsize(path) for path in outputs)
+        for path in outputs:
+            with open(path, "rb") as fh:
+                while fh.read(1 << 20):
+                    pass
+        merged = {}
+        for name, merge in IMPLEMENTATIONS.items():
+            merged[name] = os.path.join(workdir, "{}.merged".format(name))
+            if name.endswith("bgzf"):
+                merged[name] += ".gz"
+            start = time.time()
+            merge(outputs, merged[name])
+            wall = time.time() - start
+            print(
+                dict(
+                    implementation=name,
+                    files=len(outputs),
+                    mb=round(size / 1e6, 1),
+                    wall_s=round(wall, 3),
+                    mb_s=round(size / 1e6 / wall, 1),
+                    out_mb=round(os.path.getsize(merged[name]) / 1e6, 1),
+                    identical=same_content(merged["line_loop"], merged[name]),
+                )
+            )
+            if name != "line_loop":
+                os.unlink(merged[name])
+                if os.path.exists(merged[name] + ".tbi"):
+                    os.unlink(merged[name] + ".tbi")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+Benchmark multi_muse end to end against a synthetic MuSE stand-in.
+
+For each BED size, writes a synthetic reference index, BED and BAM
+placeholders into a scratch directory, then drives `multi_muse.run` with
+benchmarks/fake_muse.py as `--muse-binary`. Each size runs in its own
+process, so the orchestrator's peak RSS is measured per size. Reports:
+
+    efficiency       ideal makespan / wall time, where ideal is the larger of
+                     the summed call durations / thread_count and the longest
+                     call
+    overhead_ms      (wall - ideal) * thread_count / calls: orchestration
+                     cost per call, including idle slots
+    cpu_s            orchestrator CPU time
+    merge_mb_s       throughput of merge_files over the shard outputs
+    peak_rss_mb      orchestrator peak RSS
+
+    python benchmarks/bench_run.py --sizes 10,1000,100000 --threads 16
+    python benchmarks/bench_run.py --save base.jsonl
+    python benchmarks/bench_run.py --baseline base.jsonl  # exit 1 on regression
+
+Arguments not recognized here are passed on to multi_muse, e.g.
+`--schedule ljf` or `--shards-per-thread 4`.
+"""
+import argparse
+import gzip
+import json
+import logging
+import os
+import pathlib
+import random
+import resource
+import shlex
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+from muse_tool.manifest import load_manifest
+from muse_tool.merge import merge_files
+from muse_tool.multi_muse import process_argv, run
+
+FAKE_MUSE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_muse.py")
+
+# Higher is better for these, lower for the rest.
+HIGHER_IS_BETTER = ("efficiency", "merge_mb_s")
+COMPARED = ("efficiency", "overhead_ms", "merge_mb_s", "peak_rss_mb")
+
+
+def write_bam_stub(path: str, contigs: List[str], length: int):
+    """Write a read-less BAM with the given contigs, and its BAI index, so
+    the inputs pass preflight."""
+    header = [b"BAM\1", struct.pack("<i", 0), struct.pack("<i", len(contigs))]
+    for contig in contigs:
+        name = contig.encode() + b"\0"
+        header.append(struct.pack("<i", len(name)) + name + struct.pack("<i", length))
+    with open(path, "wb") as fh:
+        fh.write(gzip.compress(b"".join(header)))
+    with open(path + ".bai", "wb") as fh:
+        fh.write(b"BAI\1" + struct.pack("<i", len(contigs)))
+        fh.write(struct.pack("<ii", 0, 0) * len(contigs))
+
+
+def write_inputs(workdir: str, intervals: int, interval_bp: int, seed: int):
+    """Write ref.fa(.fai), t.bam(.bai), n.bam(.bai) and a BED of `intervals`
+    lines."""
+    rng = random.Random(seed)
+    contigs = ["chr{}".format(i) for i in list(range(1, 23)) + ["X", "Y"]]
+    per_contig = -(-intervals // len(contigs))
+    contig_length = per_contig * interval_bp * 4
+    with open(os.path.join(workdir, "ref.fa.fai"), "w") as fh:
+        for offset, contig in enumerate(contigs):
+            fh.write("{}\t{}\t{}\t60\t61\n".format(contig, contig_length, offset))
+    open(os.path.join(workdir, "ref.fa"), "w").close()
+    for name in ("t.bam", "n.bam"):
+        write_bam_stub(os.path.join(workdir, name), contigs, contig_length)
+    with open(os.path.join(workdir, "bench.bed"), "w") as fh:
+        written = 0
+        for contig in contigs:
+            pos = 0
+            for _ in range(min(per_contig, intervals - written)):
+                # Log-normal lengths: mostly near interval_bp, a few much longer.
+                length = max(1, int(rng.lognormvariate(0, 0.75) * interval_bp))
+                length = min(length, interval_bp * 3)
+                pos += rng.randint(1, interval_bp)
+                fh.write("{}\t{}\t{}\n".format(contig, pos, pos + length))
+                pos += length
+                written += 1
+
+
+def bench_size(args, muse_args: List[str]) -> Dict:
+    """Run multi_muse once over a synthetic BED of `args.single` intervals."""
+    workdir = tempfile.mkdtemp(prefix="bench_run.", dir=args.scratch)
+    os.chdir(workdir)
+    write_inputs(workdir, args.single, args.interval_bp, args.seed)
+    run_args = process_argv(
+        [
+            "-f",
+            "ref.fa",
+            "-r",
+            "bench.bed",
+            "-t",
+            "t.bam",
+            "-n",
+            "n.bam",
+            "-c",
+            str(args.threads),
+            "--muse-binary",
+            "{} {}".format(shlex.quote(sys.executable), shlex.quote(FAKE_MUSE)),
+            # Keep shard outputs, to measure merge throughput over them.
+            "--scratch-dir",
+            "scratch",
+            "--keep-scratch",
+        ]
+        + muse_args
+    )
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    cpu = usage.ru_utime + usage.ru_stime
+    start = time.time()
+    run(run_args)
+    wall = time.time() - start
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+
+    records = sorted(load_manifest(run_args.manifest).values(), key=lambda r: r.index)
+    durations = [record.duration for record in records]
+    ideal = max(sum(durations) / args.threads, max(durations))
+
+    outputs = [pathlib.Path(record.output) for record in records]
+    size = sum(output.stat().st_size for output in outputs)
+    merge_start = time.time()
+    with open("bench_merge.MuSE.txt", "wb") as fh:
+        merge_files(outputs, fh)
+    merge_time = time.time() - merge_start
+
+    if not args.keep:
+        shutil.rmtree(workdir)
+    return dict(
+        intervals=args.single,
+        calls=len(records),
+        threads=args.threads,
+        wall_s=round(wall, 3),
+        ideal_s=round(ideal, 3),
+        efficiency=round(ideal / wall, 3),
+        overhead_ms=round((wall - ideal) * args.threads / len(records) * 1000, 2),
+        cpu_s=round(usage.ru_utime + usage.ru_stime - cpu, 3),
+        merge_mb=round(size / 1e6, 2),
+        merge_mb_s=round(size / 1e6 / max(merge_time, 1e-6), 1),
+        # ru_maxrss is in kilobytes on Linux.
+        peak_rss_mb=round(usage.ru_maxrss / 1024, 1),
+    )
+
+
+def regressions(results: List[Dict], baseline: List[Dict], tolerance: float):
+    """Yield a message for each metric worse than baseline by over `tolerance`."""
+    base_by_size = {row["intervals"]: row for row in baseline}
+    for row in results:
+        base = base_by_size.get(row["intervals"])
+        if not base:
+            continue
+        for metric in COMPARED:
+            if metric in HIGHER_IS_BETTER:
+                worse = row[metric] < base[metric] * (1 - tolerance)
+            else:
+                worse = row[metric] > base[metric] * (1 + tolerance)
+            if worse:
+                yield "{} intervals: {} {} vs baseline {}".format(
+                    row["intervals"], metric, row[metric], base[metric]
+                )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", default="10,100,1000,10000")
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--interval-bp", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--scratch", default=None, help="Parent of scratch dirs.")
+    parser.add_argument("--keep", action="store_true", help="Keep scratch dirs.")
+    parser.add_argument("--save", default=None, help="Write results as JSON lines.")
+    parser.add_argument("--baseline", default=None, help="JSON lines to compare to.")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--single", type=int, default=None, help=argparse.SUPPRESS)
+    args, muse_args = parser.parse_known_args()
+
+    if args.single:
+        # Silence per-shard logging; warnings and errors still show.
+        logging.getLogger("muse_tool").setLevel(logging.WARNING)
+        print(json.dumps(bench_size(args, muse_args)))
+        return 0
+
+    forwarded = [
+        "--threads",
+        str(args.threads),
+        "--interval-bp",
+        str(args.interval_bp),
+        "--seed",
+        str(args.seed),
+    ]
+    if args.scratch:
+        forwarded += ["--scratch", args.scratch]
+    if args.keep:
+        forwarded.append("--keep")
+    results = []
+    for size in (int(size) for size in args.sizes.split(",")):
+        out = subprocess.check_output(
+            [sys.executable, os.path.abspath(__file__), "--single", str(size)]
+            + forwarded
+            + muse_args
+        )
+        row = json.loads(out.decode().strip().splitlines()[-1])
+        results.append(row)
+        print(row, flush=True)
+
+    if args.save:
+        with open(args.save, "w") as fh:
+            fh.writelines(json.dumps(row) + "\n" for row in results)
+    if args.baseline:
+        with open(args.baseline, "r") as fh:
+            baseline = [json.loads(line) for line in fh if line.strip()]
+        failed = list(regressions(results, baseline, args.tolerance))
+        for message in failed:
+            print("REGRESSION:", message, file=sys.stderr)
+        return 1 if failed else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Stand-in for `MuSE call`, for benchmarking the orchestration around it.
+
+Accepts the `call` arguments multi_muse passes, spends time in proportion
+to the number of bp in its region(s) and writes a `<output>.MuSE.txt`
+with MuSE-like headers and records. Tunable through the environment:
+
+    FAKE_MUSE_BP_PER_S     bp processed per second (default 50000000)
+    FAKE_MUSE_STARTUP_S    fixed cost per call, e.g. reference load (default 0)
+    FAKE_MUSE_MODE         "sleep", "cpu" to busy-loop instead, or "work" to do
+                           a fixed amount of work over a 4 MiB working set,
+                           so contention for cores shows in the wall time
+                           (default sleep)
+    FAKE_MUSE_WORK_PER_S   "work" passes over the working set per second of
+                           nominal time (default 1000)
+    FAKE_MUSE_RECORDS_PER_MB  records written per Mbp of region (default 200)
+    FAKE_MUSE_FAIL         fail calls whose output name is in this
+                           comma-separated list
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+HEADER = (
+    "##MuSE_Version=v1.0rc_submission_c039ffa\n"
+    "##reference={reference}\n"
+    "##tumor={tumor}\n"
+    "##normal={normal}\n"
+    "#CHROM\tPOS\tREF\tALT\tTUMOR_REF\tTUMOR_ALT\tNORMAL_REF\tNORMAL_ALT\tPI\n"
+)
+
+WORKING_SET = 4 << 20
+
+
+def parse_region(region: str):
+    chrom, span = region.rsplit(":", 1)
+    start, end = span.split("-")
+    return chrom, int(start), int(end)
+
+
+def spend(seconds: float, mode: str):
+    if mode == "cpu":
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            pass
+    elif mode == "work":
+        buf = bytearray(WORKING_SET)
+        passes = seconds * float(os.environ.get("FAKE_MUSE_WORK_PER_S", 1000))
+        for _ in range(int(passes)):
+            sum(buf[::64])
+    elif seconds > 0:
+        time.sleep(seconds)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("command", choices=("call",))
+    parser.add_argument("-f", dest="reference", required=True)
+    parser.add_argument("-r", dest="region", default=None)
+    parser.add_argument("-l", dest="region_list", default=None)
+    parser.add_argument("-O", dest="output", required=True)
+    parser.add_argument("bams", nargs=2)
+    args = parser.parse_args()
+
+    if args.region:
+        regions = [args.region]
+    else:
+        with open(args.region_list, "r") as fh:
+            regions = fh.read().split()
+    intervals = [parse_region(region) for region in regions]
+    bp = sum(end - start for _, start, end in intervals)
+
+    env = os.environ
+    spend(
+        float(env.get("FAKE_MUSE_STARTUP_S", 0))
+        + bp / float(env.get("FAKE_MUSE_BP_PER_S", 5e7)),
+        env.get("FAKE_MUSE_MODE", "sleep"),
+    )
+    if args.output in env.get("FAKE_MUSE_FAIL", "").split(","):
+        print("[ERROR] fake failure for {}".format(args.output), file=sys.stderr)
+        return 1
+
+    density = float(env.get("FAKE_MUSE_RECORDS_PER_MB", 200)) / 1e6
+    # Seeded by region, so reruns of a shard write identical outputs.
+    rng = random.Random(",".join(regions))
+    with open(args.output + ".MuSE.txt", "w") as fh:
+        fh.write(
+            HEADER.format(
+                reference=args.reference, tumor=args.bams[0], normal=args.bams[1]
+            )
+        )
+        for chrom, start, end in intervals:
+            count = int((end - start) * density + rng.random())
+            for pos in sorted(rng.sample(range(start + 1, end + 1), count)):
+                ref, alt = rng.sample("ACGT", 2)
+                fh.write(
+                    "{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{:.3g}\n".format(
+                        chrom,
+                        pos,
+                        ref,
+                        alt,
+                        rng.randint(5, 80),
+                        rng.randint(0, 40),
+                        rng.randint(5, 80),
+                        rng.randint(0, 2),
+                        rng.random(),
+                    )
+                )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
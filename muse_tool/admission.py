@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Memory-aware admission control for concurrent MuSE calls.
+
+A new call is admitted only while the RSS of the calls already running,
+plus the predicted RSS of one more, fits under a memory budget, and while
+the host or cgroup is not under memory pressure.
+"""
+import logging
+import re
+from typing import Dict, Optional
+
+from muse_tool.dispatch import ChildRegistry
+
+logger = logging.getLogger(__name__)
+
+CGROUP_V2_LIMIT = "/sys/fs/cgroup/memory.max"
+CGROUP_V2_PRESSURE = "/sys/fs/cgroup/memory.pressure"
+CGROUP_V1_LIMIT = "/sys/fs/cgroup/memory/memory.limit_in_bytes"
+PROC_PRESSURE = "/proc/pressure/memory"
+
+# cgroup v1 reports "no limit" as a page-rounded LONG_MAX.
+UNLIMITED = 1 << 60
+
+SIZE_SUFFIXES = {"": 1, "K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}
+
+
+def parse_size(size: str) -> int:
+    """Parse a byte count such as "512M" or "16G".
+    Raises:
+        ValueError: not a size
+    """
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([KMGT]?)B?\s*", size.upper())
+    if not match:
+        raise ValueError("Invalid size: {}".format(size))
+    return int(float(match.group(1)) * SIZE_SUFFIXES[match.group(2)])
+
+
+def read_meminfo() -> Dict[str, int]:
+    """Parse /proc/meminfo into bytes, empty if unavailable."""
+    meminfo = {}
+    try:
+        with open("/proc/meminfo", "r") as fh:
+            for line in fh:
+                key, value = line.split(":", 1)
+                fields = value.split()
+                multiplier = 1024 if fields[1:] == ["kB"] else 1
+                meminfo[key] = int(fields[0]) * multiplier
+    except (OSError, ValueError, IndexError):
+        pass
+    return meminfo
+
+
+def read_cgroup_limit() -> Optional[int]:
+    """Memory limit of this cgroup in bytes, None if unlimited or unknown."""
+    for path in (CGROUP_V2_LIMIT, CGROUP_V1_LIMIT):
+        try:
+            with open(path, "r") as fh:
+                value = fh.read().strip()
+        except OSError:
+            continue
+        if value == "max" or int(value) >= UNLIMITED:
+            return None
+        return int(value)
+    return None
+
+
+def read_pressure() -> Optional[float]:
+    """Memory PSI "some avg10" of the cgroup or host, None if unavailable."""
+    for path in (CGROUP_V2_PRESSURE, PROC_PRESSURE):
+        try:
+            with open(path, "r") as fh:
+                for line in fh:
+                    if line.startswith("some"):
+                        return float(line.split("avg10=")[1].split()[0])
+        except (OSError, IndexError, ValueError):
+            continue
+    return None
+
+
+def read_rss(pid: int) -> int:
+    """Resident set size of a process in bytes, 0 if it has gone."""
+    try:
+        with open("/proc/{}/status".format(pid), "r") as fh:
+            for line in fh:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return 0
+
+
+def resolve_budget(budget: str) -> int:
+    """Memory budget in bytes from a size, or "cgroup" for the cgroup limit.
+
+    Without a cgroup limit, "cgroup" falls back to the host's MemTotal.
+    """
+    if budget != "cgroup":
+        return parse_size(budget)
+    limit = read_cgroup_limit() or read_meminfo().get("MemTotal")
+    if not limit:
+        raise ValueError("Could not read a cgroup or host memory limit")
+    return limit
+
+
+class MemoryAdmission:
+    """Admit new children only while their predicted memory fits the budget.
+
+    Each child's predicted RSS is the largest RSS observed for any child so
+    far, or `initial_estimate` before the first observation. Running
+    children count for the larger of their current and predicted RSS.
+    Admission also backs off while MemAvailable drops below that prediction,
+    or while the memory PSI "some avg10" exceeds `max_pressure` percent.
+
+    `throttled` counts the times dispatch was held back, however many
+    admission checks it was refused until the next admission, and
+    `peak_rss` is the largest RSS actually observed.
+    """
+
+    def __init__(
+        self,
+        budget: int,
+        registry: ChildRegistry,
+        initial_estimate: int,
+        max_pressure: float = 10.0,
+        poll_interval: float = 1.0,
+    ):
+        self.budget = budget
+        self.registry = registry
+        self.predicted = initial_estimate
+        self.max_pressure = max_pressure
+        self.poll_interval = poll_interval
+        self.throttled = 0
+        self.peak_rss = 0
+        self.holding = False
+
+    def observe(self, in_flight: int) -> int:
+        """Memory committed to in-flight children, updating the prediction.
+
+        A child still ramping up, or not spawned yet, counts for its
+        predicted RSS rather than what it uses so far.
+        """
+        rss = [read_rss(pid) for pid in self.registry.pids()]
+        if rss:
+            self.peak_rss = max(self.peak_rss, max(rss))
+            self.predicted = max(self.predicted, self.peak_rss)
+        unseen = max(0, in_flight - len(rss))
+        return sum(max(r, self.predicted) for r in rss) + unseen * self.predicted
+
+    def observe_peak(self, max_rss: int):
+        """Feed in a finished child's peak RSS, in bytes."""
+        self.peak_rss = max(self.peak_rss, max_rss)
+        self.predicted = max(self.predicted, self.peak_rss)
+
+    def admit(self, in_flight: int) -> bool:
+        """Whether one more child may start alongside `in_flight` others."""
+        if in_flight == 0:
+            self.holding = False
+            return True
+        used = self.observe(in_flight)
+        reason = None
+        if used + self.predicted > self.budget:
+            reason = "budget"
+        elif read_meminfo().get("MemAvailable", self.predicted) < self.predicted:
+            reason = "MemAvailable"
+        else:
+            pressure = read_pressure()
+            if pressure is not None and pressure > self.max_pressure:
+                reason = "pressure"
+        if reason:
+            if not self.holding:
+                self.throttled += 1
+                self.holding = True
+            logger.debug(
+                "Holding back: %s (%s running, %s MiB used, %s MiB predicted)",
+                reason,
+                in_flight,
+                used >> 20,
+                self.predicted >> 20,
+            )
+            return False
+        self.holding = False
+        return True
+
+
+# __END__
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+asyncio execution engine for multi_muse.
+
+Children are awaited on a single event loop instead of tying up one
+thread each in `Popen.communicate`. Same contract as
+`multi_muse.tpe_submit_commands`.
+"""
+import asyncio
+import functools
+import logging
+import shlex
+import signal
+import time
+from typing import Any, Callable, List, Optional
+
+from muse_tool.dispatch import (
+    ChildRegistry,
+    CommandQueue,
+    CommandTimeoutError,
+    MakespanTimer,
+    PopenReturnNT,
+    next_wakeup,
+    track_child,
+)
+from muse_tool.shard_logs import read_tail
+
+logger = logging.getLogger(__name__)
+
+
+async def terminate_process(proc: asyncio.subprocess.Process, grace: float):
+    """Send SIGTERM, then SIGKILL if the child has not exited after `grace`."""
+    if proc.returncode is not None:
+        return
+    try:
+        proc.terminate()
+        await asyncio.wait_for(proc.wait(), grace)
+    except asyncio.TimeoutError:
+        proc.kill()
+        await proc.wait()
+    except ProcessLookupError:
+        pass
+
+
+async def async_commands_pipe(
+    cmd: str,
+    timeout: Optional[float],
+    grace: float = 10,
+    registry: Optional[ChildRegistry] = None,
+) -> PopenReturnNT:
+    """Run given command as an asyncio subprocess.
+    Accepts:
+        cmd (str): Command string
+        timeout (float): Max time for command to run, in seconds
+        grace (float): Seconds between SIGTERM and SIGKILL on timeout or cancel
+        registry (ChildRegistry): Registers the child while it runs
+    Returns:
+        Tuple of decoded stdout and stderr
+    Raises:
+        CommandTimeoutError: timeout exceeded
+        ValueError: non-zero exit
+    """
+    proc = await asyncio.create_subprocess_exec(
+        *shlex.split(cmd),
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    with track_child(registry, cmd, proc):
+        try:
+            stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout)
+        except asyncio.TimeoutError:
+            await terminate_process(proc, grace)
+            raise CommandTimeoutError("Timed out after {} seconds".format(timeout))
+        except asyncio.CancelledError:
+            await terminate_process(proc, grace)
+            raise
+
+    if proc.returncode != 0:
+        raise ValueError(stderr.decode())
+
+    return PopenReturnNT(stdout=stdout.decode(), stderr=stderr.decode())
+
+
+async def async_commands_logfile(
+    cmd: str,
+    timeout: Optional[float],
+    log_path: str,
+    tail_bytes: int = 4096,
+    grace: float = 10,
+    registry: Optional[ChildRegistry] = None,
+) -> PopenReturnNT:
+    """Run given command as an asyncio subprocess, writing output to a log.
+    Accepts:
+        cmd (str): Command string
+        timeout (float): Max time for command to run, in seconds
+        log_path (str): File to append the child's stdout and stderr to
+        tail_bytes (int): Bytes of the log to include in errors
+        grace (float): Seconds between SIGTERM and SIGKILL on timeout or cancel
+        registry (ChildRegistry): Registers the child while it runs
+    Returns:
+        Empty stdout and stderr, which are in the log file
+    Raises:
+        CommandTimeoutError: timeout exceeded
+        ValueError: non-zero exit
+    """
+    with open(log_path, "ab") as log_fh:
+        proc = await asyncio.create_subprocess_exec(
+            *shlex.split(cmd), stdout=log_fh, stderr=asyncio.subprocess.STDOUT,
+        )
+    with track_child(registry, cmd, proc):
+        try:
+            await asyncio.wait_for(proc.wait(), timeout)
+        except asyncio.TimeoutError:
+            await terminate_process(proc, grace)
+            raise CommandTimeoutError(read_tail(log_path, tail_bytes))
+        except asyncio.CancelledError:
+            await terminate_process(proc, grace)
+            raise
+
+    if proc.returncode != 0:
+        raise ValueError(read_tail(log_path, tail_bytes))
+
+    return PopenReturnNT(stdout="", stderr="")
+
+
+async def _dispatch(
+    queue: CommandQueue,
+    thread_count: int,
+    timeout: Optional[float],
+    fn: Callable,
+    on_success: Optional[Callable[[Any, Any, float], None]],
+    admission: Any,
+):
+    timer = MakespanTimer()
+    tasks = {}
+    started = {}
+
+    def dispatch():
+        while len(tasks) < thread_count and queue.ready():
+            if admission and not admission.admit(len(tasks)):
+                break
+            cmd = queue.pop()
+            task = asyncio.ensure_future(fn(cmd, timeout))
+            tasks[task] = cmd
+            started[task] = time.time()
+        timer.check_idle(queue, len(tasks), thread_count)
+
+    try:
+        dispatch()
+        while tasks or queue:
+            if not tasks:
+                await asyncio.sleep(queue.next_delay())
+                dispatch()
+                continue
+            done, _ = await asyncio.wait(
+                tasks,
+                timeout=next_wakeup(queue, len(tasks), thread_count, admission),
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            now = time.time()
+            finished = [
+                (tasks.pop(task), task, now - started.pop(task)) for task in done
+            ]
+            for cmd, task, _ in finished:
+                if task.exception() is not None:
+                    queue.fail(cmd, task.exception())
+            dispatch()
+            for cmd, task, duration in finished:
+                if task.exception() is None:
+                    result = task.result()
+                    if result.stdout:
+                        logger.info(result.stdout)
+                    if result.stderr:
+                        logger.info(result.stderr)
+                    if on_success:
+                        on_success(cmd, result, duration)
+            if queue.aborted:
+                # Cancel in-flight tasks, terminating their children.
+                break
+    finally:
+        # Cancelling a task terminates its child, see async_commands_pipe.
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+    timer.log()
+
+
+def aio_submit_commands(
+    cmds: List[Any],
+    thread_count: int,
+    timeout: Optional[float],
+    fn: Optional[Callable] = None,
+    on_success: Optional[Callable[[Any, Any, float], None]] = None,
+    retries: int = 0,
+    backoff: float = 0,
+    on_timeout: Optional[Callable[[Any], List[Any]]] = None,
+    grace: float = 10,
+    admission: Any = None,
+    max_failures: Optional[int] = None,
+) -> list:
+    """Run commands as concurrent asyncio subprocesses.
+
+    Same contract as `multi_muse.tpe_submit_commands`, with at most
+    `thread_count` children in flight. On SIGTERM or SIGINT every
+    in-flight child is terminated (SIGTERM, then SIGKILL after `grace`
+    seconds) before returning.
+    Accepts:
+        cmds (List[str]): List of commands
+        thread_count (int): Max concurrent children
+        timeout (float): Max time to run each command, in seconds
+        fn (Callable): Coroutine function run for each element of cmds,
+            default async_commands_pipe
+        on_success (Callable): Called with (cmd, result, duration)
+        retries (int): Max retries per failed command
+        backoff (float): Base retry delay, in seconds
+        on_timeout (Callable): Returns replacement commands for a timed out
+            command, or an empty list to retry it as is.
+        grace (float): Seconds between SIGTERM and SIGKILL
+        admission: Optional admission control, see tpe_submit_commands
+        max_failures (int): Failures tolerated before cancelling pending
+            commands and terminating in-flight children, None for no limit
+    Returns:
+        list of commands which raised exceptions
+    Raises:
+        ValueError: run was interrupted by a signal
+    """
+    fn = fn or functools.partial(async_commands_pipe, grace=grace)
+    queue = CommandQueue(cmds, retries, backoff, on_timeout, max_failures)
+
+    async def main():
+        task = asyncio.ensure_future(
+            _dispatch(queue, thread_count, timeout, fn, on_success, admission)
+        )
+        loop = asyncio.get_event_loop()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signum, task.cancel)
+        try:
+            await task
+        finally:
+            for signum in (signal.SIGTERM, signal.SIGINT):
+                loop.remove_signal_handler(signum)
+
+    try:
+        asyncio.run(main())
+    except asyncio.CancelledError:
+        raise ValueError("Interrupted, in-flight commands were terminated.")
+    return queue.exceptions
+
+
+# __END__
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+Coverage estimates from a BAM's index, without decompressing the BAM.
+
+A BAI index lists, for each bin of a reference, the chunks of the BAM
+(ranges of virtual offsets) holding the reads in that bin. Reads that fit
+in one 16 kbp window, nearly all short reads, are binned by window, so the
+summed chunk sizes of a window's bin approximate its compressed bytes of
+reads. The index's per-reference read counts turn bytes into reads.
+"""
+import gzip
+import os
+import struct
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from muse_tool.bgzf import FIRST_LEVEL_BIN, LINEAR_SHIFT
+from muse_tool.intervals import BedInterval
+
+# Pseudo-bin holding each reference's offset span and read counts.
+PSEUDO_BIN = 37450
+
+# Typical BAM compression ratio, for distances within one BGZF block.
+BLOCK_COMPRESSION = 0.3
+
+# Largest compressed BGZF block.
+MAX_BLOCK_SIZE = 1 << 16
+
+
+class ReferenceIndex(NamedTuple):
+    windows: Dict[int, float]
+    span: Optional[Tuple[int, int]] = None
+    mapped: int = 0
+    # Virtual offset of the first read overlapping each 16 kbp window.
+    linear: Tuple[int, ...] = ()
+
+
+class BamIndex(NamedTuple):
+    """BAI index of a BAM, keyed by the BAM's reference names."""
+
+    path: str
+    references: Dict[str, ReferenceIndex]
+
+
+class CoverageEstimate(NamedTuple):
+    bytes: float
+    reads: float
+
+
+def read_bam_references(bam_path: str) -> List[Tuple[str, int]]:
+    """Reference names and lengths from a BAM header.
+    Raises:
+        ValueError: not a BAM file
+    """
+
+    def read(fh, size: int) -> bytes:
+        data = fh.read(size)
+        if len(data) != size:
+            raise ValueError("Truncated BAM header: {}".format(bam_path))
+        return data
+
+    try:
+        with gzip.open(bam_path, "rb") as fh:
+            if fh.read(4) != b"BAM\1":
+                raise ValueError("Not a BAM file: {}".format(bam_path))
+            (l_text,) = struct.unpack("<i", read(fh, 4))
+            read(fh, l_text)
+            (n_ref,) = struct.unpack("<i", read(fh, 4))
+            references = []
+            for _ in range(n_ref):
+                (l_name,) = struct.unpack("<i", read(fh, 4))
+                name = read(fh, l_name).rstrip(b"\0").decode()
+                (l_ref,) = struct.unpack("<i", read(fh, 4))
+                references.append((name, l_ref))
+    except (OSError, EOFError) as e:
+        raise ValueError("Not a BAM file: {}: {}".format(bam_path, e))
+    return references
+
+
+def find_bai(bam_path: str) -> str:
+    """Path of the index of a BAM, `<bam>.bai` or `<bam minus .bam>.bai`.
+    Raises:
+        ValueError: no index found
+    """
+    candidates = [bam_path + ".bai"]
+    if bam_path.endswith(".bam"):
+        candidates.append(bam_path[: -len(".bam")] + ".bai")
+    for candidate in candidates:
+        if os.path.exists(candidate):
+            return candidate
+    raise ValueError("No .bai index for {}".format(bam_path))
+
+
+def read_bai(bai_path: str) -> List[ReferenceIndex]:
+    """Compressed bytes per 16 kbp window, offset span, mapped reads and
+    linear index of each reference in a BAI index."""
+    with open(bai_path, "rb") as fh:
+        data = fh.read()
+    if data[:4] != b"BAI\1":
+        raise ValueError("Not a BAI index: {}".format(bai_path))
+    (n_ref,) = struct.unpack_from("<i", data, 4)
+    pos = 8
+    references = []
+    for _ in range(n_ref):
+        (n_bin,) = struct.unpack_from("<i", data, pos)
+        pos += 4
+        windows: Dict[int, float] = {}
+        span, mapped = None, 0
+        for _ in range(n_bin):
+            bin_id, n_chunk = struct.unpack_from("<Ii", data, pos)
+            pos += 8
+            chunks = struct.unpack_from("<{}Q".format(2 * n_chunk), data, pos)
+            pos += 16 * n_chunk
+            if bin_id == PSEUDO_BIN and n_chunk == 2:
+                span, mapped = chunks[:2], chunks[2]
+            elif bin_id >= FIRST_LEVEL_BIN:
+                windows[bin_id - FIRST_LEVEL_BIN] = sum(
+                    voffset_distance(start, end)
+                    for start, end in zip(chunks[::2], chunks[1::2])
+                )
+        (n_intv,) = struct.unpack_from("<i", data, pos)
+        linear = struct.unpack_from("<{}Q".format(n_intv), data, pos + 4)
+        pos += 4 + 8 * n_intv
+        references.append(ReferenceIndex(windows, span, mapped, linear))
+    return references
+
+
+def load_bam_index(bam_path: str) -> BamIndex:
+    """Read the reference names of a BAM and its BAI index."""
+    names = [name for name, _ in read_bam_references(bam_path)]
+    references = read_bai(find_bai(bam_path))
+    if len(references) != len(names):
+        raise ValueError(
+            "{} references in {}, but {} in its index".format(
+                len(names), bam_path, len(references)
+            )
+        )
+    return BamIndex(bam_path, dict(zip(names, references)))
+
+
+def voffset_distance(start: int, end: int) -> float:
+    """Approximate compressed bytes between two virtual offsets."""
+    if start >> 16 == end >> 16:
+        return max(0, (end & 0xFFFF) - (start & 0xFFFF)) * BLOCK_COMPRESSION
+    return max(0, (end >> 16) - (start >> 16))
+
+
+def estimate_coverage(index: BamIndex, interval: BedInterval) -> CoverageEstimate:
+    """Estimate compressed bytes and reads of a BAM within an interval.
+
+    Windows are pro-rated by the part of them the interval covers, so the
+    estimate has 16 kbp resolution: an interval only estimates zero if its
+    windows hold no reads at all.
+    """
+    reference = index.references.get(interval.chrom)
+    if reference is None or interval.length <= 0:
+        return CoverageEstimate(0, 0)
+    first = interval.start >> LINEAR_SHIFT
+    last = (interval.end - 1) >> LINEAR_SHIFT
+    size = sum(reference.windows.get(w, 0) for w in range(first, last + 1))
+    size *= interval.length / ((last - first + 1) << LINEAR_SHIFT)
+    reads = 0.0
+    if reference.span and reference.mapped:
+        total = voffset_distance(*reference.span)
+        reads = size * reference.mapped / total if total else 0.0
+    return CoverageEstimate(size, reads)
+
+
+def byte_range(index: BamIndex, interval: BedInterval) -> Optional[Tuple[int, int]]:
+    """File offset and length of the BAM blocks holding reads in an interval.
+
+    From the linear index: from the first read overlapping the interval's
+    first 16 kbp window, to the end of the block holding the first read
+    of a later window. None if the index has no reads there.
+    """
+    reference = index.references.get(interval.chrom)
+    if reference is None or interval.length <= 0:
+        return None
+    linear = reference.linear
+    first = interval.start >> LINEAR_SHIFT
+    last = min((interval.end - 1) >> LINEAR_SHIFT, len(linear) - 1)
+    begin = next((linear[w] for w in range(first, last + 1) if linear[w]), None)
+    if begin is None:
+        return None
+    end = next(
+        (linear[w] for w in range(last + 1, len(linear)) if linear[w] > begin),
+        reference.span[1] if reference.span else begin,
+    )
+    return begin >> 16, (end >> 16) - (begin >> 16) + MAX_BLOCK_SIZE
+
+
+def weigh_interval(
+    interval: BedInterval,
+    indexes: List[BamIndex],
+    weight: bool = True,
+    min_reads: Optional[float] = None,
+) -> Tuple[Optional[BedInterval], List[CoverageEstimate]]:
+    """Weight an interval by estimated coverage, see weigh_by_coverage.
+    Returns:
+        The weighted interval, or None if it is skipped, and its estimates
+    """
+    estimates = [estimate_coverage(index, interval) for index in indexes]
+    if min_reads is not None and all(e.reads < min_reads for e in estimates):
+        return None, estimates
+    if weight and interval.length > 0:
+        size = sum(estimate.bytes for estimate in estimates)
+        interval = interval._replace(weight=interval.weight * size / interval.length)
+    return interval, estimates
+
+
+def weigh_by_coverage(
+    intervals: Iterable[BedInterval],
+    indexes: List[BamIndex],
+    weight: bool = True,
+    min_reads: Optional[float] = None,
+) -> Tuple[List[BedInterval], List[Tuple[BedInterval, List[CoverageEstimate]]]]:
+    """Weight intervals by estimated coverage, and drop uncovered ones.
+    Accepts:
+        intervals (Iterable[BedInterval]): Intervals to estimate
+        indexes (List[BamIndex]): Indexes of the BAMs called together
+        weight (bool): Scale each interval's weight so its cost is the
+            estimated compressed bytes in all BAMs
+        min_reads (float): Skip intervals with fewer estimated reads than
+            this in every BAM
+    Returns:
+        Kept intervals, and skipped intervals with their estimates
+    """
+    kept, skipped = [], []
+    for interval in intervals:
+        weighted, estimates = weigh_interval(interval, indexes, weight, min_reads)
+        if weighted is None:
+            skipped.append((interval, estimates))
+        else:
+            kept.append(weighted)
+    return kept, skipped
+
+
+# __END__
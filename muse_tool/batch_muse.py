@@ -0,0 +1,390 @@
+#!/usr/bin/env python3
+"""
+Call many tumor/normal pairs over the same reference and BED on one pool.
+
+Rather than one multi_muse run per pair, each with its own idle tail and
+startup costs, every pair x shard call is scheduled on a single pool of
+workers. Pairs take turns in the dispatch order, so each gets a fair share
+of the workers. Once a pair's last shard completes, its outputs are merged
+on a separate thread, so dispatch carries on, and the merged output is
+published atomically. Shard outputs are written to a scratch workspace,
+removed pair by pair as they are merged.
+"""
+import argparse
+import concurrent.futures
+import functools
+import logging
+import os
+import pathlib
+import shutil
+import sys
+import time
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+from muse_tool.bgzf import cpu_count
+from muse_tool.dispatch import ChildRegistry, parse_failure_policy
+from muse_tool.intervals import IntervalStore, read_fai
+from muse_tool.merge import merge_files, open_merged
+from muse_tool.multi_muse import (
+    format_shard_commands,
+    order_longest_first,
+    setup_logger,
+    shard_output_path,
+    subprocess_commands_logfile,
+    subprocess_commands_pipe,
+    tpe_submit_commands,
+    write_region_list,
+)
+from muse_tool.plan import Shard, bisect_shard, plan_shards, shards_from_intervals
+from muse_tool.preflight import preflight
+from muse_tool.workspace import SHARD_PREFIX, Workspace, publish_indexed
+
+logger = logging.getLogger("muse_tool.batch_muse")
+
+
+class BatchPair(NamedTuple):
+    """One line of a batch manifest."""
+
+    tumor_bam: str
+    normal_bam: str
+    output: str
+
+
+def read_batch(path: str) -> List[BatchPair]:
+    """Read a batch manifest of tab separated tumor BAM, normal BAM and
+    merged output path, one pair per line. Blank and `#` lines are skipped.
+    Raises:
+        ValueError: malformed line or output listed twice
+    """
+    pairs: List[BatchPair] = []
+    with open(path, "r") as fh:
+        for lineno, line in enumerate(fh, 1):
+            if not line.strip() or line.startswith("#"):
+                continue
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) != 3:
+                raise ValueError(
+                    "{}:{}: expected tumor, normal and output columns".format(
+                        path, lineno
+                    )
+                )
+            pairs.append(BatchPair(*fields))
+    outputs = [pair.output for pair in pairs]
+    if len(set(outputs)) != len(outputs):
+        raise ValueError("{}: an output is listed twice".format(path))
+    return pairs
+
+
+def round_robin(queues: Iterable[List]) -> List:
+    """Interleave lists, one item from each in turn."""
+    queues = [list(queue) for queue in queues]
+    interleaved = []
+    for i in range(max(map(len, queues), default=0)):
+        interleaved.extend(queue[i] for queue in queues if i < len(queue))
+    return interleaved
+
+
+class PairRun:
+    """Shard commands of one pair, and which of their outputs are pending."""
+
+    def __init__(self, index: int, pair: BatchPair, workdir: str):
+        self.index = index
+        self.pair = pair
+        self.workdir = workdir
+        self.outputs: List[pathlib.Path] = []
+        self.pending: set = set()
+        self.start = time.time()
+
+    @property
+    def name(self) -> str:
+        return "pair{}".format(self.index)
+
+    def add(self, shards: List[Shard], muse_binary: str, reference_path: str):
+        """Commands for shards, whose outputs are merged in shard order."""
+        for shard in shards:
+            if len(shard.intervals) > 1:
+                write_region_list(shard, self.workdir)
+        return list(
+            format_shard_commands(
+                shards,
+                reference_path,
+                self.pair.tumor_bam,
+                self.pair.normal_bam,
+                muse_binary,
+                self.workdir,
+            )
+        )
+
+    def complete(self, output: pathlib.Path) -> bool:
+        """Mark an output complete, and return whether the pair is done."""
+        self.pending.discard(output)
+        return not self.pending
+
+    def replace(self, output: pathlib.Path, outputs: List[pathlib.Path]):
+        i = self.outputs.index(output)
+        self.outputs[i : i + 1] = outputs
+        self.pending.discard(output)
+        self.pending.update(outputs)
+
+
+def get_args(argv: Optional[List[str]] = None):
+    """
+    Loads the parser.
+    """
+    parser = argparse.ArgumentParser(
+        description=(
+            "Run `MuSE call` for many tumor/normal pairs on one pool of workers."
+        )
+    )
+    required = parser.add_argument_group("Required input parameters")
+    required.add_argument("-f", "--reference_path", required=True)
+    required.add_argument("-r", "--interval_bed_path", required=True)
+    required.add_argument(
+        "-b",
+        "--batch",
+        required=True,
+        help="TSV of tumor BAM, normal BAM and merged output path per pair.",
+    )
+    required.add_argument("-c", "--thread_count", type=int, required=True)
+    optional = parser.add_argument_group("Optional parameters")
+    optional.add_argument("--muse-binary", default="muse")
+    optional.add_argument(
+        "--no-preflight",
+        action="store_true",
+        help="Skip checking every pair's inputs before starting MuSE calls.",
+    )
+    optional.add_argument(
+        "--timeout",
+        type=int,
+        default=None,
+        help="Max time for command to run, in seconds.",
+    )
+    optional.add_argument(
+        "--schedule",
+        choices=("bed", "ljf"),
+        default="bed",
+        help="Order of each pair's shards: BED order, or longest first.",
+    )
+    optional.add_argument("--weight-column", type=int, default=None)
+    optional.add_argument(
+        "--shards-per-pair",
+        type=int,
+        default=None,
+        help=(
+            "Re-shard the BED into this many equal-bp shards per pair, using "
+            "the reference .fai. Default: one shard per BED line."
+        ),
+    )
+    optional.add_argument("--shard-padding", type=int, default=1000)
+    optional.add_argument("--retries", type=int, default=0)
+    optional.add_argument("--retry-backoff", type=float, default=30)
+    optional.add_argument(
+        "--failure-policy",
+        type=parse_failure_policy,
+        default="run-all",
+        help=(
+            "run-all, fail-fast, or a number of failed calls tolerated before "
+            "cancelling the rest of the batch."
+        ),
+    )
+    optional.add_argument(
+        "--bisect-depth",
+        type=int,
+        default=0,
+        help="Split a shard that hits --timeout in half, up to this many times.",
+    )
+    optional.add_argument(
+        "--scratch-dir",
+        "--workdir",
+        default=None,
+        help=(
+            "Directory for each pair's shard outputs, in shard-pair<N> "
+            "subdirectories. Default: a new directory under $TMPDIR."
+        ),
+    )
+    optional.add_argument(
+        "--keep-scratch",
+        action="store_true",
+        help="Keep the scratch directory after a successful batch.",
+    )
+    optional.add_argument(
+        "--log-dir",
+        default=None,
+        help="Write each call's output to <log-dir>/pair<N>.<shard>.log.",
+    )
+    optional.add_argument("--log-tail-bytes", type=int, default=4096)
+    optional.add_argument(
+        "--bgzf",
+        action="store_true",
+        help="Write BGZF compressed outputs, with a tabix index if sorted.",
+    )
+    optional.add_argument("--bgzf-threads", type=int, default=cpu_count())
+    return parser.parse_args(argv)
+
+
+def run(args) -> List[PairRun]:
+    """Call every pair, writing each pair's merged output once it is done.
+    Returns:
+        Pairs with failed or cancelled shards, whose outputs were not written
+    """
+    pairs = read_batch(args.batch)
+    intervals = IntervalStore.from_bed(args.interval_bed_path, args.weight_column)
+    if not args.no_preflight:
+        bams = [bam for pair in pairs for bam in (pair.tumor_bam, pair.normal_bam)]
+        preflight(args.reference_path, list(dict.fromkeys(bams)), intervals)
+    if args.shards_per_pair:
+        shards = plan_shards(
+            intervals,
+            read_fai(args.reference_path),
+            args.shards_per_pair,
+            args.shard_padding,
+        )
+    else:
+        shards = shards_from_intervals(intervals)
+    if args.schedule == "ljf":
+        shards = order_longest_first(shards, [shard.cost for shard in shards])
+    logger.info("Calling %s pairs x %s shards", len(pairs), len(shards))
+
+    runs: List[PairRun] = []
+    run_by_cmd: Dict[str, PairRun] = {}
+    shard_by_cmd: Dict[str, Shard] = {}
+    output_by_cmd: Dict[str, pathlib.Path] = {}
+
+    def add_commands(pair_run: PairRun, shards: List[Shard]) -> List[str]:
+        cmds = pair_run.add(shards, args.muse_binary, args.reference_path)
+        for cmd, shard in zip(cmds, shards):
+            run_by_cmd[cmd] = pair_run
+            shard_by_cmd[cmd] = shard
+            output_by_cmd[cmd] = shard_output_path(shard, pair_run.workdir)
+        return cmds
+
+    workspace = Workspace(args.scratch_dir)
+    logger.info("Scratch directory: %s", workspace.path)
+    queues = []
+    for index, pair in enumerate(pairs):
+        workdir = workspace.join("{}pair{}".format(SHARD_PREFIX, index))
+        os.makedirs(workdir, exist_ok=True)
+        pair_run = PairRun(index, pair, workdir)
+        cmds = add_commands(pair_run, shards)
+        pair_run.outputs = [
+            shard_output_path(shard, workdir)
+            for shard in sorted(shards, key=lambda shard: shard.index)
+        ]
+        pair_run.pending = set(pair_run.outputs)
+        runs.append(pair_run)
+        queues.append(cmds)
+
+    def merge(pair_run: PairRun):
+        start = time.time()
+        staged = os.path.join(pair_run.workdir, "merged")
+        with open_merged(staged, args.bgzf, args.bgzf_threads) as fh:
+            merged = merge_files(pair_run.outputs, fh)
+        publish_indexed(staged, pair_run.pair.output)
+        if not args.keep_scratch:
+            shutil.rmtree(pair_run.workdir)
+        logger.info(
+            "%s done after %s seconds, merged %s outputs into %s in %s seconds",
+            pair_run.name,
+            round(start - pair_run.start, 2),
+            merged,
+            pair_run.pair.output,
+            round(time.time() - start, 2),
+        )
+
+    # Merges run one at a time off the dispatcher thread, which keeps
+    # starting calls meanwhile.
+    merger = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+    merges: Dict[PairRun, concurrent.futures.Future] = {}
+
+    def on_success(cmd, result, duration):
+        pair_run = run_by_cmd[cmd]
+        if pair_run.complete(output_by_cmd[cmd]):
+            merges[pair_run] = merger.submit(merge, pair_run)
+
+    def on_timeout(cmd):
+        shard = shard_by_cmd[cmd]
+        if len(shard.part) >= args.bisect_depth:
+            return []
+        children = bisect_shard(shard, args.shard_padding)
+        if not children:
+            return []
+        pair_run = run_by_cmd[cmd]
+        child_commands = add_commands(pair_run, children)
+        pair_run.replace(
+            output_by_cmd[cmd], [output_by_cmd[child] for child in child_commands]
+        )
+        return child_commands
+
+    registry = ChildRegistry()
+    if args.log_dir:
+        os.makedirs(args.log_dir, exist_ok=True)
+
+        def runner(cmd, timeout):
+            log_path = os.path.join(
+                args.log_dir,
+                "{}.{}.log".format(run_by_cmd[cmd].name, shard_by_cmd[cmd].name),
+            )
+            return subprocess_commands_logfile(
+                cmd, timeout, log_path, args.log_tail_bytes, registry=registry
+            )
+
+    else:
+        runner = functools.partial(subprocess_commands_pipe, registry=registry)
+
+    with merger:
+        exceptions = tpe_submit_commands(
+            round_robin(queues),
+            args.thread_count,
+            args.timeout,
+            fn=runner,
+            on_success=on_success,
+            retries=args.retries,
+            backoff=args.retry_backoff,
+            on_timeout=on_timeout,
+            max_failures=args.failure_policy,
+            registry=registry,
+        )
+    failed_runs = {run_by_cmd[cmd] for cmd in exceptions}
+    for pair_run, future in merges.items():
+        if future.exception() is not None:
+            logger.error("%s merge failed: %s", pair_run.name, future.exception())
+            failed_runs.add(pair_run)
+    unfinished = [
+        pair_run
+        for pair_run in runs
+        if pair_run.pending or pair_run in failed_runs
+    ]
+    for pair_run in unfinished:
+        logger.error(
+            "%s (%s, %s) %s, %s not written",
+            pair_run.name,
+            pair_run.pair.tumor_bam,
+            pair_run.pair.normal_bam,
+            "failed" if pair_run in failed_runs else "cancelled",
+            pair_run.pair.output,
+        )
+    if unfinished:
+        logger.info("Kept scratch directory %s", workspace.path)
+    elif not args.keep_scratch:
+        workspace.cleanup()
+    return unfinished
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = get_args(argv)
+    setup_logger()
+    start = time.time()
+    try:
+        failed = run(args)
+    except ValueError as e:
+        logger.error(e)
+        return 1
+    logger.info("Finished, took %s seconds.", round(time.time() - start, 2))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
+
+
+# __END__
@@ -0,0 +1,397 @@
+#!/usr/bin/env python3
+"""
+BGZF compression with a tabix index, for merged MuSE outputs.
+
+BGZF is a series of independent gzip members of at most 64 KiB, so blocks
+are compressed in parallel and any record can be reached by seeking to a
+virtual offset, `compressed block offset << 16 | offset within block`. The
+tabix (.tbi) index maps genomic bins to ranges of virtual offsets, so
+`tabix` and htslib readers can query a region without a full scan.
+"""
+import collections
+import concurrent.futures
+import logging
+import os
+import re
+import struct
+import zlib
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Uncompressed bytes per block; leaves room for incompressible data.
+BLOCK_SIZE = 0xFF00
+BGZF_HEADER = struct.Struct("<4BI2BH2BHH")
+EOF_BLOCK = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+
+# Tabix linear index window, and bin levels as (shift, first bin).
+LINEAR_SHIFT = 14
+BIN_LEVELS = ((26, 1), (23, 9), (20, 73), (17, 585), (14, 4681))
+FIRST_LEVEL_BIN = 4681
+
+# Contig and position of a record, skipping "#" metadata lines.
+RECORD = re.compile(rb"^([^#\t\n][^\t\n]*)\t([^\t\n]*)", re.M)
+
+
+def compress_block(data: bytes, level: int = 6) -> bytes:
+    """Compress up to BLOCK_SIZE bytes as one BGZF block."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    cdata = compressor.compress(data) + compressor.flush()
+    # BSIZE is the total block size minus 1: 18 header + 8 trailer bytes.
+    header = BGZF_HEADER.pack(31, 139, 8, 4, 0, 0, 255, 6, 66, 67, 2, len(cdata) + 25)
+    return header + cdata + struct.pack("<II", zlib.crc32(data), len(data))
+
+
+def reg2bin(beg: int, end: int) -> int:
+    """Smallest bin containing the 0-based, half-open region."""
+    end -= 1
+    for shift, first in reversed(BIN_LEVELS):
+        if beg >> shift == end >> shift:
+            return first + (beg >> shift)
+    return 0
+
+
+def reg2bins(beg: int, end: int) -> List[int]:
+    """All bins that may hold records overlapping the 0-based region."""
+    end -= 1
+    bins = [0]
+    for shift, first in BIN_LEVELS:
+        bins.extend(range(first + (beg >> shift), first + (end >> shift) + 1))
+    return bins
+
+
+class TabixIndexer:
+    """Build a tabix index of records as they are written, in order.
+
+    Records are tab separated with the contig in column 1 and a 1-based
+    position in column 2; `#` lines are metadata. Each record covers one
+    base, so its bin is the 16 kbp linear index window it falls in, and the
+    records of a window are one contiguous chunk: only window changes need
+    more than a comparison. Offsets are tracked in uncompressed bytes and
+    converted to virtual offsets once the compressed block offsets are known.
+    """
+
+    def __init__(self):
+        self.names: List[str] = []
+        self.bins: List[Dict[int, List[List[int]]]] = []
+        self.linear: List[List[int]] = []
+        self.tail = b""
+        self.offset = 0
+        self.chrom: Optional[bytes] = None
+        self.window = -1
+        self.last_beg = -1
+        # End of the last record seen.
+        self.end = 0
+        self.unsorted: Optional[str] = None
+
+    def feed(self, data: bytes):
+        buf = self.tail + data
+        cut = buf.rfind(b"\n") + 1
+        self.tail = buf[cut:]
+        base = self.offset
+        self.offset += cut
+        if self.unsorted:
+            return
+        chrom, window, last_beg = self.chrom, self.window, self.last_beg
+        last = None
+        for record in RECORD.finditer(buf, 0, cut):
+            try:
+                beg = max(int(record.group(2)) - 1, 0)
+            except ValueError:
+                self.unsorted = "unparseable record {!r}".format(record.group(0))
+                return
+            if beg >> LINEAR_SHIFT != window or record.group(1) != chrom:
+                if last is not None:
+                    self.end = base + buf.index(b"\n", last.end()) + 1
+                self.last_beg = last_beg
+                if not self._next_chunk(record.group(1), beg, base + record.start()):
+                    return
+                chrom, window = self.chrom, self.window
+            elif beg < last_beg:
+                self.unsorted = "{}:{} is out of order".format(chrom.decode(), beg + 1)
+                return
+            last_beg = beg
+            last = record
+        if last is not None:
+            self.end = base + buf.index(b"\n", last.end()) + 1
+        self.last_beg = last_beg
+
+    def _close_chunk(self):
+        if self.chrom is not None:
+            self.bins[-1][FIRST_LEVEL_BIN + self.window][-1][1] = self.end
+
+    def _next_chunk(self, chrom: bytes, beg: int, start: int) -> bool:
+        """End the current window's chunk and start one at `start`."""
+        self._close_chunk()
+        if chrom != self.chrom:
+            name = chrom.decode()
+            if name in self.names:
+                self.unsorted = "{} is not contiguous".format(name)
+                return False
+            self.names.append(name)
+            self.bins.append({})
+            self.linear.append([])
+            self.chrom = chrom
+        elif beg < self.last_beg:
+            self.unsorted = "{}:{} is out of order".format(chrom.decode(), beg + 1)
+            return False
+        self.window = beg >> LINEAR_SHIFT
+        self.bins[-1][FIRST_LEVEL_BIN + self.window] = [[start, start]]
+        linear = self.linear[-1]
+        linear.extend([-1] * (self.window - len(linear)))
+        linear.append(start)
+        return True
+
+    def write(self, path: str, block_offsets: List[int]) -> bool:
+        """Write the index given each block's compressed offset, in order.
+        Accepts:
+            path (str): Output .tbi path
+            block_offsets (List[int]): Offset of every block, then of EOF
+        Returns:
+            False if the records could not be indexed and nothing was written
+        """
+        if self.unsorted:
+            logger.warning("Not writing %s: %s", path, self.unsorted)
+            return False
+        self._close_chunk()
+
+        def voffset(offset: int) -> int:
+            block, within = divmod(offset, BLOCK_SIZE)
+            return block_offsets[block] << 16 | within
+
+        names = b"".join(name.encode() + b"\0" for name in self.names)
+        # Generic format, contig column 1, position column 2 also serving as the
+        # end column (tabix drops every record from a query if it is 0), "#"
+        # metadata lines and no skipped lines.
+        out = [b"TBI\1", struct.pack("<7i", len(self.names), 0, 1, 2, 2, 35, 0)]
+        out.append(struct.pack("<i", len(names)) + names)
+        for bins, linear in zip(self.bins, self.linear):
+            out.append(struct.pack("<i", len(bins)))
+            for bin_id in sorted(bins):
+                chunks = bins[bin_id]
+                out.append(struct.pack("<Ii", bin_id, len(chunks)))
+                for start, end in chunks:
+                    out.append(struct.pack("<QQ", voffset(start), voffset(end)))
+            previous = 0
+            filled = []
+            for start in linear:
+                previous = start if start >= 0 else previous
+                filled.append(voffset(previous))
+            out.append(struct.pack("<i{}Q".format(len(filled)), len(filled), *filled))
+        with BgzfWriter(path) as fh:
+            fh.write(b"".join(out))
+        return True
+
+
+class BgzfWriter:
+    """Write-only binary file object producing BGZF, optionally indexed.
+
+    Blocks are compressed on `threads` worker threads, as zlib releases
+    the GIL, and written in order. With `index`, a tabix index is written
+    to `<path>.tbi` on close.
+    """
+
+    def __init__(
+        self, path: str, threads: int = 1, level: int = 6, index: bool = False
+    ):
+        self.path = path
+        self.fh = open(path, "wb")
+        self.level = level
+        self.threads = max(threads, 1)
+        self.executor = None
+        if self.threads > 1:
+            self.executor = concurrent.futures.ThreadPoolExecutor(self.threads)
+        self.pending: collections.deque = collections.deque()
+        self.buffer = bytearray()
+        self.offset = 0
+        self.block_offsets: List[int] = []
+        self.indexer = TabixIndexer() if index else None
+        self.closed = False
+
+    def write(self, data: bytes) -> int:
+        if self.indexer:
+            self.indexer.feed(data)
+        self.buffer.extend(data)
+        if len(self.buffer) >= BLOCK_SIZE:
+            view = bytes(self.buffer)
+            full = len(view) - len(view) % BLOCK_SIZE
+            for i in range(0, full, BLOCK_SIZE):
+                self._submit(view[i : i + BLOCK_SIZE])
+            self.buffer = bytearray(view[full:])
+        return len(data)
+
+    def _submit(self, block: bytes):
+        if not self.executor:
+            self._write_block(compress_block(block, self.level))
+            return
+        self.pending.append(self.executor.submit(compress_block, block, self.level))
+        while len(self.pending) > self.threads * 4:
+            self._write_block(self.pending.popleft().result())
+
+    def _write_block(self, block: bytes):
+        self.block_offsets.append(self.offset)
+        self.fh.write(block)
+        self.offset += len(block)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self.buffer:
+            self._submit(bytes(self.buffer))
+        while self.pending:
+            self._write_block(self.pending.popleft().result())
+        if self.executor:
+            self.executor.shutdown()
+        self.block_offsets.append(self.offset)
+        self.fh.write(EOF_BLOCK)
+        self.fh.close()
+        if self.indexer:
+            self.indexer.write(self.path + ".tbi", self.block_offsets)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class BgzfReader:
+    """Minimal BGZF reader: seek to a virtual offset and read lines."""
+
+    def __init__(self, path: str):
+        self.fh = open(path, "rb")
+        self.block_offset = 0
+        self.next_block_offset = 0
+        self.data = b""
+        self.within = 0
+
+    def _load(self, offset: int) -> bool:
+        self.fh.seek(offset)
+        header = self.fh.read(BGZF_HEADER.size)
+        if len(header) < BGZF_HEADER.size:
+            return False
+        bsize = BGZF_HEADER.unpack(header)[-1]
+        cdata = self.fh.read(bsize + 1 - BGZF_HEADER.size)
+        self.data = zlib.decompress(cdata[:-8], -15)
+        self.block_offset = offset
+        self.next_block_offset = offset + bsize + 1
+        self.within = 0
+        return True
+
+    def seek(self, voffset: int):
+        self._load(voffset >> 16)
+        self.within = voffset & 0xFFFF
+
+    def tell(self) -> int:
+        if self.within == len(self.data):
+            return self.next_block_offset << 16
+        return self.block_offset << 16 | self.within
+
+    def readline(self) -> bytes:
+        parts = []
+        while True:
+            if self.within >= len(self.data):
+                if not self._load(self.next_block_offset) or not self.data:
+                    break
+            end = self.data.find(b"\n", self.within)
+            if end >= 0:
+                parts.append(self.data[self.within : end + 1])
+                self.within = end + 1
+                break
+            parts.append(self.data[self.within :])
+            self.within = len(self.data)
+        return b"".join(parts)
+
+    def read(self) -> bytes:
+        parts = [self.data[self.within :]]
+        while self._load(self.next_block_offset):
+            parts.append(self.data)
+        return b"".join(parts)
+
+    def close(self):
+        self.fh.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class TabixIndex(NamedTuple):
+    names: List[str]
+    bins: List[Dict[int, List[Tuple[int, int]]]]
+    linear: List[List[int]]
+
+
+def read_tabix(path: str) -> TabixIndex:
+    """Read a .tbi index written by TabixIndexer."""
+    with BgzfReader(path) as fh:
+        fh.seek(0)
+        data = fh.read()
+    if data[:4] != b"TBI\1":
+        raise ValueError("Not a tabix index: {}".format(path))
+    n_ref, *_, l_nm = struct.unpack_from("<8i", data, 4)
+    pos = 36
+    names = [name.decode() for name in data[pos : pos + l_nm].split(b"\0")[:n_ref]]
+    pos += l_nm
+    all_bins, all_linear = [], []
+    for _ in range(n_ref):
+        (n_bin,) = struct.unpack_from("<i", data, pos)
+        pos += 4
+        bins = {}
+        for _ in range(n_bin):
+            bin_id, n_chunk = struct.unpack_from("<Ii", data, pos)
+            pos += 8
+            flat = struct.unpack_from("<{}Q".format(2 * n_chunk), data, pos)
+            pos += 16 * n_chunk
+            bins[bin_id] = list(zip(flat[::2], flat[1::2]))
+        (n_intv,) = struct.unpack_from("<i", data, pos)
+        pos += 4
+        all_linear.append(list(struct.unpack_from("<{}Q".format(n_intv), data, pos)))
+        pos += 8 * n_intv
+        all_bins.append(bins)
+    return TabixIndex(names, all_bins, all_linear)
+
+
+def fetch(path: str, chrom: str, start: int, end: int) -> Iterator[bytes]:
+    """Yield records of an indexed BGZF file within chrom:start-end (1-based)."""
+    index = read_tabix(path + ".tbi")
+    if chrom not in index.names:
+        return
+    tid = index.names.index(chrom)
+    linear = index.linear[tid]
+    window = (start - 1) >> LINEAR_SHIFT
+    min_offset = linear[min(window, len(linear) - 1)] if linear else 0
+    chunks = sorted(
+        chunk
+        for bin_id in reg2bins(start - 1, end)
+        for chunk in index.bins[tid].get(bin_id, ())
+        if chunk[1] > min_offset
+    )
+    with BgzfReader(path) as fh:
+        for chunk_start, chunk_end in chunks:
+            fh.seek(max(chunk_start, min_offset))
+            while fh.tell() < chunk_end:
+                line = fh.readline()
+                if not line:
+                    break
+                if line.startswith(b"#"):
+                    continue
+                fields = line.split(b"\t", 2)
+                if fields[0].decode() == chrom and start <= int(fields[1]) <= end:
+                    yield line
+
+
+def cpu_count() -> int:
+    """CPUs this process may run on."""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+# __END__
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Content-addressed cache of per-shard MuSE outputs, shared across runs.
+
+A shard's key is a digest of everything its output depends on: the BAMs
+and their indexes (size and mtime), the reference and its `.fai`, the MuSE
+binary and the shard's regions. Entries are published atomically (written
+to a temporary file, then renamed into place), so concurrent runs sharing
+a cache never see partial entries, and evicted least recently used first
+once the cache exceeds its size budget.
+"""
+import hashlib
+import logging
+import os
+import pathlib
+import shutil
+import uuid
+from typing import List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def file_identity(path: str) -> str:
+    """Size and mtime of a file, or "missing"."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return "{}:missing".format(path)
+    return "{}:{}:{}".format(
+        os.path.basename(path), stat.st_size, stat.st_mtime_ns
+    )
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def binary_identity(muse_binary: str) -> str:
+    """Checksum of the MuSE binary, found on PATH like the shell would.
+
+    `muse_binary` may carry arguments, e.g. an interpreter and a script;
+    each part that is a file is checksummed.
+    """
+    parts = []
+    for part in muse_binary.split():
+        path = shutil.which(part) or part
+        parts.append(file_sha256(path) if os.path.isfile(path) else part)
+    return " ".join(parts)
+
+
+def input_fingerprint(
+    reference_path: str,
+    tumor_bam: str,
+    normal_bam: str,
+    muse_binary: str,
+    bam_indexes: Tuple[str, ...] = (),
+) -> str:
+    """Digest of the inputs shared by every shard of a run."""
+    fai = "{}.fai".format(reference_path)
+    parts = [
+        file_identity(reference_path),
+        file_sha256(fai) if os.path.exists(fai) else "no fai",
+        file_identity(tumor_bam),
+        file_identity(normal_bam),
+        binary_identity(muse_binary),
+    ]
+    parts.extend(file_identity(index) for index in bam_indexes)
+    return hashlib.sha256("\n".join(parts).encode()).hexdigest()
+
+
+class ShardCache:
+    """On-disk cache of shard outputs, keyed by input fingerprint and regions.
+    Accepts:
+        root (str): Cache directory, created if missing
+        max_bytes (int): Evict least recently used entries above this size
+        fingerprint (str): Digest of the run's inputs, see input_fingerprint
+    """
+
+    def __init__(self, root: str, max_bytes: int, fingerprint: str):
+        self.root = pathlib.Path(root)
+        self.objects = self.root / "objects"
+        self.tmp = self.root / "tmp"
+        self.objects.mkdir(parents=True, exist_ok=True)
+        self.tmp.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.fingerprint = fingerprint
+        self.size = sum(size for _, _, size in self._entries())
+        self.hits = 0
+        self.misses = 0
+        self.published = 0
+        self.evicted = 0
+
+    def key(self, regions: List[str]) -> str:
+        text = "{}\n{}".format(self.fingerprint, ",".join(regions))
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def _path(self, key: str) -> pathlib.Path:
+        return self.objects / key[:2] / "{}.MuSE.txt".format(key)
+
+    def _entries(self) -> List[Tuple[float, pathlib.Path, int]]:
+        """(mtime, path, size) of every entry."""
+        entries = []
+        for subdir in os.scandir(str(self.objects)):
+            if not subdir.is_dir():
+                continue
+            for entry in os.scandir(subdir.path):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append(
+                    (stat.st_mtime, pathlib.Path(entry.path), stat.st_size)
+                )
+        return entries
+
+    def _copy_atomic(
+        self, src: pathlib.Path, dest: pathlib.Path, tmp_dir: pathlib.Path
+    ):
+        """Copy src to dest via a temporary file renamed into place."""
+        tmp = tmp_dir / ".{}.{}.tmp".format(dest.name, uuid.uuid4().hex)
+        try:
+            shutil.copyfile(str(src), str(tmp))
+            os.replace(str(tmp), str(dest))
+        finally:
+            if tmp.exists():
+                tmp.unlink()
+
+    def fetch(self, regions: List[str], output: pathlib.Path) -> bool:
+        """Copy a cached output for regions to `output`, if there is one."""
+        path = self._path(self.key(regions))
+        try:
+            self._copy_atomic(path, output, output.parent)
+            # Hits refresh the entry for LRU eviction.
+            os.utime(str(path))
+        except FileNotFoundError:
+            self.misses += 1
+            return False
+        self.hits += 1
+        return True
+
+    def publish(self, regions: List[str], output: pathlib.Path):
+        """Store a shard's output in the cache, then evict down to budget."""
+        path = self._path(self.key(regions))
+        if path.exists():
+            return
+        path.parent.mkdir(exist_ok=True)
+        self._copy_atomic(output, path, self.tmp)
+        self.published += 1
+        self.size += path.stat().st_size
+        if self.size > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        """Remove least recently used entries until under 90% of budget."""
+        entries = sorted(self._entries())
+        self.size = sum(size for _, _, size in entries)
+        target = self.max_bytes * 0.9
+        for _, path, size in entries:
+            if self.size <= target:
+                break
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            self.size -= size
+            self.evicted += 1
+
+    def log_stats(self, log: Optional[logging.Logger] = None):
+        (log or logger).info(
+            "Shard cache: %s hits, %s misses, %s published, %s evicted, %s MiB",
+            self.hits,
+            self.misses,
+            self.published,
+            self.evicted,
+            self.size >> 20,
+        )
+
+
+# __END__
@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""
+Dispatch bookkeeping shared by the multi_muse execution engines.
+"""
+import collections
+import contextlib
+import heapq
+import itertools
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from muse_tool.telemetry import ChildUsage
+
+logger = logging.getLogger(__name__)
+
+# Seconds between SIGTERMs to in-flight children after an abort.
+ABORT_POLL_INTERVAL = 1.0
+
+# Seconds after the first SIGTERM before a child still running is killed.
+ABORT_KILL_GRACE = 10.0
+
+
+class PopenReturnNT(NamedTuple):
+    stderr: str
+    stdout: str
+    usage: Optional[ChildUsage] = None
+
+
+class CommandTimeoutError(ValueError):
+    """Command exceeded its timeout and was killed."""
+
+
+class ChildRegistry:
+    """Child processes currently running, by command.
+
+    Shared between the functions spawning children and the dispatcher, which
+    uses it to observe (and later signal) in-flight children.
+    Accepts:
+        grace (float): Seconds after the first SIGTERM before `terminate`
+            sends SIGKILL instead
+    """
+
+    def __init__(self, grace: float = ABORT_KILL_GRACE):
+        self.grace = grace
+        self._lock = threading.Lock()
+        self._children: Dict[Any, Any] = {}
+        # Time each child was first sent SIGTERM.
+        self._terminated: Dict[Any, float] = {}
+
+    @contextlib.contextmanager
+    def track(self, cmd: Any, proc: Any):
+        """Register proc under cmd for the duration of the block."""
+        with self._lock:
+            self._children[cmd] = proc
+        try:
+            yield proc
+        finally:
+            with self._lock:
+                self._children.pop(cmd, None)
+                self._terminated.pop(cmd, None)
+
+    def pids(self) -> List[int]:
+        with self._lock:
+            return [proc.pid for proc in self._children.values()]
+
+    def terminate(self) -> int:
+        """Send SIGTERM to every registered child, or SIGKILL to children
+        still running `grace` seconds after their first SIGTERM.
+        Returns:
+            Number of children signalled
+        """
+        now = time.time()
+        with self._lock:
+            children = list(self._children.items())
+            for cmd, _ in children:
+                self._terminated.setdefault(cmd, now)
+            overdue = {
+                cmd for cmd, _ in children if now - self._terminated[cmd] >= self.grace
+            }
+        for cmd, proc in children:
+            try:
+                if cmd in overdue:
+                    proc.kill()
+                else:
+                    proc.terminate()
+            except ProcessLookupError:
+                pass
+        return len(children)
+
+    def kill(self, cmd: Any) -> bool:
+        """Send SIGKILL to the child of a command, if it is registered.
+        Returns:
+            Whether a child was signalled
+        """
+        with self._lock:
+            proc = self._children.get(cmd)
+        if proc is None:
+            return False
+        try:
+            proc.kill()
+        except ProcessLookupError:
+            pass
+        return True
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._children)
+
+
+def track_child(registry: Optional[ChildRegistry], cmd: Any, proc: Any):
+    """Context manager registering proc, if there is a registry."""
+    if registry is None:
+        return contextlib.nullcontext(proc)
+    return registry.track(cmd, proc)
+
+
+class CommandQueue:
+    """Commands awaiting dispatch, with retries and front-of-queue requeues.
+
+    A failed command is retried up to `retries` times, after an exponential
+    backoff of `backoff * 2 ** (attempt - 1)` seconds, ahead of any
+    commands not yet started. A command that times out is first offered
+    to `on_timeout`; any replacement commands it returns (e.g. the command
+    over halves of its interval) are run next instead of a retry.
+
+    Once more than `max_failures` commands have failed for good, the queue
+    aborts: commands not yet started are cancelled, as are in-flight ones
+    failing afterwards (e.g. because the dispatcher terminated them). With
+    `max_failures` None every command runs regardless of failures.
+    """
+
+    def __init__(
+        self,
+        cmds: List[Any],
+        retries: int = 0,
+        backoff: float = 0,
+        on_timeout: Optional[Callable[[Any], List[Any]]] = None,
+        max_failures: Optional[int] = None,
+    ):
+        self.pending = collections.deque(cmds)
+        self.delayed: List[Tuple[float, int, Any]] = []
+        self.attempts: Dict[Any, int] = collections.Counter()
+        self.sequence = itertools.count()
+        self.retries = retries
+        self.backoff = backoff
+        self.on_timeout = on_timeout
+        self.max_failures = max_failures
+        self.exceptions: List[Any] = []
+        self.cancelled: List[Any] = []
+        self.aborted = False
+
+    def __bool__(self) -> bool:
+        return bool(self.pending or self.delayed)
+
+    def ready(self) -> bool:
+        """Move retries whose backoff has elapsed to the front of the queue."""
+        released = []
+        while self.delayed and self.delayed[0][0] <= time.time():
+            released.append(heapq.heappop(self.delayed)[2])
+        self.pending.extendleft(reversed(released))
+        return bool(self.pending)
+
+    def pop(self) -> Any:
+        return self.pending.popleft()
+
+    def next_delay(self) -> Optional[float]:
+        """Seconds until the next delayed retry is due, None if there is none."""
+        if not self.delayed:
+            return None
+        return max(0.0, self.delayed[0][0] - time.time())
+
+    def fail(self, cmd: Any, e: Exception):
+        """Requeue a failed command, or record it once retries are exhausted."""
+        if self.aborted:
+            self.cancelled.append(cmd)
+            return
+        self.attempts[cmd] += 1
+        if isinstance(e, CommandTimeoutError) and self.on_timeout:
+            replacements = self.on_timeout(cmd)
+            if replacements:
+                logger.warning("Timed out, split into %s: %s", len(replacements), cmd)
+                self.pending.extendleft(reversed(replacements))
+                return
+        if self.attempts[cmd] <= self.retries:
+            delay = self.backoff * 2 ** (self.attempts[cmd] - 1)
+            logger.warning(
+                "Attempt %s failed, retrying in %s seconds: %s\n%s",
+                self.attempts[cmd],
+                delay,
+                cmd,
+                e,
+            )
+            heapq.heappush(
+                self.delayed, (time.time() + delay, next(self.sequence), cmd)
+            )
+            return
+        self.exceptions.append(cmd)
+        logger.error(
+            "Failed after %s attempts: %s\n%s", self.attempts[cmd], cmd, e
+        )
+        if self.max_failures is not None and len(self.exceptions) > self.max_failures:
+            self.abort()
+
+    def abort(self):
+        """Cancel every command not yet started."""
+        self.aborted = True
+        self.cancelled.extend(self.pending)
+        self.cancelled.extend(cmd for _, _, cmd in sorted(self.delayed))
+        self.pending.clear()
+        self.delayed.clear()
+        logger.error(
+            "%s commands failed, over the limit of %s: cancelled %s pending "
+            "commands, terminating those in flight",
+            len(self.exceptions),
+            self.max_failures,
+            len(self.cancelled),
+        )
+
+
+def next_wakeup(
+    queue: CommandQueue, in_flight: int, capacity: int, admission: Any = None
+) -> Optional[float]:
+    """Seconds a dispatcher may block waiting for completions.
+
+    Until the next delayed retry is due, or until admission control should
+    be asked again if it is holding back commands that have a free slot.
+    """
+    timeouts = [queue.next_delay()]
+    if admission is not None and queue.pending and in_flight < capacity:
+        timeouts.append(admission.poll_interval)
+    timeouts = [t for t in timeouts if t is not None]
+    return min(timeouts) if timeouts else None
+
+
+def parse_failure_policy(policy: str) -> Optional[int]:
+    """Max failures tolerated before aborting a run, None for no limit.
+
+    "run-all" runs every command regardless of failures, "fail-fast"
+    aborts on the first failure, and a number K aborts on failure K + 1.
+    Raises:
+        ValueError: not a policy
+    """
+    if policy == "run-all":
+        return None
+    if policy == "fail-fast":
+        return 0
+    if policy.isdigit():
+        return int(policy)
+    raise ValueError(
+        "Failure policy must be run-all, fail-fast or a number: {}".format(policy)
+    )
+
+
+class MakespanTimer:
+    """Track overall makespan and the idle tail at the end of a run.
+
+    The idle tail is the time between the first worker running out of work
+    and the last command finishing.
+    """
+
+    def __init__(self):
+        self.start = time.time()
+        self.tail_start: Optional[float] = None
+
+    def check_idle(self, queue: CommandQueue, in_flight: int, capacity: int):
+        if self.tail_start is None and not queue and in_flight < capacity:
+            self.tail_start = time.time()
+
+    def log(self):
+        end = time.time()
+        logger.info(
+            "Makespan: %s seconds, idle tail: %s seconds.",
+            round(end - self.start, 2),
+            round(end - (self.tail_start or end), 2),
+        )
+
+
+# __END__
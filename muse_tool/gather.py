@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+"""
+Gather partial multi_muse results from several nodes into one output.
+
+A node run with `--shard-index i --shard-count N` writes its shards'
+outputs, each with its header, into one partial file, plus a JSON
+descriptor of the plan it was cut from and where each shard's output sits
+in the partial file. Gathering checks that the descriptors come from the
+same plan and together cover every planned interval exactly once, then
+merges the shard outputs in reference order.
+"""
+import argparse
+import collections
+import json
+import logging
+import os
+import pathlib
+import sys
+import time
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from muse_tool import __version__
+from muse_tool.bgzf import cpu_count
+from muse_tool.manifest import file_md5
+from muse_tool.merge import append_segment, open_merged
+from muse_tool.plan import Shard, plan_digest
+from muse_tool.workspace import Workspace, publish_indexed
+
+logger = logging.getLogger("muse_tool.gather")
+
+PARTIAL_FORMAT = "multi_muse_partial/1"
+
+
+class Segment(NamedTuple):
+    """One shard output within a partial file."""
+
+    name: str
+    regions: List[str]
+    path: str
+    offset: int
+    size: int
+
+
+def partial_paths(index: int, count: int) -> Tuple[str, str]:
+    """Partial output and descriptor paths of node `index` of `count`."""
+    stem = "multi_muse_call_partial.{}of{}".format(index, count)
+    return stem + ".MuSE.txt", stem + ".json"
+
+
+def describe_shard(shard: Shard) -> Tuple[int, List[str]]:
+    return shard.index, [interval.region for interval in shard.intervals]
+
+
+def write_descriptor(
+    path: str,
+    index: int,
+    count: int,
+    plan: List[Shard],
+    contigs: Optional[List[str]],
+    inputs: Dict[str, str],
+    output: str,
+    segments: List[Tuple[Shard, int, int]],
+):
+    """Describe a node's partial output.
+    Accepts:
+        path (str): Descriptor path
+        index (int): This node's index
+        count (int): Number of nodes
+        plan (List[Shard]): Every planned shard, on all nodes
+        contigs (List[str]): Reference contig order, if known
+        inputs (Dict[str, str]): Input paths, for provenance
+        output (str): Partial output path
+        segments (List[Tuple[Shard, int, int]]): Each shard's output offset
+            and size in the partial output, in order
+    """
+    by_index: Dict[int, dict] = {}
+    for shard, offset, size in segments:
+        entry = by_index.setdefault(shard.index, dict(index=shard.index))
+        entry.setdefault("segments", []).append(
+            dict(
+                name=shard.name,
+                regions=describe_shard(shard)[1],
+                offset=offset,
+                size=size,
+            )
+        )
+    planned = dict(describe_shard(shard) for shard in plan)
+    for entry in by_index.values():
+        entry["planned"] = planned[entry["index"]]
+    descriptor = dict(
+        format=PARTIAL_FORMAT,
+        version=__version__,
+        shard_index=index,
+        shard_count=count,
+        plan_digest=plan_digest(describe_shard(shard) for shard in plan),
+        plan_shards=len(plan),
+        contigs=contigs,
+        inputs=inputs,
+        output=os.path.basename(output),
+        size=os.path.getsize(output),
+        md5=file_md5(pathlib.Path(output)),
+        shards=[by_index[i] for i in sorted(by_index)],
+    )
+    with open(path, "w") as fh:
+        json.dump(descriptor, fh, indent=1)
+
+
+def parse_region(region: str) -> Tuple[str, int, int]:
+    """Contig, 0-based start and end of a `MuSE call -r` region."""
+    chrom, span = region.rsplit(":", 1)
+    start, end = span.split("-")
+    return chrom, int(start) - 1, int(end)
+
+
+def coverage_steps(regions: List[str]) -> Dict[Tuple[str, int], int]:
+    """Change in coverage depth at each position where it changes.
+
+    Two lists of regions have equal steps exactly when they cover every
+    base the same number of times, however they are split.
+    """
+    steps: Dict[Tuple[str, int], int] = collections.Counter()
+    for chrom, start, end in map(parse_region, regions):
+        steps[chrom, start] += 1
+        steps[chrom, end] -= 1
+    return {position: step for position, step in steps.items() if step}
+
+
+def validate(descriptors: List[dict], paths: List[str]) -> List[Segment]:
+    """Check partials cover every planned interval exactly once.
+    Accepts:
+        descriptors (List[dict]): Loaded descriptors
+        paths (List[str]): Descriptor paths, partial outputs are next to them
+    Returns:
+        Every segment, in reference order
+    Raises:
+        ValueError: partials missing, duplicated, corrupt or from other plans
+    """
+    if not descriptors:
+        raise ValueError("No partial results given")
+    first = descriptors[0]
+    count = first["shard_count"]
+    nodes = sorted(d["shard_index"] for d in descriptors)
+    if nodes != list(range(count)):
+        raise ValueError(
+            "Expected partials 0 to {} exactly once, got {}".format(count - 1, nodes)
+        )
+
+    planned: Dict[int, List[str]] = {}
+    segments: Dict[int, List[Segment]] = {}
+    for descriptor, path in zip(descriptors, paths):
+        if descriptor.get("format") != PARTIAL_FORMAT:
+            raise ValueError("Not a multi_muse partial descriptor: {}".format(path))
+        if descriptor["plan_digest"] != first["plan_digest"]:
+            raise ValueError("Partial from a different plan: {}".format(path))
+        output = os.path.join(os.path.dirname(path), descriptor["output"])
+        if not os.path.exists(output):
+            raise ValueError("Missing partial output: {}".format(output))
+        if os.path.getsize(output) != descriptor["size"] or (
+            file_md5(pathlib.Path(output)) != descriptor["md5"]
+        ):
+            raise ValueError("Partial output does not match descriptor: " + output)
+        for shard in descriptor["shards"]:
+            if shard["index"] in planned:
+                raise ValueError("Shard {} in two partials".format(shard["index"]))
+            planned[shard["index"]] = shard["planned"]
+            segments[shard["index"]] = [
+                Segment(s["name"], s["regions"], output, s["offset"], s["size"])
+                for s in shard["segments"]
+            ]
+
+    missing = set(range(first["plan_shards"])) - set(planned)
+    if missing:
+        raise ValueError(
+            "{} planned shards not in any partial, e.g. {}".format(
+                len(missing), min(missing)
+            )
+        )
+    digest = plan_digest((index, planned[index]) for index in sorted(planned))
+    if digest != first["plan_digest"]:
+        raise ValueError("Partials do not add up to the planned intervals")
+    for index, shard_segments in segments.items():
+        regions = [region for s in shard_segments for region in s.regions]
+        if coverage_steps(regions) != coverage_steps(planned[index]):
+            raise ValueError(
+                "Shard {} does not cover its intervals exactly once".format(index)
+            )
+        names = [s.name for s in shard_segments]
+        if len(set(names)) != len(names):
+            raise ValueError("Shard {} was called twice".format(index))
+
+    rank = {contig: i for i, contig in enumerate(first.get("contigs") or [])}
+
+    def reference_order(index: int):
+        chrom, start, _ = parse_region(planned[index][0])
+        return rank.get(chrom, len(rank)), start if rank else 0, index
+
+    return [
+        segment
+        for index in sorted(segments, key=reference_order)
+        for segment in sorted(
+            segments[index], key=lambda s: [int(i) for i in s.name.split(".")]
+        )
+    ]
+
+
+def load_partials(descriptor_paths: List[str]) -> List[Segment]:
+    """Load and validate partial descriptors, see validate."""
+    descriptors = []
+    for path in descriptor_paths:
+        with open(path, "r") as fh:
+            descriptors.append(json.load(fh))
+    return validate(descriptors, descriptor_paths)
+
+
+def merge_segments(segments: List[Segment], out_fh) -> int:
+    """Merge shard outputs into out_fh, keeping the first header.
+    Returns:
+        Number of non-empty shard outputs merged
+    """
+    merged = 0
+    for segment in segments:
+        if append_segment(
+            segment.path, segment.offset, segment.size, out_fh, merged == 0
+        ):
+            merged += 1
+    return merged
+
+
+def gather(descriptor_paths: List[str], out_fh) -> int:
+    """Validate partials and merge them into out_fh.
+    Returns:
+        Number of non-empty shard outputs merged
+    """
+    return merge_segments(load_partials(descriptor_paths), out_fh)
+
+
+def get_args(argv: Optional[List[str]] = None):
+    """
+    Loads the parser.
+    """
+    parser = argparse.ArgumentParser(
+        description="Gather partial multi_muse results into one `MuSE call` output."
+    )
+    required = parser.add_argument_group("Required input parameters")
+    required.add_argument(
+        "--partial",
+        action="append",
+        required=True,
+        help="Partial descriptor (.json) of each node.",
+    )
+    required.add_argument("--merge_outname", required=True)
+    optional = parser.add_argument_group("Optional parameters")
+    optional.add_argument(
+        "--bgzf",
+        action="store_true",
+        help="Write BGZF compressed output, with a tabix index if sorted.",
+    )
+    optional.add_argument(
+        "--threads",
+        type=int,
+        default=cpu_count(),
+        help="Threads compressing BGZF blocks.",
+    )
+    return parser.parse_args(argv)
+
+
+def setup_logger():
+    """
+    Sets up the logger.
+    """
+    logger = logging.getLogger("muse_tool")
+    logger_format = "[%(levelname)s] [%(asctime)s] [%(name)s] - %(message)s"
+    logger.setLevel(level=logging.INFO)
+    handler = logging.StreamHandler(sys.stderr)
+    formatter = logging.Formatter(logger_format, datefmt="%Y%m%d %H:%M:%S")
+    handler.setFormatter(formatter)
+    logger.addHandler(handler)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = get_args(argv)
+    setup_logger()
+    start = time.time()
+    try:
+        segments = load_partials(args.partial)
+    except ValueError as e:
+        logger.error(e)
+        return 1
+    # Staged, then published whole, as multi_muse does its merged output.
+    workspace = Workspace()
+    try:
+        staged = workspace.join(os.path.basename(args.merge_outname))
+        with open_merged(staged, args.bgzf, args.threads) as fh:
+            merged = merge_segments(segments, fh)
+        publish_indexed(staged, args.merge_outname)
+    finally:
+        workspace.cleanup()
+    logger.info(
+        "Gathered %s shard outputs from %s partials, took %s seconds.",
+        merged,
+        len(args.partial),
+        round(time.time() - start, 2),
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
+
+
+# __END__
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""
+BED interval and reference index parsing.
+"""
+import array
+import contextlib
+import gc
+import gzip
+import statistics
+from typing import IO, Dict, Generator, Iterator, List, NamedTuple, Optional, Tuple
+
+# BED lines that are not intervals.
+HEADER_PREFIXES = ("#", "track", "browser")
+
+
+class BedInterval(NamedTuple):
+    """Zero-based, half-open BED interval with an optional cost weight."""
+
+    chrom: str
+    start: int
+    end: int
+    weight: float = 1.0
+
+    @property
+    def region(self) -> str:
+        """One-based, closed region string accepted by `MuSE call -r`."""
+        return "{}:{}-{}".format(self.chrom, self.start + 1, self.end)
+
+    @property
+    def length(self) -> int:
+        return self.end - self.start
+
+    @property
+    def cost(self) -> float:
+        """Estimated relative cost of calling this interval."""
+        return self.length * self.weight
+
+
+class FaiRecord(NamedTuple):
+    contig: str
+    length: int
+
+
+@contextlib.contextmanager
+def gc_paused():
+    """Pause the cyclic garbage collector.
+
+    Building millions of small containers otherwise triggers repeated full
+    collections, which dominate the cost of loading a large BED.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def open_bed(intervals_file: str) -> IO[str]:
+    """Open a plain or gzipped BED file for reading text."""
+    with open(intervals_file, "rb") as fh:
+        gzipped = fh.read(2) == b"\x1f\x8b"
+    if gzipped:
+        return gzip.open(intervals_file, "rt")
+    return open(intervals_file, "r")
+
+
+def parse_bed(
+    intervals_file: str, weight_column: Optional[int] = None
+) -> Generator[Tuple[str, int, int, float], None, None]:
+    """Yield (chrom, start, end, weight) of each interval in a BED file.
+
+    Plain or gzipped; blank, comment, `track` and `browser` lines are
+    skipped. Fields may be separated by tabs or spaces.
+    Raises:
+        ValueError: malformed line, or weight column missing or not numeric
+    """
+    with open_bed(intervals_file) as fh:
+        for lineno, line in enumerate(fh, 1):
+            if line.startswith(HEADER_PREFIXES) or not line.strip():
+                continue
+            fields = line.split()
+            try:
+                chrom, start, end = fields[0], int(fields[1]), int(fields[2])
+            except (IndexError, ValueError):
+                raise ValueError(
+                    "{}:{}: not a BED interval: {}".format(
+                        intervals_file, lineno, line.strip()
+                    )
+                )
+            weight = 1.0
+            if weight_column:
+                try:
+                    weight = float(fields[weight_column - 1])
+                except (IndexError, ValueError):
+                    raise ValueError(
+                        "Invalid weight in column {}: {}".format(
+                            weight_column, line.strip()
+                        )
+                    )
+            yield chrom, start, end, weight
+
+
+def yield_bed_intervals(
+    intervals_file: str, weight_column: Optional[int] = None
+) -> Generator[BedInterval, None, None]:
+    """Yield intervals from BED file.
+    Accepts:
+        intervals_file (str): BED file path, plain or gzipped
+        weight_column (int): Optional 1-based column holding a numeric weight
+    Returns:
+        Generator of BedInterval
+    Raises:
+        ValueError: malformed line, or weight column missing or not numeric
+    """
+    for chrom, start, end, weight in parse_bed(intervals_file, weight_column):
+        yield BedInterval(chrom, start, end, weight)
+
+
+class IntervalStats(NamedTuple):
+    count: int
+    bp: int
+    contigs: int
+    min: int
+    median: float
+    max: int
+
+
+class IntervalStore:
+    """Intervals held in parallel arrays of contig id, start, end and weight.
+
+    Far more compact than a list of BedInterval, and sorted and merged
+    without building one. Iterating yields BedInterval.
+    """
+
+    def __init__(self, contigs: Optional[List[str]] = None):
+        self.contigs: List[str] = list(contigs or [])
+        self.contig_ids: Dict[str, int] = {c: i for i, c in enumerate(self.contigs)}
+        self.ids = array.array("i")
+        self.starts = array.array("q")
+        self.ends = array.array("q")
+        self.weights = array.array("d")
+
+    @classmethod
+    def from_bed(
+        cls, intervals_file: str, weight_column: Optional[int] = None
+    ) -> "IntervalStore":
+        """Load a plain or gzipped BED file, see parse_bed.
+
+        Lines are parsed one at a time straight into the arrays, so no
+        more than one line is held besides them.
+        """
+        store = cls()
+        for chrom, start, end, weight in parse_bed(intervals_file, weight_column):
+            store.append(chrom, start, end, weight)
+        return store
+
+    def append(self, chrom: str, start: int, end: int, weight: float = 1.0):
+        contig_id = self.contig_ids.get(chrom)
+        if contig_id is None:
+            contig_id = self.contig_ids[chrom] = len(self.contigs)
+            self.contigs.append(chrom)
+        self.ids.append(contig_id)
+        self.starts.append(start)
+        self.ends.append(end)
+        self.weights.append(weight)
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def __iter__(self) -> Iterator[BedInterval]:
+        contigs = self.contigs
+        for contig_id, start, end, weight in zip(
+            self.ids, self.starts, self.ends, self.weights
+        ):
+            yield BedInterval(contigs[contig_id], start, end, weight)
+
+    @property
+    def bp(self) -> int:
+        return sum(self.ends) - sum(self.starts)
+
+    def stats(self) -> IntervalStats:
+        lengths = [end - start for start, end in zip(self.starts, self.ends)]
+        if not lengths:
+            return IntervalStats(0, 0, 0, 0, 0, 0)
+        return IntervalStats(
+            len(lengths),
+            sum(lengths),
+            len(set(self.ids)),
+            min(lengths),
+            statistics.median(lengths),
+            max(lengths),
+        )
+
+    def _take(self, order: List[int], contigs: List[str]) -> "IntervalStore":
+        store = IntervalStore(contigs)
+        ids = self.ids
+        if contigs != self.contigs:
+            position = {contig: i for i, contig in enumerate(contigs)}
+            remap = [position[contig] for contig in self.contigs]
+            ids = [remap[contig_id] for contig_id in self.ids]
+        store.ids = array.array("i", map(ids.__getitem__, order))
+        store.starts = array.array("q", map(self.starts.__getitem__, order))
+        store.ends = array.array("q", map(self.ends.__getitem__, order))
+        store.weights = array.array("d", map(self.weights.__getitem__, order))
+        return store
+
+    def sorted(self, contig_order: Optional[List[str]] = None) -> "IntervalStore":
+        """Sorted by contig, start and end.
+
+        Contigs follow `contig_order`, e.g. the reference's, then any others
+        in order of first appearance.
+        """
+        contigs = [c for c in contig_order or [] if c in self.contig_ids]
+        known = set(contigs)
+        contigs += [c for c in self.contigs if c not in known]
+        position = {contig: i for i, contig in enumerate(contigs)}
+        rank = [position[contig] for contig in self.contigs]
+        # Stable sorts on C-level keys, least significant first.
+        with gc_paused():
+            order = sorted(range(len(self)), key=self.ends.__getitem__)
+            order.sort(key=self.starts.__getitem__)
+            ranks = [rank[contig_id] for contig_id in self.ids]
+            order.sort(key=ranks.__getitem__)
+            return self._take(order, contigs)
+
+    def merged(
+        self, padding: int = 0, lengths: Optional[Dict[str, int]] = None
+    ) -> "IntervalStore":
+        """Merge overlapping and abutting intervals of a sorted store.
+
+        Intervals are first padded by `padding` bp on each side, clipped to
+        the contig (at `lengths`, if given). A merged interval's weight is
+        the length-weighted mean of its parts', so its cost is about theirs.
+        """
+        lengths = lengths or {}
+        store = IntervalStore(self.contigs)
+        last_id, cur_start, cur_end, cur_cost = -1, 0, 0, 0.0
+
+        def flush():
+            if last_id >= 0:
+                store.ids.append(last_id)
+                store.starts.append(cur_start)
+                store.ends.append(cur_end)
+                store.weights.append(cur_cost / max(cur_end - cur_start, 1))
+
+        for contig_id, start, end, weight in zip(
+            self.ids, self.starts, self.ends, self.weights
+        ):
+            cost = (end - start) * weight
+            start = max(start - padding, 0)
+            end += padding
+            length = lengths.get(self.contigs[contig_id])
+            if length is not None:
+                end = min(end, length)
+            if contig_id == last_id and start <= cur_end:
+                cur_end = max(cur_end, end)
+                cur_cost += cost
+                continue
+            flush()
+            last_id, cur_start, cur_end, cur_cost = contig_id, start, end, cost
+        flush()
+        return store
+
+
+def read_fai(reference_path: str) -> List[FaiRecord]:
+    """Read contig names and lengths from the `.fai` next to the reference.
+    Accepts:
+        reference_path (str): FASTA path; `<reference_path>.fai` must exist
+    Returns:
+        List of FaiRecord, in reference order
+    """
+    records = []
+    with open("{}.fai".format(reference_path), "r") as fh:
+        for line in fh:
+            if not line.strip():
+                continue
+            contig, length, *_ = line.rstrip("\n").split("\t")
+            records.append(FaiRecord(contig, int(length)))
+    return records
+
+
+# __END__
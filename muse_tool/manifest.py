@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Run manifest for checkpointing and resuming multi_muse runs.
+
+The manifest is JSON lines: one record per completed shard, and one per
+shard bisected after timing out, naming the commands that replaced it.
+Each is appended with a single write and fsync'd, so a crash can at worst
+leave a torn last line, which is ignored when loading.
+"""
+import hashlib
+import json
+import logging
+import os
+import pathlib
+from typing import Dict, Iterator, List, NamedTuple, Union
+
+logger = logging.getLogger(__name__)
+
+
+class ManifestRecord(NamedTuple):
+    index: int
+    regions: List[str]
+    cmd: str
+    output: str
+    size: int
+    md5: str
+    duration: float
+
+
+class SplitRecord(NamedTuple):
+    """A shard that timed out and was bisected into `children` commands."""
+
+    index: int
+    cmd: str
+    children: List[str]
+
+
+def file_md5(path: pathlib.Path, chunk_size: int = 1 << 20) -> str:
+    """Return hex md5 digest of a file."""
+    digest = hashlib.md5()
+    with path.open("rb") as fh:
+        for chunk in iter(lambda: fh.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def make_record(
+    index: int, regions: List[str], cmd: str, output: pathlib.Path, duration: float
+) -> ManifestRecord:
+    """Build a record for a completed shard from its output on disk."""
+    return ManifestRecord(
+        index=index,
+        regions=regions,
+        cmd=cmd,
+        output=str(output),
+        size=output.stat().st_size,
+        md5=file_md5(output),
+        duration=round(duration, 3),
+    )
+
+
+def verify_record(record: ManifestRecord) -> bool:
+    """Check the recorded output still exists with the same size and md5."""
+    output = pathlib.Path(record.output)
+    try:
+        if output.stat().st_size != record.size:
+            return False
+    except FileNotFoundError:
+        return False
+    return file_md5(output) == record.md5
+
+
+def read_manifest(path: str) -> Iterator[Union[ManifestRecord, SplitRecord]]:
+    """Yield the records of a manifest in order. Missing manifest is empty."""
+    if not os.path.exists(path):
+        return
+    with open(path, "r") as fh:
+        for line in fh:
+            try:
+                fields = json.loads(line)
+                if "children" in fields:
+                    yield SplitRecord(**fields)
+                else:
+                    yield ManifestRecord(**fields)
+            except (ValueError, TypeError):
+                logger.warning("Ignoring malformed manifest line: %s", line.strip())
+
+
+def load_manifest(path: str) -> Dict[str, ManifestRecord]:
+    """Load completed shard records keyed by command."""
+    return {
+        record.cmd: record
+        for record in read_manifest(path)
+        if isinstance(record, ManifestRecord)
+    }
+
+
+def load_splits(path: str) -> Dict[str, SplitRecord]:
+    """Load bisected shard records keyed by command."""
+    return {
+        record.cmd: record
+        for record in read_manifest(path)
+        if isinstance(record, SplitRecord)
+    }
+
+
+class RunManifest:
+    """Append-only writer for manifest records."""
+
+    def __init__(self, path: str, append: bool = False):
+        flags = os.O_WRONLY | os.O_CREAT | os.O_APPEND
+        if not append:
+            flags |= os.O_TRUNC
+        self.fd = os.open(path, flags, 0o644)
+
+    def write(self, record: Union[ManifestRecord, SplitRecord]):
+        os.write(self.fd, (json.dumps(record._asdict()) + "\n").encode())
+        os.fsync(self.fd)
+
+    def close(self):
+        os.close(self.fd)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# __END__
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Bulk merging of `MuSE call` outputs.
+
+Only each output's leading `#` header block is read line by line. The body
+after it is copied in large chunks, with os.sendfile when both ends are
+plain files, so merging runs at close to disk speed.
+"""
+import io
+import logging
+import os
+import pathlib
+import shutil
+from typing import IO, List, Optional, Union
+
+from muse_tool.bgzf import BgzfWriter
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1 << 20
+
+
+def _copy_range(src_fh: IO, out_fh: IO, size: int, chunk_size: int = CHUNK_SIZE):
+    """Copy `size` bytes of src_fh, from its current position, to out_fh."""
+    while size > 0:
+        chunk = src_fh.read(min(chunk_size, size))
+        if not chunk:
+            break
+        out_fh.write(chunk)
+        size -= len(chunk)
+
+
+def _copy_body(
+    src_fh: IO, out_fh: IO, chunk_size: int = CHUNK_SIZE, end: Optional[int] = None
+):
+    """Copy the rest of src_fh, or up to offset `end`, to out_fh."""
+    if isinstance(out_fh, io.TextIOBase):
+        shutil.copyfileobj(src_fh, out_fh, chunk_size)
+        return
+    offset = src_fh.tell()
+    if end is None:
+        end = os.fstat(src_fh.fileno()).st_size
+    try:
+        out_fd = out_fh.fileno()
+        seekable = out_fh.seekable()
+    except (AttributeError, io.UnsupportedOperation):
+        seekable = False
+    if not seekable or not hasattr(os, "sendfile"):
+        _copy_range(src_fh, out_fh, end - offset, chunk_size)
+        return
+    out_fh.flush()
+    while offset < end:
+        sent = os.sendfile(out_fd, src_fh.fileno(), offset, end - offset)
+        if sent == 0:
+            break
+        offset += sent
+    # Resync the buffered writer with the bytes written behind its back.
+    out_fh.seek(0, os.SEEK_END)
+
+
+def append_output(
+    file: Union[str, pathlib.Path],
+    out_fh: IO,
+    header: bool,
+    chunk_size: int = CHUNK_SIZE,
+) -> bool:
+    """Append one output to given file handler, with or without its header.
+
+    Header lines are only looked for in the output's leading `#` block.
+    out_fh may be opened in text or binary mode; binary is faster.
+    Returns:
+        False if the output was empty and nothing was written
+    """
+    file = pathlib.Path(file)
+    if file.stat().st_size == 0:
+        logger.error("Empty output: %s", file.name)
+        return False
+    text = isinstance(out_fh, io.TextIOBase)
+    comment = "#" if text else b"#"
+    with file.open("r" if text else "rb") as fh:
+        line = fh.readline()
+        while line.startswith(comment):
+            if header:
+                out_fh.write(line)
+            line = fh.readline()
+        out_fh.write(line)
+        _copy_body(fh, out_fh, chunk_size)
+    return True
+
+
+def append_segment(
+    file: Union[str, pathlib.Path],
+    offset: int,
+    size: int,
+    out_fh: IO,
+    header: bool,
+    chunk_size: int = CHUNK_SIZE,
+) -> bool:
+    """Append one output stored at `offset` within a larger file, see
+    append_output. out_fh must be binary.
+    Returns:
+        False if the output was empty and nothing was written
+    """
+    if size == 0:
+        return False
+    end = offset + size
+    with open(file, "rb") as fh:
+        fh.seek(offset)
+        line = fh.readline(size)
+        while line.startswith(b"#") and fh.tell() < end:
+            if header:
+                out_fh.write(line)
+            line = fh.readline(end - fh.tell())
+        if not line.startswith(b"#"):
+            out_fh.write(line)
+        elif header:
+            out_fh.write(line)
+        _copy_body(fh, out_fh, chunk_size, end)
+    return True
+
+
+def open_merged(path: str, bgzf: bool = False, threads: int = 1) -> IO:
+    """Open a merged output for writing, BGZF compressed and indexed if `bgzf`."""
+    if bgzf:
+        return BgzfWriter(path, threads=threads, index=True)
+    return open(path, "wb")
+
+
+def merge_files(muse_outputs: List[Union[str, pathlib.Path]], out_fh: IO) -> int:
+    """Write contents of outputs to given file handler.
+
+    The header of the first non-empty output is kept, others are dropped.
+    Returns:
+        Number of non-empty outputs merged
+    """
+    merged = 0
+    for file in muse_outputs:
+        if append_output(file, out_fh, merged == 0):
+            merged += 1
+    return merged
+
+
+# __END__
@@ -11,6 +11,9 @@ import os
 import sys
 import time
 
+from muse_tool.bgzf import cpu_count
+from muse_tool.merge import merge_files, open_merged
+
 
 def main(args, logger):
     """
@@ -18,14 +21,8 @@ def main(args, logger):
     """
     # Merge
     logger.info("Merging `MuSE call` outputs...")
-    first = True
-    with open(args.merge_outname, "w") as o:
-        for m in args.muse_call_out:
-            with open(m) as f:
-                for line in f:
-                    if first or not line.startswith("#"):
-                        o.write(line)
-            first = False
+    with open_merged(args.merge_outname, args.bgzf, args.threads) as o:
+        merge_files(args.muse_call_out, o)
     assert os.stat(args.merge_outname).st_size != 0, "Merged VCF is Empty"
 
 
@@ -41,6 +38,18 @@ def get_args():
     required = parser.add_argument_group("Required input parameters")
     required.add_argument("--muse_call_out", action="append", required=True)
     required.add_argument("--merge_outname", required=True)
+    optional = parser.add_argument_group("Optional parameters")
+    optional.add_argument(
+        "--bgzf",
+        action="store_true",
+        help="Write BGZF compressed output, with a tabix index if sorted.",
+    )
+    optional.add_argument(
+        "--threads",
+        type=int,
+        default=cpu_count(),
+        help="Threads compressing BGZF blocks.",
+    )
     return parser.parse_args()
 
 
@@ -5,8 +5,13 @@ Multithreading MuSE call
 @author: Shenglai Li
 """
 import argparse
+import collections
 import concurrent.futures
+import contextlib
+import functools
+import heapq
 import logging
+import os
 import pathlib
 import shlex
 import subprocess
@@ -15,22 +20,71 @@ import time
 from collections import namedtuple
 from textwrap import dedent
 from types import SimpleNamespace
-from typing import IO, Any, Callable, Generator, List, NamedTuple, Optional, Tuple
+from typing import IO, Any, Callable, Generator, List, Optional, Tuple
 
 from muse_tool import __version__
+from muse_tool.admission import MemoryAdmission, parse_size, resolve_budget
+from muse_tool.aio_engine import (
+    aio_submit_commands,
+    async_commands_logfile,
+    async_commands_pipe,
+)
+from muse_tool.bam import find_bai, load_bam_index, weigh_interval
+from muse_tool.bgzf import cpu_count
+from muse_tool.cache import ShardCache, input_fingerprint
+from muse_tool.dispatch import (
+    ABORT_POLL_INTERVAL,
+    ChildRegistry,
+    CommandQueue,
+    CommandTimeoutError,
+    MakespanTimer,
+    PopenReturnNT,
+    next_wakeup,
+    parse_failure_policy,
+    track_child,
+)
+from muse_tool.gather import partial_paths, write_descriptor
+from muse_tool.intervals import (
+    IntervalStore,
+    read_fai,
+    yield_bed_intervals,
+)
+from muse_tool.manifest import (
+    RunManifest,
+    SplitRecord,
+    load_manifest,
+    load_splits,
+    make_record,
+    verify_record,
+)
+from muse_tool.merge import append_output, merge_files, open_merged  # noqa: F401
+from muse_tool.placement import Placement, read_numa_nodes, split_cpus
+from muse_tool.plan import (
+    Shard,
+    bisect_shard,
+    pack_intervals,
+    partition_shards,
+    plan_shards,
+    shards_from_intervals,
+    write_plan,
+)
+from muse_tool.prefetch import Prefetcher, bam_ranges
+from muse_tool.preflight import preflight
+from muse_tool.progress import ProgressTracker
+from muse_tool.shard_logs import archive_logs, read_tail
+from muse_tool.speculate import Speculator
+from muse_tool.telemetry import wait_child, write_report_json, write_report_tsv
+from muse_tool.workspace import SHARD_PREFIX, Workspace, publish, publish_indexed
 
-logger = logging.getLogger(__name__)
+# Not __name__, which is "__main__" when run as a script, outside the
+# "muse_tool" logger that setup_logger configures.
+logger = logging.getLogger("muse_tool.multi_muse")
 
 DI = SimpleNamespace(
     futures=concurrent.futures, pathlib=pathlib, shlex=shlex, subprocess=subprocess
 )
 
 
-class PopenReturnNT(NamedTuple):
-    stderr: str
-    stdout: str
-
-
 CMD_STR = dedent(
     """
     {muse_binary} call
@@ -42,40 +96,70 @@ CMD_STR = dedent(
     """
 ).strip()
 
+CMD_LIST_STR = dedent(
+    """
+    {muse_binary} call
+    -f {reference_path}
+    -l {region_list}
+    {tumor_bam}
+    {normal_bam}
+    -O {output_file}
+    """
+).strip()
+
 
 def setup_logger():
     """
     Sets up the logger.
     """
+    # Configure the package logger, so all muse_tool modules log through it.
+    package_logger = logging.getLogger("muse_tool")
     loggerformat = "[%(levelname)s] [%(asctime)s] [%(name)s] - %(message)s"
-    logger.setLevel(level=logging.INFO)
+    package_logger.setLevel(level=logging.INFO)
     handler = logging.StreamHandler(sys.stderr)
     formatter = logging.Formatter(loggerformat, datefmt="%Y%m%d %H:%M:%S")
     handler.setFormatter(formatter)
-    logger.addHandler(handler)
+    package_logger.addHandler(handler)
 
 
-def subprocess_commands_pipe(cmd, timeout: int, di=DI) -> PopenReturnNT:
+def subprocess_commands_pipe(
+    cmd,
+    timeout: int,
+    di=DI,
+    registry: Optional[ChildRegistry] = None,
+    preexec_fn: Optional[Callable[[], None]] = None,
+) -> PopenReturnNT:
     """Run given command with subprocess.
     Accepts:
         cmd (str): Command string
         timeout (int): Max time for command to run, in seconds
+        registry (ChildRegistry): Registers the child while it runs
+        preexec_fn (Callable): Called in the child before exec, see placement
     Returns:
         Tuple of decoded stdout and stderr
     Raises:
-        ValueError: timeout exceeded or other exception
+        CommandTimeoutError: timeout exceeded
+        ValueError: other exception
     """
     """run pool commands"""
 
     output = di.subprocess.Popen(
-        shlex.split(cmd), stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        shlex.split(cmd),
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        preexec_fn=preexec_fn,
     )
-    try:
-        output_stdout, output_stderr = output.communicate(timeout=timeout)
-    except Exception:
-        output.kill()
-        _, output_stderr = output.communicate()
-        raise ValueError(output_stderr.decode())
+    with track_child(registry, cmd, output):
+        try:
+            output_stdout, output_stderr = output.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            output.kill()
+            _, output_stderr = output.communicate()
+            raise CommandTimeoutError(output_stderr.decode())
+        except Exception:
+            output.kill()
+            _, output_stderr = output.communicate()
+            raise ValueError(output_stderr.decode())
 
     if output.returncode != 0:
         raise ValueError(output_stderr.decode())
@@ -83,15 +167,87 @@ def subprocess_commands_pipe(cmd, timeout: int, di=DI) -> PopenReturnNT:
     return PopenReturnNT(stdout=output_stdout.decode(), stderr=output_stderr.decode(),)
 
 
+def subprocess_commands_logfile(
+    cmd,
+    timeout: int,
+    log_path: str,
+    tail_bytes: int = 4096,
+    collect_usage: bool = False,
+    di=DI,
+    registry: Optional[ChildRegistry] = None,
+    preexec_fn: Optional[Callable[[], None]] = None,
+) -> PopenReturnNT:
+    """Run given command with subprocess, writing its output to a log file.
+    Accepts:
+        cmd (str): Command string
+        timeout (int): Max time for command to run, in seconds
+        log_path (str): File to append the child's stdout and stderr to
+        tail_bytes (int): Bytes of the log to include in errors
+        collect_usage (bool): Collect the child's resource usage
+        registry (ChildRegistry): Registers the child while it runs
+        preexec_fn (Callable): Called in the child before exec, see placement
+    Returns:
+        Empty stdout and stderr, which are in the log file, and usage
+    Raises:
+        CommandTimeoutError: timeout exceeded
+        ValueError: other exception
+    """
+    usage = None
+    with open(log_path, "ab") as log_fh:
+        output = di.subprocess.Popen(
+            shlex.split(cmd),
+            stdout=log_fh,
+            stderr=subprocess.STDOUT,
+            preexec_fn=preexec_fn,
+        )
+        with track_child(registry, cmd, output):
+            try:
+                if collect_usage:
+                    usage = wait_child(output, timeout)
+                else:
+                    output.wait(timeout=timeout)
+            except subprocess.TimeoutExpired:
+                output.kill()
+                output.wait()
+                raise CommandTimeoutError(read_tail(log_path, tail_bytes))
+            except Exception:
+                output.kill()
+                output.wait()
+                raise ValueError(read_tail(log_path, tail_bytes))
+
+    if output.returncode != 0:
+        raise ValueError(read_tail(log_path, tail_bytes))
+
+    return PopenReturnNT(stdout="", stderr="", usage=usage)
+
+
 def tpe_submit_commands(
     cmds: List[Any],
     thread_count: int,
     timeout: int,
     fn: Callable = subprocess_commands_pipe,
     di=DI,
+    on_success: Optional[Callable[[Any, Any, float], None]] = None,
+    retries: int = 0,
+    backoff: float = 0,
+    on_timeout: Optional[Callable[[Any], List[Any]]] = None,
+    admission: Any = None,
+    max_failures: Optional[int] = None,
+    registry: Optional[ChildRegistry] = None,
+    prefetcher: Any = None,
+    speculator: Any = None,
 ) -> list:
     """Run commands on multiple threads.
 
+    Commands are dispatched in the given order, with at most `thread_count`
+    in flight at once. The overall makespan and the idle tail (time between
+    the first worker running out of work and the last command finishing)
+    are logged once all commands are done.
+
+    Failed commands are retried or replaced as described in CommandQueue.
+    Once more than `max_failures` have failed, pending commands are
+    cancelled and in-flight children in `registry` terminated.
+
     Stdout and stderr are logged on function success.
     Exception logged on function failure.
     Accepts:
@@ -99,58 +255,200 @@ def tpe_submit_commands(
         thread_count (int): Threads to run
         fn (Callable): Function to run using threads, must accept each element of cmds
         timeout: Max time to run in seconds.
+        on_success (Callable): Called with (cmd, result, duration) in the
+            dispatching thread after each success, once freed workers have
+            been refilled.
+        retries (int): Max retries per failed command
+        backoff (float): Base retry delay, in seconds
+        on_timeout (Callable): Returns replacement commands for a timed out
+            command, or an empty list to retry it as is.
+        admission: Optional admission control with `admit(in_flight)` and
+            `poll_interval`, e.g. admission.MemoryAdmission
+        max_failures (int): Failures tolerated before aborting, None for
+            no limit, see dispatch.parse_failure_policy
+        registry (ChildRegistry): Children of fn, terminated on abort, and
+            killed if still running after the registry's grace period
+        prefetcher: Optional prefetch.Prefetcher, shown the queue ahead of
+            each dispatch and told of each dispatched command
+        speculator: Optional speculate.Speculator, duplicating stragglers
+            on free workers once the queue is empty; losing copies are
+            killed through `registry`
     Returns:
         list of commands which raised exceptions
     Raises:
         None
     """
-    exceptions = []
+    queue = CommandQueue(cmds, retries, backoff, on_timeout, max_failures)
+    timer = MakespanTimer()
     with di.futures.ThreadPoolExecutor(max_workers=thread_count) as executor:
-        futures = {executor.submit(fn, cmd, timeout): cmd for cmd in cmds}
-        for future in di.futures.as_completed(futures):
-            cmd = futures[future]
-            try:
-                result = future.result()
-                logger.info(result.stdout)
-                logger.info(result.stderr)
-            except Exception as e:
-                exceptions.append(cmd)
-                logger.error(result.stdout)
-                logger.error(result.stderr)
-    return exceptions
+        futures = {}
+        started = {}
+
+        def submit(cmd):
+            future = executor.submit(fn, cmd, timeout)
+            futures[future] = cmd
+            started[future] = time.time()
+
+        def dispatch():
+            while len(futures) < thread_count and queue.ready():
+                if admission and not admission.admit(len(futures)):
+                    break
+                cmd = queue.pop()
+                if prefetcher:
+                    prefetcher.dispatched(cmd)
+                submit(cmd)
+            if prefetcher:
+                prefetcher.ahead(queue.pending)
+            if speculator and not queue and not queue.aborted:
+                now = time.time()
+                running = {cmd: now - started[f] for f, cmd in futures.items()}
+                free = thread_count - len(futures)
+                if admission and free > 0 and not admission.admit(len(futures)):
+                    free = 0
+                for duplicate in speculator.launch(running, free):
+                    submit(duplicate)
+            timer.check_idle(queue, len(futures), thread_count)
+
+        if prefetcher:
+            prefetcher.ahead(queue.pending)
+
+        dispatch()
+        while futures or queue:
+            if not futures:
+                time.sleep(queue.next_delay())
+                dispatch()
+                continue
+            if queue.aborted and registry is not None:
+                # Also catches children started just before the abort.
+                registry.terminate()
+            wakeup = next_wakeup(queue, len(futures), thread_count, admission)
+            if speculator and registry is not None:
+                # Also catches losers whose child had not started yet.
+                for cmd in speculator.doomed:
+                    registry.kill(cmd)
+            if queue.aborted or (speculator and speculator.doomed):
+                wakeup = ABORT_POLL_INTERVAL
+            elif speculator and not queue and len(futures) < thread_count:
+                # Nothing else is due with the queue empty.
+                wakeup = speculator.poll_interval
+            done, _ = di.futures.wait(
+                futures, timeout=wakeup, return_when=di.futures.FIRST_COMPLETED,
+            )
+            now = time.time()
+            finished = []
+            for future in done:
+                cmd, duration = futures.pop(future), now - started.pop(future)
+                error = future.exception()
+                result = future.result() if error is None else None
+                if speculator:
+                    outcome = speculator.settle(cmd, error, result, duration)
+                    if outcome is None:
+                        continue
+                    cmd, error, result, duration = outcome
+                finished.append((cmd, error, result, duration))
+            # Requeue failures before refilling workers, so retries and
+            # replacements go ahead of commands not yet started.
+            for cmd, error, _, _ in finished:
+                if error is not None:
+                    queue.fail(cmd, error)
+            dispatch()
+            for cmd, error, result, duration in finished:
+                if error is None:
+                    if result.stdout:
+                        logger.info(result.stdout)
+                    if result.stderr:
+                        logger.info(result.stderr)
+                    if speculator:
+                        speculator.observe(cmd, duration)
+                    if on_success:
+                        on_success(cmd, result, duration)
+    timer.log()
+    return queue.exceptions
+
+
+def predict_makespan(costs: List[float], workers: int) -> float:
+    """Simulate greedy list scheduling of costs, in order, over workers.
+    Accepts:
+        costs (List[float]): Cost of each job, in dispatch order
+        workers (int): Number of parallel workers
+    Returns:
+        Predicted makespan, in cost units
+    """
+    loads = [0.0] * max(workers, 1)
+    for cost in costs:
+        heapq.heapreplace(loads, loads[0] + cost)
+    return max(loads)
+
+
+def order_longest_first(cmds: List[Any], costs: List[float]) -> List[Any]:
+    """Sort commands by descending cost, ties kept in input order."""
+    order = sorted(range(len(cmds)), key=lambda i: -costs[i])
+    return [cmds[i] for i in order]
 
 
 def yield_bed_regions(intervals_file: str) -> Generator[str, None, None]:
     """Yield region string from BED file."""
-    with open(intervals_file, "r") as fh:
-        for line in fh:
-            chrom, start, end, *_ = line.strip().split()
-            interval = "{}:{}-{}".format(chrom, int(start) + 1, end)
-            yield interval
+    for interval in yield_bed_intervals(intervals_file):
+        yield interval.region
+
 
+def shard_prefix(shard: Shard, workdir: str = "") -> str:
+    """Path of a shard's files without extension, e.g. `<workdir>/shard-3.1`."""
+    return os.path.join(workdir, SHARD_PREFIX + shard.name)
 
-def get_file_size(filename: pathlib.Path) -> int:
-    """ Gets file size """
-    return filename.stat().st_size
 
+def region_list_path(shard: Shard, workdir: str = "") -> str:
+    """Path of the region list file for a multi-interval shard."""
+    return shard_prefix(shard, workdir) + ".regions.txt"
 
-def format_command(
-    interval_bed_path: str,
+
+def shard_output_path(shard: Shard, workdir: str = "") -> pathlib.Path:
+    """Path of the `MuSE call` output for a shard."""
+    return pathlib.Path(shard_prefix(shard, workdir) + ".MuSE.txt")
+
+
+def write_region_list(shard: Shard, workdir: str = "") -> str:
+    """Write shard intervals as a MuSE region list, one region per line."""
+    path = region_list_path(shard, workdir)
+    with open(path, "w") as fh:
+        for interval in shard.intervals:
+            fh.write(interval.region + "\n")
+    return path
+
+
+def format_shard_commands(
+    shards: List[Shard],
     reference_path: str,
     tumor_bam: str,
     normal_bam: str,
     muse_binary: str = 'muse',
+    workdir: str = "",
 ) -> Generator[str, None, None]:
-    """Yield commands for each BED interval."""
-    for i, interval in enumerate(yield_bed_regions(interval_bed_path)):
-        cmd = CMD_STR.format(
-            muse_binary=muse_binary,
-            reference_path=reference_path,
-            region=interval,
-            tumor_bam=tumor_bam,
-            normal_bam=normal_bam,
-            output_file=i,
-        )
+    """Yield commands for each shard.
+
+    Single-interval shards are passed as a region, larger shards as a
+    region list file, which must already exist (see write_region_list).
+    Outputs and region lists are in `workdir`, default the current directory.
+    """
+    for shard in shards:
+        if len(shard.intervals) == 1:
+            cmd = CMD_STR.format(
+                muse_binary=muse_binary,
+                reference_path=reference_path,
+                region=shard.intervals[0].region,
+                tumor_bam=tumor_bam,
+                normal_bam=normal_bam,
+                output_file=shard_prefix(shard, workdir),
+            )
+        else:
+            cmd = CMD_LIST_STR.format(
+                muse_binary=muse_binary,
+                reference_path=reference_path,
+                region_list=region_list_path(shard, workdir),
+                tumor_bam=tumor_bam,
+                normal_bam=normal_bam,
+                output_file=shard_prefix(shard, workdir),
+            )
         yield cmd
 
 
@@ -181,22 +479,408 @@ def setup_parser() -> argparse.ArgumentParser:
         required=False,
         help="Max time for command to run, in seconds.",
     )
+    parser.add_argument(
+        "--schedule",
+        choices=("bed", "ljf"),
+        default="bed",
+        help="Dispatch order: BED file order, or longest (most costly) job first.",
+    )
+    parser.add_argument(
+        "--weight-column",
+        type=int,
+        default=None,
+        required=False,
+        help="1-based BED column with a numeric cost weight for each interval.",
+    )
+    parser.add_argument(
+        "--shards-per-thread",
+        type=int,
+        default=None,
+        required=False,
+        help=(
+            "Re-shard the BED into this many equal-bp shards per thread, "
+            "using the reference .fai. Default: one shard per BED line."
+        ),
+    )
+    parser.add_argument(
+        "--batch-bp",
+        type=int,
+        default=None,
+        help=(
+            "Pack adjacent intervals, unsplit, into MuSE calls of up to this "
+            "many bp each, saving a MuSE startup per interval on exome and "
+            "panel BEDs."
+        ),
+    )
+    parser.add_argument(
+        "--batch-intervals",
+        type=int,
+        default=None,
+        help="Pack adjacent intervals into MuSE calls of up to this many each.",
+    )
+    parser.add_argument(
+        "--min-tasks-per-thread",
+        type=int,
+        default=4,
+        help=(
+            "With --batch-*, shrink batches as needed to make at least this "
+            "many calls per thread."
+        ),
+    )
+    parser.add_argument(
+        "--shard-padding",
+        type=int,
+        default=1000,
+        help="Never split an interval within this many bp of its edges.",
+    )
+    parser.add_argument(
+        "--merge-intervals",
+        action="store_true",
+        help=(
+            "Sort intervals into reference order and merge overlapping and "
+            "abutting ones, so no position is called twice."
+        ),
+    )
+    parser.add_argument(
+        "--interval-padding",
+        type=int,
+        default=0,
+        help="With --merge-intervals, pad intervals by this many bp each side.",
+    )
+    parser.add_argument(
+        "--plan-only",
+        action="store_true",
+        help="Write the shard plan as BED to stdout and exit.",
+    )
+    parser.add_argument(
+        "--preflight-only",
+        action="store_true",
+        help=(
+            "Check the reference index, BAM headers and indexes and the BED "
+            "against each other, then exit."
+        ),
+    )
+    parser.add_argument(
+        "--no-preflight",
+        action="store_true",
+        help="Skip checking the inputs before starting MuSE calls.",
+    )
+    parser.add_argument(
+        "--manifest",
+        help=(
+            "Run manifest recording each completed shard. Default: in the "
+            "scratch directory."
+        ),
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help=(
+            "Skip shards recorded in --manifest whose outputs still verify, "
+            "and of shards bisected before, run only the unfinished halves. "
+            "Requires the --scratch-dir of the run being resumed."
+        ),
+    )
+    parser.add_argument(
+        "--retries",
+        type=int,
+        default=0,
+        help="Max retries of a failed MuSE call.",
+    )
+    parser.add_argument(
+        "--retry-backoff",
+        type=float,
+        default=30,
+        help="Base retry delay in seconds, doubled after each attempt.",
+    )
+    parser.add_argument(
+        "--failure-policy",
+        type=parse_failure_policy,
+        default="run-all",
+        help=(
+            "On failed MuSE calls (after retries): run-all keeps going, "
+            "fail-fast cancels pending calls and terminates running ones on "
+            "the first failure, and a number K does so on failure K + 1. "
+            "The run fails either way."
+        ),
+    )
+    parser.add_argument(
+        "--bisect-depth",
+        type=int,
+        default=0,
+        help=(
+            "Split a shard that hits --timeout in half and run the halves, "
+            "up to this many times. Default: retry the whole shard instead."
+        ),
+    )
+    parser.add_argument(
+        "--engine",
+        choices=("thread", "asyncio"),
+        default="thread",
+        help="Run MuSE calls from a thread pool, or from an asyncio event loop.",
+    )
+    parser.add_argument(
+        "--kill-grace",
+        type=float,
+        default=10,
+        help="asyncio engine: seconds between SIGTERM and SIGKILL of a child.",
+    )
+    parser.add_argument(
+        "--log-dir",
+        default=None,
+        help=(
+            "Write each shard's MuSE stdout and stderr to <log-dir>/<shard>.log "
+            "instead of logging it. Default: capture and log it."
+        ),
+    )
+    parser.add_argument(
+        "--log-tail-bytes",
+        type=int,
+        default=4096,
+        help="Bytes from the end of a shard log to report when it fails.",
+    )
+    parser.add_argument(
+        "--log-archive",
+        default=None,
+        help="With --log-dir, bundle the shard logs into this .tar.gz at the end.",
+    )
+    parser.add_argument(
+        "--telemetry",
+        action="store_true",
+        help=(
+            "Report wall time, CPU time, peak RSS and I/O of each MuSE call "
+            "next to the merged output. Requires --log-dir and --engine thread."
+        ),
+    )
+    parser.add_argument(
+        "--memory-budget",
+        default=None,
+        help=(
+            "Only start another MuSE call while the running calls plus one "
+            "more are predicted to fit in this memory, e.g. 64G, or 'cgroup' "
+            "for the container's memory limit. Default: no limit."
+        ),
+    )
+    parser.add_argument(
+        "--memory-per-call",
+        default=None,
+        help=(
+            "Predicted RSS of a MuSE call until one has been observed. "
+            "Default: --memory-budget / --thread_count."
+        ),
+    )
+    parser.add_argument(
+        "--max-memory-pressure",
+        type=float,
+        default=10.0,
+        help="Hold back new calls while memory PSI some avg10 exceeds this (%%).",
+    )
+    parser.add_argument(
+        "--bgzf",
+        action="store_true",
+        help=(
+            "Write the merged output BGZF compressed (.MuSE.txt.gz), with a "
+            "tabix index if the records are in reference order."
+        ),
+    )
+    parser.add_argument(
+        "--bgzf-threads",
+        type=int,
+        default=cpu_count(),
+        help="Threads compressing BGZF blocks. Default: all available CPUs.",
+    )
+    parser.add_argument(
+        "--coverage-weight",
+        action="store_true",
+        help=(
+            "Weight each interval's cost by the tumor and normal bytes in it, "
+            "estimated from the BAM indexes, for --schedule ljf."
+        ),
+    )
+    parser.add_argument(
+        "--min-reads",
+        type=float,
+        default=None,
+        help=(
+            "Skip intervals with fewer reads than this in both BAMs, as "
+            "estimated from their indexes; 1 skips intervals with no reads. "
+            "Skipped intervals are listed in multi_muse_skipped.bed, written "
+            "with the merged output."
+        ),
+    )
+    parser.add_argument(
+        "--shard-index",
+        type=int,
+        default=None,
+        help="With --shard-count, the 0-based index of this node.",
+    )
+    parser.add_argument(
+        "--shard-count",
+        type=int,
+        default=None,
+        help=(
+            "Split the run across this many nodes, each running a balanced "
+            "share of the shards and writing a partial result for gather."
+        ),
+    )
+    parser.add_argument(
+        "--progress-interval",
+        type=float,
+        default=60,
+        help=(
+            "Seconds between progress lines, with bp/s and ETA; 0 for just "
+            "a final one."
+        ),
+    )
+    parser.add_argument(
+        "--progress-textfile",
+        default=None,
+        help=(
+            "Keep progress metrics in this Prometheus node-exporter textfile "
+            "(.prom), updated with each progress line."
+        ),
+    )
+    parser.add_argument(
+        "--cpu-affinity",
+        action="store_true",
+        help=(
+            "Pin each running MuSE call to its own share of the CPUs this "
+            "process may use. Requires --engine thread."
+        ),
+    )
+    parser.add_argument(
+        "--numa",
+        action="store_true",
+        help=(
+            "With --cpu-affinity, take each call's CPUs from one NUMA node, "
+            "spreading calls over the nodes."
+        ),
+    )
+    parser.add_argument(
+        "--nice",
+        type=int,
+        default=None,
+        help="Run MuSE calls at this niceness. Requires --engine thread.",
+    )
+    parser.add_argument(
+        "--ionice",
+        default=None,
+        help=(
+            "Run MuSE calls in this I/O scheduling class, CLASS[:LEVEL] with "
+            "CLASS idle, best-effort or realtime and LEVEL 0-7 (default 4). "
+            "Requires --engine thread."
+        ),
+    )
+    parser.add_argument(
+        "--prefetch",
+        action="store_true",
+        help=(
+            "Warm the tumor and normal BAM ranges of the next calls in the "
+            "page cache ahead of dispatch, for BAMs on network filesystems. "
+            "Requires --engine thread."
+        ),
+    )
+    parser.add_argument(
+        "--prefetch-max-size",
+        default="64M",
+        help="Warm at most this much of each BAM per call.",
+    )
+    parser.add_argument(
+        "--speculate",
+        type=float,
+        default=None,
+        metavar="FACTOR",
+        help=(
+            "Once no calls are waiting, start a duplicate of any call running "
+            "FACTOR times longer than expected from its bp and the observed "
+            "bp/s, e.g. 2; the first copy to finish is kept and the other "
+            "killed. Requires --engine thread."
+        ),
+    )
+    parser.add_argument(
+        "--scratch-dir",
+        default=None,
+        help=(
+            "Write shard outputs, region lists and the merged output here, "
+            "e.g. on tmpfs or local NVMe, and move only the merged output to "
+            "the working directory. Kept if the run fails, to --resume from. "
+            "Default: a new private directory under $TMPDIR."
+        ),
+    )
+    parser.add_argument(
+        "--keep-scratch",
+        action="store_true",
+        help="Keep shard outputs in the scratch directory after a successful run.",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        default=None,
+        help=(
+            "Cache shard outputs in this directory, keyed by the inputs and "
+            "regions, and reuse them in later runs. May be shared by "
+            "concurrent runs."
+        ),
+    )
+    parser.add_argument(
+        "--cache-max-size",
+        default="20G",
+        help="Evict least recently used cache entries above this size.",
+    )
     return parser
 
 
-def merge_files(muse_outputs: List[pathlib.Path], out_fh: IO):
-    """Write contents of outputs to given file handler."""
-    # Merge
-    first = True
-    for file in muse_outputs:
-        if get_file_size(file) == 0:
-            logger.error("Empty output: %s", file.name)
-            continue
-        with file.open() as fh:
-            for line in fh:
-                if first or not line.startswith("#"):
-                    out_fh.write(line)
-        first = False
+class OrderedMerger:
+    """Stream outputs into a merged file, in order, as they complete.
+
+    Each output is appended once it and every output before it in `outputs`
+    have completed, so merging overlaps with calling and the merged file
+    follows shard order.
+
+    With `segments`, every output is appended whole, header included, and
+    its offset and size in out_fh recorded in `segments`, so that it can be
+    cut back out of the merged file (see gather).
+    """
+
+    def __init__(
+        self, outputs: List[pathlib.Path], out_fh: IO, segments: bool = False
+    ):
+        self.pending = collections.deque(outputs)
+        self.completed: set = set()
+        self.out_fh = out_fh
+        self.first = True
+        self.merged = 0
+        self.segments: Optional[List[Tuple[pathlib.Path, int, int]]] = None
+        if segments:
+            self.segments = []
+
+    def complete(self, output: pathlib.Path):
+        """Mark output as complete and append every output now in order."""
+        self.completed.add(output)
+        while self.pending and self.pending[0] in self.completed:
+            output = self.pending.popleft()
+            self.completed.discard(output)
+            if not output.exists():
+                logger.error("Missing output: %s", output.name)
+                continue
+            if self.segments is None:
+                if append_output(output, self.out_fh, self.first):
+                    self.first = False
+            else:
+                offset = self.out_fh.tell()
+                append_output(output, self.out_fh, True)
+                self.segments.append((output, offset, self.out_fh.tell() - offset))
+            self.merged += 1
+
+    def replace(self, output: pathlib.Path, outputs: List[pathlib.Path]):
+        """Replace a pending output by several, merged in its place."""
+        i = self.pending.index(output)
+        del self.pending[i]
+        for j, new_output in enumerate(outputs):
+            self.pending.insert(i + j, new_output)
+
+    @property
+    def finished(self) -> bool:
+        return not self.pending
 
 
 def process_argv(argv: Optional[List] = None) -> namedtuple:
@@ -215,42 +899,587 @@ def process_argv(argv: Optional[List] = None) -> namedtuple:
     return run_args(**args_dict)
 
 
+def command_runner(
+    run_args,
+    log_path: Optional[Callable[[str], str]],
+    registry: ChildRegistry,
+    placement: Optional[Placement] = None,
+) -> Callable:
+    """Function running one command, for the selected engine and log mode,
+    placed on a slot's CPUs if `placement` is given (thread engine only)."""
+    if run_args.engine == "asyncio":
+        if log_path:
+            return lambda cmd, timeout: async_commands_logfile(
+                cmd,
+                timeout,
+                log_path(cmd),
+                run_args.log_tail_bytes,
+                run_args.kill_grace,
+                registry=registry,
+            )
+        return functools.partial(
+            async_commands_pipe, grace=run_args.kill_grace, registry=registry
+        )
+    if log_path:
+
+        def fn(cmd, timeout, **kwargs):
+            return subprocess_commands_logfile(
+                cmd,
+                timeout,
+                log_path(cmd),
+                run_args.log_tail_bytes,
+                collect_usage=run_args.telemetry,
+                registry=registry,
+                **kwargs,
+            )
+
+    else:
+        fn = functools.partial(subprocess_commands_pipe, registry=registry)
+    return placement.wrap(fn) if placement else fn
+
+
+def apply_coverage(
+    store: IntervalStore, run_args, skipped_path: str
+) -> IntervalStore:
+    """Weight intervals by BAM coverage and skip uncovered ones, as configured.
+
+    Skipped intervals are written to `skipped_path` with their estimated
+    tumor and normal reads.
+    """
+    indexes = [
+        load_bam_index(run_args.tumor_bam),
+        load_bam_index(run_args.normal_bam),
+    ]
+    kept = IntervalStore(store.contigs)
+    n_skipped = skipped_bp = 0
+    with contextlib.ExitStack() as stack:
+        skipped_fh = None
+        if run_args.min_reads is not None:
+            skipped_fh = stack.enter_context(open(skipped_path, "w"))
+        for interval in store:
+            weighted, estimates = weigh_interval(
+                interval, indexes, run_args.coverage_weight, run_args.min_reads
+            )
+            if weighted is not None:
+                kept.append(*weighted)
+                continue
+            n_skipped += 1
+            skipped_bp += interval.length
+            skipped_fh.write(
+                "{}\t{}\t{}\t{}\n".format(
+                    interval.chrom,
+                    interval.start,
+                    interval.end,
+                    "\t".join(str(round(e.reads, 1)) for e in estimates),
+                )
+            )
+    if run_args.min_reads is not None:
+        logger.info(
+            "Skipped %s of %s intervals (%s bp) with under %s estimated reads",
+            n_skipped,
+            len(store),
+            skipped_bp,
+            run_args.min_reads,
+        )
+    return kept
+
+
+def open_shard_cache(run_args) -> ShardCache:
+    """Open the shard cache for this run's reference, BAMs and MuSE."""
+    bam_indexes = []
+    for bam_path in (run_args.tumor_bam, run_args.normal_bam):
+        try:
+            bam_indexes.append(find_bai(bam_path))
+        except ValueError:
+            pass
+    fingerprint = input_fingerprint(
+        run_args.reference_path,
+        run_args.tumor_bam,
+        run_args.normal_bam,
+        run_args.muse_binary,
+        tuple(bam_indexes),
+    )
+    return ShardCache(
+        run_args.cache_dir, parse_size(run_args.cache_max_size), fingerprint
+    )
+
+
 def run(run_args):
     """Main script logic.
     Creates muse commands for each BED region and executes in multiple threads.
     """
+    if run_args.shards_per_thread and (
+        run_args.batch_bp or run_args.batch_intervals
+    ):
+        raise ValueError("--shards-per-thread and --batch-* are exclusive")
+    if run_args.shard_count:
+        if run_args.shard_index is None or not (
+            0 <= run_args.shard_index < run_args.shard_count
+        ):
+            raise ValueError("--shard-index must be in [0, --shard-count)")
+        if run_args.bgzf:
+            raise ValueError("--bgzf applies to gather, not to partial results")
+    if run_args.resume and not run_args.scratch_dir:
+        raise ValueError("--resume requires the --scratch-dir of the run to resume")
 
-    run_commands = list(
-        format_command(
-            run_args.interval_bed_path,
+    store = IntervalStore.from_bed(
+        run_args.interval_bed_path, run_args.weight_column
+    )
+    stats = store.stats()
+    logger.info(
+        "Loaded %s intervals on %s contigs, %s bp (min %s, median %s, max %s bp)",
+        stats.count,
+        stats.contigs,
+        stats.bp,
+        stats.min,
+        stats.median,
+        stats.max,
+    )
+    if not run_args.no_preflight:
+        preflight(
             run_args.reference_path,
-            run_args.tumor_bam,
-            run_args.normal_bam,
-            run_args.muse_binary,
+            [run_args.tumor_bam, run_args.normal_bam],
+            store,
         )
+    if run_args.preflight_only:
+        return
+    workspace = Workspace(run_args.scratch_dir)
+    logger.info("Scratch directory: %s", workspace.path)
+    # Reports published next to the merged output, once complete.
+    skipped_path = workspace.join(SHARD_PREFIX + "skipped.bed")
+
+    def publish_reports():
+        if os.path.exists(skipped_path):
+            publish(skipped_path, "multi_muse_skipped.bed")
+
+    if run_args.merge_intervals:
+        fai = read_fai(run_args.reference_path)
+        store = store.sorted([record.contig for record in fai]).merged(
+            run_args.interval_padding, dict(fai)
+        )
+        logger.info("Merged into %s intervals, %s bp", len(store), store.bp)
+    if run_args.coverage_weight or run_args.min_reads is not None:
+        store = apply_coverage(store, run_args, skipped_path)
+    if run_args.batch_bp or run_args.batch_intervals:
+        shards = pack_intervals(
+            store,
+            read_fai(run_args.reference_path),
+            run_args.batch_bp,
+            run_args.batch_intervals,
+            run_args.min_tasks_per_thread * run_args.thread_count,
+        )
+        logger.info(
+            "Packed %s intervals into %s region-list batches",
+            len(store),
+            len(shards),
+        )
+    elif run_args.shards_per_thread:
+        shards = plan_shards(
+            store,
+            read_fai(run_args.reference_path),
+            run_args.shards_per_thread * run_args.thread_count,
+            run_args.shard_padding,
+        )
+        logger.info("Planned %s shards from %s intervals", len(shards), len(store))
+    else:
+        shards = shards_from_intervals(store)
+
+    plan = shards
+    if run_args.shard_count:
+        shards = partition_shards(plan, run_args.shard_count)[run_args.shard_index]
+        logger.info(
+            "Node %s of %s: %s of %s shards",
+            run_args.shard_index,
+            run_args.shard_count,
+            len(shards),
+            len(plan),
+        )
+
+    if run_args.plan_only:
+        write_plan(shards, sys.stdout)
+        publish_reports()
+        if not run_args.keep_scratch:
+            workspace.cleanup()
+        return
+
+    manifest_path = run_args.manifest or workspace.join(
+        SHARD_PREFIX + "manifest.jsonl"
     )
-    # Start Queue
-    exceptions = tpe_submit_commands(
-        run_commands, run_args.thread_count, run_args.timeout
-    )
-    if exceptions:
-        for e in exceptions:
-            logger.error(e)
-        raise ValueError("Exceptions raised during processing.")
 
-    # Check and merge outputs
-    p = pathlib.Path('.')
-    outputs = list(p.glob("*.MuSE.txt"))
+    def shard_commands(shards: List[Shard]) -> List[str]:
+        for shard in shards:
+            if len(shard.intervals) > 1:
+                write_region_list(shard, workspace.path)
+        return list(
+            format_shard_commands(
+                shards,
+                run_args.reference_path,
+                run_args.tumor_bam,
+                run_args.normal_bam,
+                run_args.muse_binary,
+                workspace.path,
+            )
+        )
+
+    run_commands = shard_commands(shards)
+    outputs = [shard_output_path(shard, workspace.path) for shard in shards]
+    shard_by_cmd = dict(zip(run_commands, shards))
+    output_by_cmd = dict(zip(run_commands, outputs))
+
+    def split_command(cmd: str) -> List[str]:
+        """Bisect a command's shard, returning the commands of its halves."""
+        children = bisect_shard(shard_by_cmd[cmd], run_args.shard_padding)
+        child_commands = shard_commands(children)
+        shard_by_cmd.update(zip(child_commands, children))
+        output_by_cmd.update(
+            (child_cmd, shard_output_path(child, workspace.path))
+            for child_cmd, child in zip(child_commands, children)
+        )
+        return child_commands
+
+    resumed = []
+    # Commands bisected by the run resumed, with the commands replacing them.
+    resplit: List[Tuple[str, List[str]]] = []
+    if run_args.resume:
+        records = load_manifest(manifest_path)
+        splits = load_splits(manifest_path)
+
+        def expand(cmd: str) -> List[str]:
+            if cmd not in splits:
+                return [cmd]
+            children = split_command(cmd)
+            if children != splits[cmd].children:
+                # Bisected differently, e.g. with other padding: start over.
+                return [cmd]
+            resplit.append((cmd, children))
+            return [leaf for child in children for leaf in expand(child)]
+
+        run_commands = [leaf for cmd in run_commands for leaf in expand(cmd)]
+        resumed = [
+            cmd
+            for cmd in run_commands
+            if cmd in records and verify_record(records[cmd])
+        ]
+        logger.info(
+            "Resuming: %s of %s shards complete, %s shards bisected before",
+            len(resumed),
+            len(run_commands),
+            len(resplit),
+        )
+    run_commands = [cmd for cmd in run_commands if cmd not in set(resumed)]
+
+    cache = None
+    cached = []
+    if run_args.cache_dir:
+        cache = open_shard_cache(run_args)
+        cached = [
+            cmd
+            for cmd in run_commands
+            if cache.fetch(shard_by_cmd[cmd].regions, output_by_cmd[cmd])
+        ]
+        run_commands = [cmd for cmd in run_commands if cmd not in set(cached)]
+    costs = [shard_by_cmd[cmd].cost for cmd in run_commands]
+
+    if run_args.schedule == "ljf":
+        workers = run_args.thread_count
+        logger.info(
+            "Predicted makespan (cost): BED order %s, longest first %s, ideal %s",
+            round(predict_makespan(costs, workers)),
+            round(predict_makespan(sorted(costs, reverse=True), workers)),
+            round(sum(costs) / max(workers, 1)),
+        )
+        run_commands = order_longest_first(run_commands, costs)
+
+    if run_args.telemetry and (not run_args.log_dir or run_args.engine != "thread"):
+        raise ValueError("--telemetry requires --log-dir and --engine thread")
+    if run_args.prefetch and run_args.engine != "thread":
+        raise ValueError("--prefetch requires --engine thread")
+    if run_args.speculate and run_args.engine != "thread":
+        raise ValueError("--speculate requires --engine thread")
+    placement = None
+    if run_args.cpu_affinity or run_args.nice is not None or run_args.ionice:
+        if run_args.engine != "thread":
+            raise ValueError(
+                "--cpu-affinity, --nice and --ionice require --engine thread"
+            )
+        slots = []
+        if run_args.cpu_affinity:
+            slots = split_cpus(
+                sorted(os.sched_getaffinity(0)),
+                run_args.thread_count,
+                read_numa_nodes() if run_args.numa else None,
+            )
+        placement = Placement(slots, run_args.nice, run_args.ionice)
+        placement.log(logger)
+
+    # Start Queue, merging outputs in shard order as they complete
+    merged_output_path = "multi_muse_call_merged.MuSE.txt"
+    if run_args.bgzf:
+        merged_output_path += ".gz"
+    if run_args.shard_count:
+        merged_output_path, descriptor_path = partial_paths(
+            run_args.shard_index, run_args.shard_count
+        )
+    staged_output_path = workspace.join(os.path.basename(merged_output_path))
+    telemetry: List[dict] = []
+    with open_merged(
+        staged_output_path, run_args.bgzf, run_args.bgzf_threads
+    ) as fh, RunManifest(
+        manifest_path, append=run_args.resume
+    ) as manifest:
+        merger = OrderedMerger(outputs, fh, segments=bool(run_args.shard_count))
+        progress = ProgressTracker(
+            shards,
+            run_args.progress_interval,
+            run_args.progress_textfile,
+            running=lambda: len(registry),
+            labels=dict(output=os.path.abspath(merged_output_path)),
+        )
+        for cmd, child_commands in resplit:
+            merger.replace(
+                output_by_cmd[cmd], [output_by_cmd[child] for child in child_commands]
+            )
+        for cmd in resumed:
+            merger.complete(output_by_cmd[cmd])
+            progress.complete(shard_by_cmd[cmd], skipped=True)
+        for cmd in cached:
+            shard = shard_by_cmd[cmd]
+            manifest.write(
+                make_record(shard.index, shard.regions, cmd, output_by_cmd[cmd], 0.0)
+            )
+            merger.complete(output_by_cmd[cmd])
+            progress.complete(shard, skipped=True)
+
+        def on_success(cmd, result, duration):
+            shard = shard_by_cmd[cmd]
+            output = output_by_cmd[cmd]
+            manifest.write(
+                make_record(shard.index, shard.regions, cmd, output, duration)
+            )
+            if cache:
+                cache.publish(shard.regions, output)
+            merger.complete(output)
+            progress.complete(shard)
+            if result.usage and admission:
+                admission.observe_peak(result.usage.max_rss_kb * 1024)
+            if result.usage:
+                telemetry.append(
+                    dict(
+                        shard=shard.name,
+                        regions=shard.regions,
+                        bp=shard.bp,
+                        **result.usage._asdict(),
+                    )
+                )
+
+        def on_timeout(cmd):
+            shard = shard_by_cmd[cmd]
+            if len(shard.part) >= run_args.bisect_depth:
+                return []
+            child_commands = split_command(cmd)
+            if not child_commands:
+                return []
+            # Recorded so that --resume runs only the halves not yet done.
+            manifest.write(SplitRecord(shard.index, cmd, child_commands))
+            merger.replace(
+                output_by_cmd[cmd], [output_by_cmd[child] for child in child_commands]
+            )
+            return child_commands
+
+        def log_path_for(cmd):
+            name = shard_by_cmd[cmd].name
+            if cmd in speculative:
+                name += ".speculative"
+            return os.path.join(run_args.log_dir, "{}.log".format(name))
+
+        if run_args.log_dir:
+            os.makedirs(run_args.log_dir, exist_ok=True)
+
+        registry = ChildRegistry()
+        admission = None
+        if run_args.memory_budget:
+            budget = resolve_budget(run_args.memory_budget)
+            admission = MemoryAdmission(
+                budget,
+                registry,
+                initial_estimate=(
+                    parse_size(run_args.memory_per_call)
+                    if run_args.memory_per_call
+                    else budget // max(run_args.thread_count, 1)
+                ),
+                max_pressure=run_args.max_memory_pressure,
+            )
+            logger.info("Memory budget: %s MiB", budget >> 20)
+
+        engine_kwargs = dict(
+            fn=command_runner(
+                run_args,
+                log_path_for if run_args.log_dir else None,
+                registry,
+                placement,
+            ),
+            on_success=on_success,
+            retries=run_args.retries,
+            backoff=run_args.retry_backoff,
+            on_timeout=on_timeout,
+            admission=admission,
+            max_failures=run_args.failure_policy,
+        )
+        if run_args.engine == "asyncio":
+            submit_commands = aio_submit_commands
+            engine_kwargs.update(grace=run_args.kill_grace)
+        else:
+            submit_commands = tpe_submit_commands
+            engine_kwargs.update(registry=registry)
+
+        speculator = None
+        speculative = set()
+        if run_args.speculate:
+            speculative_dir = workspace.join(SHARD_PREFIX + "speculative")
+
+            def duplicate(cmd):
+                shard = shard_by_cmd[cmd]
+                os.makedirs(speculative_dir, exist_ok=True)
+                if len(shard.intervals) > 1:
+                    write_region_list(shard, speculative_dir)
+                (dup,) = format_shard_commands(
+                    [shard],
+                    run_args.reference_path,
+                    run_args.tumor_bam,
+                    run_args.normal_bam,
+                    run_args.muse_binary,
+                    speculative_dir,
+                )
+                shard_by_cmd[dup] = shard
+                output_by_cmd[dup] = shard_output_path(shard, speculative_dir)
+                speculative.add(dup)
+                return dup
+
+            def discard(dup):
+                shard = shard_by_cmd[dup]
+                for path in (
+                    output_by_cmd[dup],
+                    region_list_path(shard, speculative_dir),
+                ):
+                    if os.path.exists(path):
+                        os.unlink(path)
+
+            def promote(cmd, dup):
+                publish(str(output_by_cmd[dup]), str(output_by_cmd[cmd]))
+                discard(dup)
+
+            speculator = Speculator(
+                lambda cmd: shard_by_cmd[cmd].bp,
+                duplicate,
+                promote,
+                discard,
+                run_args.speculate,
+            )
+            engine_kwargs.update(speculator=speculator)
+
+        prefetcher = None
+        if run_args.prefetch:
+            indexes = [
+                load_bam_index(run_args.tumor_bam),
+                load_bam_index(run_args.normal_bam),
+            ]
+            max_bytes = parse_size(run_args.prefetch_max_size)
+            prefetcher = Prefetcher(
+                lambda cmd: bam_ranges(indexes, shard_by_cmd[cmd].intervals, max_bytes),
+                depth=2 * run_args.thread_count,
+            )
+            engine_kwargs.update(prefetcher=prefetcher)
+
+        with progress, prefetcher or contextlib.nullcontext():
+            exceptions = submit_commands(
+                run_commands, run_args.thread_count, run_args.timeout, **engine_kwargs
+            )
+
+    if admission:
+        logger.info(
+            "Memory admission held back dispatch %s times, peak observed child "
+            "RSS %s MiB",
+            admission.throttled,
+            admission.peak_rss >> 20,
+        )
+
+    if cache:
+        cache.log_stats(logger)
+    if prefetcher:
+        prefetcher.log_stats(logger)
+    if speculator:
+        speculator.log_stats(logger)
+
+    if run_args.telemetry:
+        report_path = merged_output_path.split(".MuSE.txt")[0] + ".telemetry"
+        telemetry.sort(key=lambda row: [int(i) for i in row["shard"].split(".")])
+        with open(report_path + ".tsv", "w") as fh:
+            write_report_tsv(telemetry, fh)
+        with open(report_path + ".json", "w") as fh:
+            write_report_json(telemetry, fh)
+        logger.info("Wrote telemetry of %s shards to %s.*", len(telemetry), report_path)
+
+    if run_args.log_dir and run_args.log_archive:
+        archive_logs(run_args.log_dir, run_args.log_archive)
+        logger.info("Archived shard logs to %s", run_args.log_archive)
+    if exceptions:
+        failed = {output_by_cmd[cmd] for cmd in exceptions}
+        not_run = [
+            output
+            for output in merger.pending
+            if output not in failed and output not in merger.completed
+        ]
+        logger.info(
+            "Kept scratch directory %s, resume with --resume --scratch-dir %s",
+            workspace.path,
+            workspace.path,
+        )
+        raise ValueError(
+            "{} shards failed: {}{}".format(
+                len(exceptions),
+                ", ".join(shard_by_cmd[cmd].name for cmd in exceptions),
+                "; {} not run".format(len(not_run)) if not_run else "",
+            )
+        )
 
     # Sanity check
-    if len(run_commands) != len(outputs):
+    if not merger.finished:
         logger.error("Number of output files not expected")
 
-    merged_output_path = "multi_muse_call_merged.MuSE.txt"
-    with open(merged_output_path, 'w') as fh:
-        merge_files(outputs, fh)
+    publish_indexed(staged_output_path, merged_output_path)
+    logger.info("Wrote %s", merged_output_path)
+    publish_reports()
+
+    if run_args.shard_count:
+        shard_by_output = {
+            output_by_cmd[cmd]: shard for cmd, shard in shard_by_cmd.items()
+        }
+        try:
+            contigs = [record.contig for record in read_fai(run_args.reference_path)]
+        except OSError:
+            contigs = None
+        write_descriptor(
+            descriptor_path,
+            run_args.shard_index,
+            run_args.shard_count,
+            plan,
+            contigs,
+            dict(
+                reference_path=run_args.reference_path,
+                interval_bed_path=run_args.interval_bed_path,
+                tumor_bam=run_args.tumor_bam,
+                normal_bam=run_args.normal_bam,
+            ),
+            merged_output_path,
+            [
+                (shard_by_output[output], offset, size)
+                for output, offset, size in merger.segments
+            ],
+        )
+        logger.info("Wrote partial result %s", descriptor_path)
 
-    return
+    if not run_args.keep_scratch:
+        workspace.cleanup()
 
 
 def main(argv=None) -> int:
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+Place MuSE children on dedicated cores, with nice and ionice priorities.
+
+Each running child holds one of --thread_count slots, and each slot owns
+a share of the CPUs this process may run on, so children neither float
+across sockets nor contend for the same cores. With NUMA, each slot's
+CPUs are taken from one node (as listed in /sys), and slots are spread
+over the nodes in turn.
+
+Settings are applied in the child between fork and exec, by a subprocess
+`preexec_fn`. The subprocess docs warn that `preexec_fn` is not safe when
+the parent has threads, as the dispatcher does: a lock held by another
+thread at fork stays held in the child. The hook is kept to the system
+calls themselves (sched_setaffinity, setpriority, ioprio_set), with
+everything it needs prepared in the parent, but is not guaranteed to be
+safe.
+"""
+import contextlib
+import ctypes
+import glob
+import logging
+import os
+import platform
+import re
+import threading
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+NUMA_ROOT = "/sys/devices/system/node"
+
+# ioprio_set(2): classes, and the syscall number per architecture.
+IOPRIO_CLASSES = {"realtime": 1, "best-effort": 2, "idle": 3}
+IOPRIO_CLASS_SHIFT = 13
+IOPRIO_WHO_PROCESS = 1
+SYS_IOPRIO_SET = {"x86_64": 251, "aarch64": 30, "ppc64le": 273, "i686": 289}
+
+
+def parse_cpulist(text: str) -> List[int]:
+    """CPUs of a kernel cpulist, e.g. "0-3,8" is [0, 1, 2, 3, 8]."""
+    cpus: List[int] = []
+    for part in text.strip().split(","):
+        if not part:
+            continue
+        first, _, last = part.partition("-")
+        cpus.extend(range(int(first), int(last or first) + 1))
+    return cpus
+
+
+def format_cpulist(cpus: List[int]) -> str:
+    """Kernel cpulist of CPUs, e.g. [0, 1, 2, 3, 8] is "0-3,8"."""
+    parts: List[str] = []
+    cpus = sorted(cpus)
+    start = 0
+    for i in range(1, len(cpus) + 1):
+        if i == len(cpus) or cpus[i] != cpus[i - 1] + 1:
+            first, last = cpus[start], cpus[i - 1]
+            parts.append(str(first) if first == last else "{}-{}".format(first, last))
+            start = i
+    return ",".join(parts)
+
+
+def read_numa_nodes(root: str = NUMA_ROOT) -> Dict[int, List[int]]:
+    """CPUs of each NUMA node, empty if the system does not list any."""
+    nodes = {}
+    for path in glob.glob(os.path.join(root, "node[0-9]*", "cpulist")):
+        node = int(re.search(r"node(\d+)", path).group(1))
+        with open(path, "r") as fh:
+            nodes[node] = parse_cpulist(fh.read())
+    return nodes
+
+
+def split_cpus(
+    cpus: List[int], slots: int, nodes: Optional[Dict[int, List[int]]] = None
+) -> List[Tuple[List[int], Optional[int]]]:
+    """Split CPUs into one contiguous set per slot, and its NUMA node.
+
+    Slots are dealt to nodes in turn, and each node's CPUs split evenly
+    between its slots. With more slots than CPUs, slots get one CPU each,
+    shared in turn.
+    Accepts:
+        cpus (List[int]): CPUs available
+        slots (int): Number of slots
+        nodes (Dict[int, List[int]]): CPUs of each NUMA node, if any
+    Returns:
+        List of (CPUs, node or None), one per slot
+    """
+    available = set(cpus)
+    groups = [
+        (sorted(available.intersection(node_cpus)), node)
+        for node, node_cpus in sorted((nodes or {}).items())
+    ]
+    groups = [(group, node) for group, node in groups if group]
+    if not groups:
+        groups = [(sorted(available), None)]
+    dealt: List[List[int]] = [[] for _ in groups]
+    for slot in range(slots):
+        dealt[slot % len(groups)].append(slot)
+
+    assignment: List[Tuple[List[int], Optional[int]]] = [([], None)] * slots
+    for (group, node), group_slots in zip(groups, dealt):
+        n = len(group_slots)
+        for i, slot in enumerate(group_slots):
+            if n >= len(group):
+                share = [group[i % len(group)]]
+            else:
+                share = group[i * len(group) // n : (i + 1) * len(group) // n]
+            assignment[slot] = (share, node)
+    return assignment
+
+
+def parse_ionice(ionice: str) -> int:
+    """ioprio value of "CLASS[:LEVEL]", e.g. "best-effort:7" or "idle".
+    Raises:
+        ValueError: unknown class or level out of 0-7
+    """
+    name, _, level = ionice.partition(":")
+    if name not in IOPRIO_CLASSES:
+        raise ValueError(
+            "Unknown I/O class {}, expected one of {}".format(
+                name, ", ".join(IOPRIO_CLASSES)
+            )
+        )
+    level = int(level or 4)
+    if not 0 <= level <= 7:
+        raise ValueError("I/O priority level must be 0-7, got {}".format(level))
+    return IOPRIO_CLASSES[name] << IOPRIO_CLASS_SHIFT | level
+
+
+def ioprio_setter() -> Callable[[int], int]:
+    """Function setting the I/O priority of the calling process.
+    Raises:
+        ValueError: not supported on this platform
+    """
+    number = SYS_IOPRIO_SET.get(platform.machine())
+    if not number or platform.system() != "Linux":
+        raise ValueError("ionice is not supported on {}".format(platform.machine()))
+    syscall = ctypes.CDLL(None, use_errno=True).syscall
+    return lambda ioprio: syscall(number, IOPRIO_WHO_PROCESS, 0, ioprio)
+
+
+class Placement:
+    """Slots of CPUs, niceness and I/O priority for running children.
+    Accepts:
+        slots (List[Tuple[List[int], Optional[int]]]): CPUs and NUMA node
+            of each slot, see split_cpus; empty to leave affinity alone
+        nice (int): Niceness of children
+        ionice (str): I/O class and level of children, see parse_ionice
+    """
+
+    def __init__(
+        self,
+        slots: List[Tuple[List[int], Optional[int]]],
+        nice: Optional[int] = None,
+        ionice: Optional[str] = None,
+    ):
+        self.slots = slots
+        self.nice = nice
+        self.ionice = ionice
+        self.ioprio = parse_ionice(ionice) if ionice else None
+        self._set_ioprio = ioprio_setter() if ionice else None
+        self._free = list(range(len(slots)))
+        self._lock = threading.Lock()
+
+    def log(self, log: logging.Logger):
+        for slot, (cpus, node) in enumerate(self.slots):
+            log.info(
+                "Slot %s: CPUs %s%s",
+                slot,
+                format_cpulist(cpus),
+                "" if node is None else " on NUMA node {}".format(node),
+            )
+        if self.nice is not None or self.ionice:
+            log.info("MuSE calls run with nice %s, ionice %s", self.nice, self.ionice)
+
+    def preexec(self, cpus: Optional[List[int]]) -> Callable[[], None]:
+        """Hook applying the settings in a forked child, before exec."""
+        nice, ioprio, set_ioprio = self.nice, self.ioprio, self._set_ioprio
+
+        # Runs in the child of a threaded parent, see the module docstring:
+        # no logging, imports or locks here, only the system calls.
+        def apply():
+            if cpus:
+                os.sched_setaffinity(0, cpus)
+            if nice is not None:
+                os.setpriority(os.PRIO_PROCESS, 0, nice)
+            if set_ioprio is not None and set_ioprio(ioprio) != 0:
+                raise OSError(ctypes.get_errno(), "ioprio_set failed")
+
+        return apply
+
+    @contextlib.contextmanager
+    def slot(self) -> Iterator[Callable[[], None]]:
+        """Hold a free slot while a child runs, yielding its preexec hook.
+
+        There is a slot for every worker, so one is always free.
+        """
+        if not self.slots:
+            yield self.preexec(None)
+            return
+        with self._lock:
+            slot = self._free.pop(0)
+        try:
+            yield self.preexec(self.slots[slot][0])
+        finally:
+            with self._lock:
+                self._free.append(slot)
+
+    def wrap(self, fn: Callable) -> Callable:
+        """Command runner passing a slot's hook to `fn` as `preexec_fn`."""
+
+        def run_placed(cmd, timeout):
+            with self.slot() as preexec_fn:
+                return fn(cmd, timeout, preexec_fn=preexec_fn)
+
+        return run_placed
+
+
+# __END__
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""
+Re-shard BED intervals into balanced MuSE work units.
+"""
+import hashlib
+import heapq
+import math
+from typing import IO, Iterable, List, NamedTuple, Optional, Tuple
+
+from muse_tool.intervals import BedInterval, FaiRecord
+
+
+class Shard(NamedTuple):
+    """One MuSE call: an ordered group of intervals.
+
+    Shards split after planning (see bisect_shard) keep their parent's
+    index and record their position within it in `part`.
+    """
+
+    index: int
+    intervals: Tuple[BedInterval, ...]
+    part: Tuple[int, ...] = ()
+
+    @property
+    def name(self) -> str:
+        """Unique name, ordered like the shard, e.g. "3" or "3.1.0"."""
+        return ".".join(str(i) for i in (self.index,) + self.part)
+
+    @property
+    def bp(self) -> int:
+        return sum(interval.length for interval in self.intervals)
+
+    @property
+    def cost(self) -> float:
+        return sum(interval.cost for interval in self.intervals)
+
+    @property
+    def regions(self) -> List[str]:
+        return [interval.region for interval in self.intervals]
+
+
+def shards_from_intervals(intervals: Iterable[BedInterval]) -> List[Shard]:
+    """One shard per interval, in input order."""
+    return [Shard(i, (interval,)) for i, interval in enumerate(intervals)]
+
+
+def sort_intervals(
+    intervals: Iterable[BedInterval], contigs: List[FaiRecord]
+) -> List[BedInterval]:
+    """Sort intervals into reference order, clipped to contig length.
+    Raises:
+        ValueError: interval on a contig missing from the reference
+    """
+    lengths = {record.contig: record.length for record in contigs}
+    rank = {record.contig: i for i, record in enumerate(contigs)}
+    clipped = []
+    for interval in intervals:
+        if interval.chrom not in lengths:
+            raise ValueError(
+                "Contig not in reference index: {}".format(interval.region)
+            )
+        end = min(interval.end, lengths[interval.chrom])
+        if end > interval.start:
+            clipped.append(interval._replace(end=end))
+    return sorted(clipped, key=lambda i: (rank[i.chrom], i.start, i.end))
+
+
+def plan_shards(
+    intervals: Iterable[BedInterval],
+    contigs: List[FaiRecord],
+    shard_count: int,
+    padding: int = 0,
+) -> List[Shard]:
+    """Split or coalesce intervals into roughly equal-bp shards.
+
+    Intervals are walked in reference order and packed into shards of
+    about `total_bp / shard_count` each. Intervals too large for the
+    remaining room are split, but never within `padding` bp of either
+    interval edge; intervals too short to split are kept whole.
+    Accepts:
+        intervals (Iterable[BedInterval]): Intervals to plan
+        contigs (List[FaiRecord]): Reference contigs, in reference order
+        shard_count (int): Target number of shards
+        padding (int): Minimum distance between a split and an interval edge
+    Returns:
+        List of Shard, in reference order
+    """
+    ordered = sort_intervals(intervals, contigs)
+    total = sum(interval.length for interval in ordered)
+    target = max(1, math.ceil(total / max(shard_count, 1)))
+
+    shards: List[Shard] = []
+    current: List[BedInterval] = []
+    filled = 0
+
+    def flush():
+        nonlocal current, filled
+        if current:
+            shards.append(Shard(len(shards), tuple(current)))
+        current, filled = [], 0
+
+    for interval in ordered:
+        while interval is not None:
+            room = target - filled
+            if interval.length <= room:
+                current.append(interval)
+                filled += interval.length
+                interval = None
+            elif interval.length >= 2 * padding + 2:
+                lo = interval.start + max(padding, 1)
+                hi = interval.end - max(padding, 1)
+                cut = min(max(interval.start + room, lo), hi)
+                current.append(interval._replace(end=cut))
+                interval = interval._replace(start=cut)
+                flush()
+            elif current and room < interval.length / 2:
+                flush()
+            else:
+                current.append(interval)
+                filled += interval.length
+                interval = None
+            if filled >= target:
+                flush()
+    flush()
+    return shards
+
+
+def pack_intervals(
+    intervals: Iterable[BedInterval],
+    contigs: List[FaiRecord],
+    target_bp: Optional[int] = None,
+    target_count: Optional[int] = None,
+    min_shards: int = 1,
+) -> List[Shard]:
+    """Pack runs of adjacent intervals into shards, without splitting any.
+
+    Intervals are walked in reference order and added to a shard until it
+    holds `target_count` intervals, or until the next interval would take
+    it over `target_bp`. An interval larger than `target_bp` gets a shard
+    of its own. Both targets are lowered as needed to keep at least
+    `min_shards` shards, so that small BEDs still fill every worker.
+    Accepts:
+        intervals (Iterable[BedInterval]): Intervals to pack
+        contigs (List[FaiRecord]): Reference contigs, in reference order
+        target_bp (int): Max bp per shard
+        target_count (int): Max intervals per shard
+        min_shards (int): Lower the targets to make at least this many shards
+    Returns:
+        List of Shard, in reference order
+    """
+    ordered = sort_intervals(intervals, contigs)
+    min_shards = max(min_shards, 1)
+    if target_bp:
+        total = sum(interval.length for interval in ordered)
+        target_bp = max(1, min(target_bp, math.ceil(total / min_shards)))
+    if target_count:
+        target_count = max(1, min(target_count, math.ceil(len(ordered) / min_shards)))
+
+    shards: List[Shard] = []
+    current: List[BedInterval] = []
+    filled = 0
+    for interval in ordered:
+        if current and (
+            (target_bp and filled + interval.length > target_bp)
+            or (target_count and len(current) >= target_count)
+        ):
+            shards.append(Shard(len(shards), tuple(current)))
+            current, filled = [], 0
+        current.append(interval)
+        filled += interval.length
+    if current:
+        shards.append(Shard(len(shards), tuple(current)))
+    return shards
+
+
+def bisect_shard(shard: Shard, padding: int = 0) -> List[Shard]:
+    """Split a shard into two halves of roughly equal bp.
+
+    Multi-interval shards are split between intervals; a single interval is
+    split at its midpoint, unless that would fall within `padding` bp of
+    its edges.
+    Returns:
+        Two child shards, or an empty list if the shard cannot be split
+    """
+    intervals = shard.intervals
+    if len(intervals) > 1:
+        half, filled, cut = shard.bp / 2, 0, 1
+        for i, interval in enumerate(intervals[:-1], 1):
+            filled += interval.length
+            cut = i
+            if filled >= half:
+                break
+        halves = (intervals[:cut], intervals[cut:])
+    else:
+        (interval,) = intervals
+        if interval.length < 2 * max(padding, 1):
+            return []
+        mid = interval.start + interval.length // 2
+        halves = ((interval._replace(end=mid),), (interval._replace(start=mid),))
+    return [
+        Shard(shard.index, half, shard.part + (i,)) for i, half in enumerate(halves)
+    ]
+
+
+def partition_shards(shards: List[Shard], count: int) -> List[List[Shard]]:
+    """Deal shards out to `count` nodes with balanced total cost.
+
+    Shards go longest first to the least loaded node, ties broken by index,
+    so every node computes the same partition from the same plan.
+    Returns:
+        Shards of each node, in shard order
+    """
+    loads = [(0.0, node) for node in range(count)]
+    nodes: List[List[Shard]] = [[] for _ in range(count)]
+    for shard in sorted(shards, key=lambda shard: (-shard.cost, shard.index)):
+        load, node = heapq.heappop(loads)
+        nodes[node].append(shard)
+        heapq.heappush(loads, (load + shard.cost, node))
+    return [sorted(node, key=lambda shard: shard.index) for node in nodes]
+
+
+def plan_digest(planned: Iterable[Tuple[int, List[str]]]) -> str:
+    """Digest of a plan, from each shard's index and regions, in order."""
+    digest = hashlib.sha256()
+    for index, regions in planned:
+        digest.update("{}\t{}\n".format(index, ",".join(regions)).encode())
+    return digest.hexdigest()
+
+
+def write_plan(shards: List[Shard], out_fh: IO):
+    """Write shards as BED, with the shard index in the fourth column."""
+    for shard in shards:
+        for interval in shard.intervals:
+            out_fh.write(
+                "{}\t{}\t{}\t{}\n".format(
+                    interval.chrom, interval.start, interval.end, shard.index
+                )
+            )
+
+
+# __END__
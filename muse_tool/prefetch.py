@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+Warm the BAM byte ranges of MuSE calls about to be dispatched.
+
+On network filesystems each MuSE call otherwise stalls on cold reads of
+its regions of the tumor and normal BAMs. A background thread works
+through the commands next in the dispatch queue, looks up the file ranges
+of their intervals in the BAI linear index, and has the kernel read them
+ahead with posix_fadvise(WILLNEED), or reads them itself where that is
+not available.
+
+How far ahead it works adapts to the queue: a call dispatched before its
+ranges were warmed doubles the depth, and a run of calls dispatched warm
+shrinks it again, so prefetched data does not crowd the page cache.
+"""
+import collections
+import itertools
+import logging
+import os
+import threading
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional
+
+from muse_tool.bam import BamIndex, byte_range
+from muse_tool.intervals import BedInterval
+
+logger = logging.getLogger(__name__)
+
+# Reads of the fallback without posix_fadvise.
+READ_CHUNK = 1 << 20
+
+# State of a command known to the prefetcher.
+QUEUED, WARMING, WARM = "queued", "warming", "warm"
+
+
+class ByteRange(NamedTuple):
+    path: str
+    offset: int
+    length: int
+
+
+def bam_ranges(
+    indexes: List[BamIndex], intervals: Iterable[BedInterval], max_bytes: int
+) -> List[ByteRange]:
+    """Byte ranges of each BAM holding reads in intervals.
+
+    Overlapping ranges are coalesced, and only the first `max_bytes` of
+    each BAM are returned: MuSE reads them in order, and kernel readahead
+    takes over once it is streaming.
+    """
+    intervals = list(intervals)
+    ranges = []
+    for index in indexes:
+        spans: List[List[int]] = []
+        for interval in intervals:
+            found = byte_range(index, interval)
+            if found is None:
+                continue
+            offset, length = found
+            if spans and offset <= spans[-1][0] + spans[-1][1]:
+                spans[-1][1] = max(spans[-1][1], offset + length - spans[-1][0])
+            else:
+                spans.append([offset, length])
+        budget = max_bytes
+        for offset, length in spans:
+            if budget <= 0:
+                break
+            ranges.append(ByteRange(index.path, offset, min(length, budget)))
+            budget -= length
+    return ranges
+
+
+class Prefetcher:
+    """Warm the byte ranges of upcoming commands, ahead of dispatch.
+
+    The dispatcher passes its queue to `ahead` and each command it starts
+    to `dispatched`. A command is advised if readahead of all its ranges
+    had been requested by then, late if they were queued or being warmed,
+    and missed if the prefetcher had not seen it. Advice is not checked:
+    the kernel may drop or evict the pages, so `advised` counts requests
+    made in time, not page cache hits. The depth doubles at most once per window
+    of queued commands, so the late commands of one window, such as the
+    first wave of a run, count as one signal.
+    Accepts:
+        ranges (Callable): Returns the ByteRanges a command will read
+        depth (int): Commands to warm ahead of dispatch, initially
+        max_depth (int): Upper bound of the adaptive depth
+    """
+
+    def __init__(
+        self,
+        ranges: Callable[[Any], List[ByteRange]],
+        depth: int = 8,
+        max_depth: int = 256,
+    ):
+        self.ranges = ranges
+        self.min_depth = self.depth = max(depth, 1)
+        self.max_depth = max(max_depth, self.depth)
+        self.state: Dict[Any, str] = {}
+        self.advised = 0
+        self.late = 0
+        self.missed = 0
+        self.warmed_bytes = 0
+        self.errors = 0
+        self._sequence: Dict[Any, int] = {}
+        self._counter = itertools.count()
+        self._grown_at = 0
+        self._streak = 0
+        self._pending: collections.deque = collections.deque()
+        self._fds: Dict[str, int] = {}
+        self._cond = threading.Condition()
+        self._stop = False
+        self._thread: Optional[threading.Thread] = None
+
+    def ahead(self, cmds: Iterable):
+        """Queue the first `depth` of the commands next in dispatch order."""
+        with self._cond:
+            for cmd in itertools.islice(cmds, self.depth):
+                if cmd not in self.state:
+                    self.state[cmd] = QUEUED
+                    self._sequence[cmd] = next(self._counter)
+                    self._pending.append(cmd)
+            self._cond.notify()
+
+    def dispatched(self, cmd: Any):
+        with self._cond:
+            state = self.state.pop(cmd, None)
+            sequence = self._sequence.pop(cmd, None)
+            if state == WARM:
+                self.advised += 1
+                self._streak += 1
+                if self._streak >= self.depth and self.depth > self.min_depth:
+                    self.depth -= 1
+                    self._streak = 0
+                return
+            self._streak = 0
+            if state is None:
+                self.missed += 1
+            else:
+                self.late += 1
+                if state == QUEUED:
+                    self._pending.remove(cmd)
+            if sequence is None or sequence >= self._grown_at:
+                self.depth = min(self.depth * 2, self.max_depth)
+                self._grown_at = next(self._counter)
+
+    def warm(self, rng: ByteRange):
+        fd = self._fds.get(rng.path)
+        if fd is None:
+            fd = self._fds[rng.path] = os.open(rng.path, os.O_RDONLY)
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(fd, rng.offset, rng.length, os.POSIX_FADV_WILLNEED)
+            return
+        pos, end = rng.offset, rng.offset + rng.length
+        while pos < end and not self._stop:
+            data = os.pread(fd, min(READ_CHUNK, end - pos), pos)
+            if not data:
+                break
+            pos += len(data)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._stop:
+                    self._cond.wait()
+                if self._stop:
+                    return
+                cmd = self._pending.popleft()
+                self.state[cmd] = WARMING
+            warmed = 0
+            for rng in self.ranges(cmd):
+                try:
+                    self.warm(rng)
+                    warmed += rng.length
+                except OSError as e:
+                    self.errors += 1
+                    logger.debug("Cannot prefetch %s: %s", rng, e)
+            with self._cond:
+                self.warmed_bytes += warmed
+                if cmd in self.state:
+                    self.state[cmd] = WARM
+
+    def __enter__(self) -> "Prefetcher":
+        self._thread = threading.Thread(target=self._run, name="prefetch", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        with self._cond:
+            self._stop = True
+            self._cond.notify()
+        self._thread.join()
+        for fd in self._fds.values():
+            os.close(fd)
+        self._fds.clear()
+
+    def log_stats(self, log: logging.Logger):
+        dispatched = self.advised + self.late + self.missed
+        log.info(
+            "Prefetch: readahead advised before %s of %s calls started (%s%%), "
+            "%s late, %s not prefetched; advised %s MiB, final depth %s%s",
+            self.advised,
+            dispatched,
+            round(100.0 * self.advised / dispatched, 1) if dispatched else 0,
+            self.late,
+            self.missed,
+            self.warmed_bytes >> 20,
+            self.depth,
+            ", {} errors".format(self.errors) if self.errors else "",
+        )
+
+
+# __END__
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+Validate a run's inputs before any MuSE call is started.
+
+The reference `.fai`, and the header and index of each BAM, are read once
+into contig dictionaries (cached, so BAMs shared between runs of a batch
+are read once), then every BED interval is checked against all of them in
+one pass. Problems are collected and reported together, with a hint when
+contig names only differ by a `chr` prefix.
+"""
+import collections
+import functools
+import logging
+import os
+import struct
+import time
+from typing import Collection, Dict, Iterable, List, NamedTuple, Optional
+
+from muse_tool.bam import find_bai, read_bam_references
+from muse_tool.intervals import BedInterval, read_fai
+
+logger = logging.getLogger(__name__)
+
+# Invalid intervals quoted in the report; the rest are only counted.
+MAX_EXAMPLES = 5
+
+
+class PreflightError(ValueError):
+    """Inputs are inconsistent; `problems` lists each one found."""
+
+    def __init__(self, problems: List[str]):
+        super().__init__(
+            "Preflight found {} problems:\n  {}".format(
+                len(problems), "\n  ".join(problems)
+            )
+        )
+        self.problems = problems
+
+
+class ContigDictionary(NamedTuple):
+    """Contig lengths, in order, of a reference or BAM."""
+
+    source: str
+    lengths: Dict[str, int]
+
+
+def _stat_key(path: str):
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+@functools.lru_cache(maxsize=None)
+def _reference_contigs(reference_path: str, _key) -> ContigDictionary:
+    lengths = {record.contig: record.length for record in read_fai(reference_path)}
+    return ContigDictionary("{}.fai".format(reference_path), lengths)
+
+
+@functools.lru_cache(maxsize=None)
+def _bam_contigs(bam_path: str, _key) -> ContigDictionary:
+    return ContigDictionary(bam_path, dict(read_bam_references(bam_path)))
+
+
+def reference_contigs(reference_path: str) -> ContigDictionary:
+    """Contigs of a reference's `.fai`, cached until the file changes."""
+    return _reference_contigs(reference_path, _stat_key(reference_path + ".fai"))
+
+
+def bam_contigs(bam_path: str) -> ContigDictionary:
+    """Contigs of a BAM's header, cached until the file changes."""
+    return _bam_contigs(bam_path, _stat_key(bam_path))
+
+
+def bai_reference_count(bai_path: str) -> int:
+    """Number of references in a BAI index, from its first 8 bytes."""
+    with open(bai_path, "rb") as fh:
+        data = fh.read(8)
+    if len(data) != 8 or data[:4] != b"BAI\1":
+        raise ValueError("Not a BAI index: {}".format(bai_path))
+    return struct.unpack("<i", data[4:])[0]
+
+
+def suggest_contig(name: str, known: Iterable[str]) -> Optional[str]:
+    """The known contig that `name` likely refers to, under the other
+    naming convention (`chr1` and `1`, `chrM` and `MT`)."""
+    known = set(known)
+    if name.startswith("chr"):
+        candidates = [name[3:]]
+    else:
+        candidates = ["chr" + name]
+    if name in ("chrM", "MT"):
+        candidates.append("MT" if name == "chrM" else "chrM")
+    for candidate in candidates:
+        if candidate in known:
+            return candidate
+    return None
+
+
+def check_bam(bam_path: str) -> List[str]:
+    """Problems with a BAM and its index, reading only the header and
+    the start of the index."""
+    if not os.path.exists(bam_path):
+        return ["Missing BAM: {}".format(bam_path)]
+    try:
+        contigs = bam_contigs(bam_path)
+        bai_path = find_bai(bam_path)
+        n_ref = bai_reference_count(bai_path)
+    except ValueError as e:
+        return [str(e)]
+    if n_ref != len(contigs.lengths):
+        return [
+            "{} has {} references, but its index {} has {}".format(
+                bam_path, len(contigs.lengths), bai_path, n_ref
+            )
+        ]
+    if os.path.getmtime(bai_path) < os.path.getmtime(bam_path):
+        logger.warning("Index %s is older than %s", bai_path, bam_path)
+    return []
+
+
+def check_intervals(
+    intervals: Iterable[BedInterval], dictionaries: List[ContigDictionary]
+) -> List[str]:
+    """Problems with intervals against every contig dictionary, in one pass.
+
+    Intervals on contigs missing from a dictionary are counted per contig,
+    and contig lengths that differ between dictionaries reported once.
+    """
+    reference = dictionaries[0]
+    per_contig: Dict[str, int] = collections.Counter()
+    invalid: List[str] = []
+    n_invalid = 0
+    for interval in intervals:
+        per_contig[interval.chrom] += 1
+        length = reference.lengths.get(interval.chrom)
+        if interval.start < 0 or interval.start >= interval.end or (
+            length is not None and interval.end > length
+        ):
+            n_invalid += 1
+            if len(invalid) < MAX_EXAMPLES:
+                invalid.append(
+                    "{}\t{}\t{} (contig length {})".format(
+                        interval.chrom, interval.start, interval.end, length
+                    )
+                )
+
+    problems = []
+    for chrom, count in per_contig.items():
+        for dictionary in dictionaries:
+            if chrom in dictionary.lengths:
+                continue
+            hint = suggest_contig(chrom, dictionary.lengths)
+            problems.append(
+                "{} intervals on {}, which is not in {}{}".format(
+                    count,
+                    chrom,
+                    dictionary.source,
+                    " (did you mean {}?)".format(hint) if hint else "",
+                )
+            )
+        lengths = {
+            d.source: d.lengths[chrom] for d in dictionaries if chrom in d.lengths
+        }
+        if len(set(lengths.values())) > 1:
+            problems.append(
+                "{} has different lengths: {}".format(
+                    chrom,
+                    ", ".join("{} in {}".format(v, k) for k, v in lengths.items()),
+                )
+            )
+    if n_invalid:
+        problems.append(
+            "{} intervals empty or beyond their contig, e.g. {}".format(
+                n_invalid, "; ".join(invalid)
+            )
+        )
+    return problems
+
+
+def preflight(
+    reference_path: str, bam_paths: List[str], intervals: Collection[BedInterval]
+) -> List[ContigDictionary]:
+    """Check the reference, BAMs and intervals of a run.
+    Accepts:
+        reference_path (str): FASTA path, with `<reference_path>.fai`
+        bam_paths (List[str]): BAMs called together
+        intervals (Collection[BedInterval]): Intervals to call, e.g. an
+            IntervalStore
+    Returns:
+        Contig dictionaries of the reference and each BAM
+    Raises:
+        PreflightError: every problem found
+    """
+    start = time.time()
+    problems = []
+    dictionaries = []
+    try:
+        dictionaries.append(reference_contigs(reference_path))
+    except (OSError, ValueError) as e:
+        problems.append("Cannot read reference index: {}".format(e))
+    for bam_path in bam_paths:
+        bam_problems = check_bam(bam_path)
+        problems.extend(bam_problems)
+        if not bam_problems:
+            dictionaries.append(bam_contigs(bam_path))
+    if problems:
+        raise PreflightError(problems)
+    problems = check_intervals(intervals, dictionaries)
+    if problems:
+        raise PreflightError(problems)
+    logger.info(
+        "Preflight: %s intervals checked against %s in %s seconds",
+        len(intervals),
+        ", ".join(d.source for d in dictionaries),
+        round(time.time() - start, 3),
+    )
+    return dictionaries
+
+
+# __END__
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Progress of a run against its plan: intervals and bp done, throughput, ETA.
+
+A background thread logs a status line on a fixed interval, so stalls show
+up as lines whose counts stop moving, and can write the same numbers as a
+Prometheus node-exporter textfile for fleet monitoring.
+"""
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from muse_tool.plan import Shard
+
+logger = logging.getLogger(__name__)
+
+METRIC_PREFIX = "muse_tool"
+
+
+def format_duration(seconds: Optional[float]) -> str:
+    """H:MM:SS, or "?" if unknown."""
+    if seconds is None:
+        return "?"
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return "{}:{:02d}:{:02d}".format(hours, minutes, seconds)
+
+
+def format_bp(bp: float) -> str:
+    """Base pairs with a unit, e.g. "1.5 Mbp"."""
+    for unit, scale in (("Gbp", 1e9), ("Mbp", 1e6), ("kbp", 1e3)):
+        if bp >= scale:
+            return "{:.1f} {}".format(bp / scale, unit)
+    return "{:.0f} bp".format(bp)
+
+
+class ProgressTracker:
+    """Count completed intervals and bp of planned shards.
+
+    Shards split after planning (see bisect_shard) count towards their
+    planned shard, whose intervals are done once all its parts are.
+    Shards completed without running (resumed or cached) are `skipped`:
+    they count as done, but not towards throughput.
+    Accepts:
+        shards (List[Shard]): Planned shards
+        interval (float): Seconds between status lines
+        textfile (str): Optional Prometheus textfile to keep up to date
+        running (Callable): Returns the number of calls in flight
+        labels (Dict[str, str]): Labels of every metric
+    """
+
+    def __init__(
+        self,
+        shards: List[Shard],
+        interval: float = 60,
+        textfile: Optional[str] = None,
+        running: Optional[Callable[[], int]] = None,
+        labels: Optional[Dict[str, str]] = None,
+    ):
+        self.remaining = {shard.index: shard.bp for shard in shards}
+        self.planned_intervals = {
+            shard.index: len(shard.intervals) for shard in shards
+        }
+        self.total_bp = sum(self.remaining.values())
+        self.total_intervals = sum(self.planned_intervals.values())
+        self.interval = interval
+        self.textfile = textfile
+        self.running = running
+        self.labels = labels or {}
+        self.done_bp = 0
+        self.done_intervals = 0
+        self.skipped_bp = 0
+        self.start = time.time()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def complete(self, shard: Shard, skipped: bool = False):
+        with self._lock:
+            self.done_bp += shard.bp
+            if skipped:
+                self.skipped_bp += shard.bp
+            self.remaining[shard.index] -= shard.bp
+            if self.remaining[shard.index] <= 0:
+                self.done_intervals += self.planned_intervals[shard.index]
+
+    @property
+    def rate(self) -> float:
+        """bp per second called by this run."""
+        elapsed = time.time() - self.start
+        return (self.done_bp - self.skipped_bp) / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def eta(self) -> Optional[float]:
+        rate = self.rate
+        if self.done_bp >= self.total_bp:
+            return 0.0
+        return (self.total_bp - self.done_bp) / rate if rate > 0 else None
+
+    def status(self) -> str:
+        percent = 100.0 * self.done_bp / self.total_bp if self.total_bp else 100.0
+        line = "Progress: {}/{} intervals, {} of {} ({:.1f}%), {}/s, ETA {}".format(
+            self.done_intervals,
+            self.total_intervals,
+            format_bp(self.done_bp),
+            format_bp(self.total_bp),
+            percent,
+            format_bp(self.rate),
+            format_duration(self.eta),
+        )
+        if self.running:
+            line += ", {} running".format(self.running())
+        return line
+
+    def metrics(self) -> str:
+        """Prometheus text exposition of the current progress."""
+        labels = ",".join(
+            '{}="{}"'.format(key, value.replace("\\", "\\\\").replace('"', '\\"'))
+            for key, value in sorted(self.labels.items())
+        )
+        if labels:
+            labels = "{" + labels + "}"
+        eta = self.eta
+        values = [
+            ("intervals_total", "Planned intervals.", self.total_intervals),
+            ("intervals_done", "Intervals called.", self.done_intervals),
+            ("bp_total", "Planned base pairs.", self.total_bp),
+            ("bp_done", "Base pairs called.", self.done_bp),
+            ("bp_per_second", "Base pairs called per second.", self.rate),
+            ("eta_seconds", "Estimated seconds to completion.", eta),
+            ("start_time_seconds", "Unix time the run started.", self.start),
+            ("last_update_seconds", "Unix time of this update.", time.time()),
+        ]
+        if self.running:
+            values.append(("running", "MuSE calls in flight.", self.running()))
+        lines = []
+        for name, help_text, value in values:
+            if value is None:
+                continue
+            metric = "{}_{}".format(METRIC_PREFIX, name)
+            lines.append("# HELP {} {}".format(metric, help_text))
+            lines.append("# TYPE {} gauge".format(metric))
+            lines.append("{}{} {}".format(metric, labels, value))
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self):
+        """Replace the textfile atomically, as node-exporter may read it
+        at any time."""
+        tmp = "{}.{}.tmp".format(self.textfile, os.getpid())
+        with open(tmp, "w") as fh:
+            fh.write(self.metrics())
+        os.replace(tmp, self.textfile)
+
+    def report(self):
+        logger.info(self.status())
+        if self.textfile:
+            try:
+                self.write_textfile()
+            except OSError as e:
+                logger.warning("Cannot write %s: %s", self.textfile, e)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.report()
+
+    def __enter__(self) -> "ProgressTracker":
+        if self.interval > 0:
+            self._thread = threading.Thread(
+                target=self._run, name="progress", daemon=True
+            )
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        self.report()
+
+
+# __END__
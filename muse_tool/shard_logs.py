@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+"""
+Per-shard child log files.
+
+Children write stdout and stderr straight to a log file per shard, so
+their output is never buffered in the orchestrator. Only a bounded tail
+is read back, for error reporting.
+"""
+import os
+import tarfile
+
+
+def read_tail(path: str, max_bytes: int) -> str:
+    """Return at most the last `max_bytes` of a file, decoded."""
+    with open(path, "rb") as fh:
+        fh.seek(0, os.SEEK_END)
+        fh.seek(max(0, fh.tell() - max_bytes))
+        return fh.read().decode(errors="replace")
+
+
+def archive_logs(log_dir: str, archive_path: str) -> str:
+    """Bundle every `*.log` in log_dir into a gzipped tarball."""
+    with tarfile.open(archive_path, "w:gz") as tar:
+        for name in sorted(os.listdir(log_dir)):
+            if name.endswith(".log"):
+                tar.add(os.path.join(log_dir, name), arcname=name)
+    return archive_path
+
+
+# __END__
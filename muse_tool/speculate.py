@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+Speculative re-execution of straggling commands at the tail of a run.
+
+Once no commands are waiting, workers would otherwise idle while a few
+slow calls finish, slowed by a noisy neighbour or a slow NFS path rather
+than by their own size. A call running `factor` times longer than
+expected from its bp and the observed bp/s gets a duplicate, writing to
+its own paths. The first copy to succeed wins: the other is killed, the
+winner's outputs moved into the original's place if needed, and the
+loser's removed. An original that fails while its duplicate runs waits
+for the duplicate, whose outcome becomes the original's.
+"""
+import logging
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Outcome of a finished command: (cmd, exception, result, duration).
+Outcome = Tuple[Any, Optional[BaseException], Any, float]
+
+
+class Speculator:
+    """Launch duplicates of stragglers, and settle which copy wins.
+
+    The dispatcher offers its running commands to `launch` while no
+    commands are waiting, passes every finished command through `settle`,
+    and kills the children of `doomed` commands until they have exited.
+    Accepts:
+        cost (Callable): bp of a command
+        duplicate (Callable): Returns a command running the same work as
+            a command, with its own outputs
+        promote (Callable): Called with (cmd, duplicate) to move a winning
+            duplicate's outputs to the command's
+        discard (Callable): Called with a losing duplicate, to remove its
+            outputs
+        factor (float): Duplicate commands running this many times longer
+            than expected
+        min_observed (int): Successes needed to estimate bp/s
+    """
+
+    # Seconds between checks for stragglers while workers are free.
+    poll_interval = 1.0
+
+    def __init__(
+        self,
+        cost: Callable[[Any], float],
+        duplicate: Callable[[Any], Any],
+        promote: Callable[[Any, Any], None],
+        discard: Callable[[Any], None],
+        factor: float = 2.0,
+        min_observed: int = 3,
+    ):
+        self.cost = cost
+        self._duplicate = duplicate
+        self._promote = promote
+        self._discard = discard
+        self.factor = factor
+        self.min_observed = min_observed
+        self.observed = 0
+        self.observed_cost = 0.0
+        self.observed_time = 0.0
+        self.min_duration: Optional[float] = None
+        # Original of each running duplicate, and the reverse.
+        self.originals: Dict[Any, Any] = {}
+        self.duplicates: Dict[Any, Any] = {}
+        # Outcomes of duplicates that won, until their original has exited.
+        self.won: Dict[Any, Tuple[Any, Any, float]] = {}
+        # Outcomes of originals that failed, until their duplicate finishes.
+        self.failed: Dict[Any, Outcome] = {}
+        self.doomed: Set[Any] = set()
+        self.launched = 0
+        self.wins = 0
+        self.losses = 0
+
+    def observe(self, cmd: Any, duration: float):
+        """Account a successful command towards the observed bp/s."""
+        self.observed += 1
+        self.observed_cost += self.cost(cmd)
+        self.observed_time += duration
+        if self.min_duration is None or duration < self.min_duration:
+            self.min_duration = duration
+
+    def expected(self, cmd: Any) -> Optional[float]:
+        """Expected seconds of a command, at least the shortest observed
+        one, which stands for startup costs. None until enough are seen."""
+        if self.observed < self.min_observed or self.observed_time <= 0:
+            return None
+        rate = self.observed_cost / self.observed_time
+        return max(self.cost(cmd) / rate if rate > 0 else 0.0, self.min_duration)
+
+    def launch(self, running: Dict[Any, float], free: int) -> List[Any]:
+        """Duplicates to start, most overdue first, for at most `free` of
+        the running commands, given their elapsed seconds."""
+        overdue = []
+        for cmd, elapsed in running.items():
+            if (
+                cmd in self.originals
+                or cmd in self.duplicates
+                or cmd in self.won
+                or cmd in self.doomed
+            ):
+                continue
+            expected = self.expected(cmd)
+            if expected and elapsed > self.factor * expected:
+                overdue.append((elapsed / expected, cmd))
+        overdue.sort(key=lambda item: item[0], reverse=True)
+        started = []
+        for ratio, cmd in overdue[: max(free, 0)]:
+            duplicate = self._duplicate(cmd)
+            self.originals[duplicate] = cmd
+            self.duplicates[cmd] = duplicate
+            self.launched += 1
+            started.append(duplicate)
+            logger.warning(
+                "Running %.1f times longer than expected, started a duplicate: %s",
+                ratio,
+                cmd,
+            )
+        return started
+
+    def settle(
+        self, cmd: Any, error: Optional[BaseException], result: Any, duration: float
+    ) -> Optional[Outcome]:
+        """Account a finished command or duplicate.
+        Returns:
+            The outcome to handle as that of an original command, or None
+            if there is nothing to handle yet
+        """
+        if cmd in self.doomed:
+            self.doomed.discard(cmd)
+            if cmd in self.won:
+                duplicate, result, duration = self.won.pop(cmd)
+                self._promote(cmd, duplicate)
+                self.wins += 1
+                return cmd, None, result, duration
+            self._discard(cmd)
+            self.losses += 1
+            return None
+        if cmd in self.originals:
+            original = self.originals.pop(cmd)
+            del self.duplicates[original]
+            if original in self.failed:
+                # The original has exited, so the duplicate's outcome is final.
+                if error is None:
+                    del self.failed[original]
+                    self._promote(original, cmd)
+                    self.wins += 1
+                    return original, None, result, duration
+                logger.warning("Duplicate failed as well: %s", cmd)
+                self._discard(cmd)
+                self.losses += 1
+                return self.failed.pop(original)
+            if error is None:
+                # Handled once the original has been killed and has exited,
+                # so it cannot write over the promoted outputs.
+                self.won[original] = (cmd, result, duration)
+                self.doomed.add(original)
+            else:
+                logger.warning("Duplicate failed, keeping the original: %s", cmd)
+                self._discard(cmd)
+                self.losses += 1
+            return None
+        if cmd in self.duplicates:
+            if error is not None:
+                logger.warning("Failed, waiting for its duplicate: %s", cmd)
+                self.failed[cmd] = (cmd, error, result, duration)
+                return None
+            # The original finished first.
+            duplicate = self.duplicates.pop(cmd)
+            del self.originals[duplicate]
+            self.doomed.add(duplicate)
+        return cmd, error, result, duration
+
+    def log_stats(self, log: logging.Logger):
+        log.info(
+            "Speculation: %s duplicates started, %s finished first, %s lost",
+            self.launched,
+            self.wins,
+            self.losses,
+        )
+
+
+# __END__
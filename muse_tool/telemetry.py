@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Per-child resource telemetry: wall time, CPU time, peak RSS and I/O.
+"""
+import csv
+import json
+import os
+import subprocess
+import time
+from typing import IO, Dict, List, NamedTuple, Optional
+
+USAGE_FIELDS = (
+    "wall_s",
+    "user_cpu_s",
+    "sys_cpu_s",
+    "max_rss_kb",
+    "read_bytes",
+    "write_bytes",
+    "rchar",
+    "wchar",
+)
+
+
+class ChildUsage(NamedTuple):
+    wall_s: float
+    user_cpu_s: float
+    sys_cpu_s: float
+    max_rss_kb: int
+    read_bytes: Optional[int] = None
+    write_bytes: Optional[int] = None
+    rchar: Optional[int] = None
+    wchar: Optional[int] = None
+
+
+def read_proc_io(pid: int) -> Dict[str, int]:
+    """Parse /proc/<pid>/io, empty if unavailable."""
+    try:
+        with open("/proc/{}/io".format(pid), "r") as fh:
+            fields = (line.split(":") for line in fh)
+            return {key.strip(): int(value) for key, value in fields}
+    except (OSError, ValueError):
+        return {}
+
+
+def _exited(pid: int) -> bool:
+    """Poll whether a child has exited, without reaping it."""
+    if hasattr(os, "waitid"):
+        flags = os.WEXITED | os.WNOHANG | os.WNOWAIT
+        return os.waitid(os.P_PID, pid, flags) is not None
+    # No waitid: the child is reaped in wait_child once wait4 reports it.
+    return False
+
+
+def wait_child(
+    proc: subprocess.Popen, timeout: Optional[float], poll: float = 0.05
+) -> ChildUsage:
+    """Wait for a child and collect its resource usage.
+
+    The exited child is left unreaped while /proc/<pid>/io is read, then
+    reaped with os.wait4 for its rusage. Sets `proc.returncode`.
+    Accepts:
+        proc (Popen): Running child, not waited on by anything else
+        timeout (float): Max seconds to wait
+        poll (float): Max polling interval, in seconds
+    Returns:
+        ChildUsage
+    Raises:
+        subprocess.TimeoutExpired: child still running after timeout
+    """
+    start = time.time()
+    delay = 0.001
+    io: Dict[str, int] = {}
+    while True:
+        if _exited(proc.pid):
+            io = read_proc_io(proc.pid)
+            pid, status, rusage = os.wait4(proc.pid, 0)
+            break
+        pid, status, rusage = os.wait4(proc.pid, os.WNOHANG)
+        if pid:
+            break
+        if timeout is not None and time.time() - start > timeout:
+            raise subprocess.TimeoutExpired(proc.args, timeout)
+        time.sleep(delay)
+        delay = min(delay * 2, poll)
+    if os.WIFEXITED(status):
+        proc.returncode = os.WEXITSTATUS(status)
+    else:
+        proc.returncode = -os.WTERMSIG(status)
+    return ChildUsage(
+        wall_s=round(time.time() - start, 3),
+        user_cpu_s=round(rusage.ru_utime, 3),
+        sys_cpu_s=round(rusage.ru_stime, 3),
+        # ru_maxrss is in kilobytes on Linux.
+        max_rss_kb=rusage.ru_maxrss,
+        read_bytes=io.get("read_bytes"),
+        write_bytes=io.get("write_bytes"),
+        rchar=io.get("rchar"),
+        wchar=io.get("wchar"),
+    )
+
+
+def write_report_tsv(rows: List[Dict], out_fh: IO):
+    """Write telemetry rows (shard, regions, bp, *usage) as TSV."""
+    writer = csv.writer(out_fh, delimiter="\t", lineterminator="\n")
+    writer.writerow(("shard", "regions", "bp") + USAGE_FIELDS)
+    for row in rows:
+        writer.writerow(
+            [row["shard"], ",".join(row["regions"]), row["bp"]]
+            + ["" if row[field] is None else row[field] for field in USAGE_FIELDS]
+        )
+
+
+def write_report_json(rows: List[Dict], out_fh: IO):
+    json.dump(rows, out_fh, indent=1)
+
+
+# __END__
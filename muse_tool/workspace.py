@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Per-run scratch workspace for shard outputs, and atomic publishing.
+
+Shard outputs, region lists and the merged output are written to the
+workspace, which can be on fast local storage (tmpfs, NVMe), instead of
+the working directory. Only the merged output leaves it, renamed into
+place, so readers of the output location never see a partial file.
+"""
+import errno
+import logging
+import os
+import shutil
+import tempfile
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Prefix of the names of shard files, so that cleanup of a shared scratch
+# directory only removes this tool's files.
+SHARD_PREFIX = "shard-"
+
+
+def publish(src: str, dest: str):
+    """Move `src` to `dest` atomically.
+
+    Across filesystems, `src` is first copied next to `dest` under a
+    temporary name, then renamed. Readers of `dest` see either the old
+    file or the complete new one.
+    """
+    try:
+        os.replace(src, dest)
+        return
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+    tmp = "{}.{}.tmp".format(dest, os.getpid())
+    try:
+        shutil.copyfile(src, tmp)
+        os.replace(tmp, dest)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+    os.unlink(src)
+
+
+def publish_indexed(src: str, dest: str):
+    """Publish `src` to `dest`, with its tabix index if it has one.
+
+    A stale index of an earlier `dest` is removed otherwise, as it would
+    misplace every record.
+    """
+    publish(src, dest)
+    if os.path.exists(src + ".tbi"):
+        publish(src + ".tbi", dest + ".tbi")
+    elif os.path.exists(dest + ".tbi"):
+        os.unlink(dest + ".tbi")
+
+
+class Workspace:
+    """Scratch directory of a run.
+
+    A given directory is created if missing, and is the same in every
+    run, so a failed run can be resumed from it. Cleanup only removes
+    this tool's shard files from it, and the directory itself if this run
+    created it and it is left empty. By default a new private directory
+    is made under $TMPDIR, and removed on cleanup.
+    Accepts:
+        scratch_dir (str): Directory to use. Default: a new one
+    """
+
+    def __init__(self, scratch_dir: Optional[str] = None):
+        self.owned = not scratch_dir
+        if scratch_dir:
+            self.created = not os.path.isdir(scratch_dir)
+            os.makedirs(scratch_dir, exist_ok=True)
+            self.path = scratch_dir
+        else:
+            self.created = True
+            self.path = tempfile.mkdtemp(prefix="multi_muse.")
+
+    def join(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def cleanup(self):
+        """Remove the workspace, or this tool's files from a given one."""
+        if self.owned:
+            shutil.rmtree(self.path, ignore_errors=True)
+            return
+        for name in os.listdir(self.path):
+            if not name.startswith(SHARD_PREFIX):
+                continue
+            if os.path.isdir(self.join(name)):
+                shutil.rmtree(self.join(name))
+            else:
+                os.unlink(self.join(name))
+        if self.created:
+            try:
+                os.rmdir(self.path)
+            except OSError:
+                pass
+
+
+# __END__
@@ -219,6 +219,8 @@ setup(
         "console_scripts": [
             # "merge = muse_tool.merge_muse:main",
             "multi_muse = muse_tool.multi_muse:main",
+            "gather_muse = muse_tool.gather:main",
+            "batch_muse = muse_tool.batch_muse:main",
         ]
     },
     scripts=[os.path.join(os.path.dirname(__file__), 'bin', PACKAGE)],
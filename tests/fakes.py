@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+Stand-ins shared by the tests.
+"""
+import gzip
+import struct
+
+from muse_tool.bam import PSEUDO_BIN
+
+# Writes "#header" and "<region>\t<tumor>" to <-O>.MuSE.txt, and fails
+# for tumor BAMs named "bad.bam".
+FAKE_MUSE = """
+import sys
+args = sys.argv[1:]
+region = args[args.index("-r") + 1]
+tumor = args[args.index("-r") + 2]
+if tumor == "bad.bam":
+    sys.exit("corrupt BAM")
+with open(args[args.index("-O") + 1] + ".MuSE.txt", "w") as fh:
+    fh.write("#header\\n{}\\t{}\\n".format(region, tumor))
+"""
+
+
+def bam_header(references):
+    text = b"@HD\tVN:1.6\n"
+    out = [b"BAM\1", struct.pack("<i", len(text)), text]
+    out.append(struct.pack("<i", len(references)))
+    for name, length in references:
+        out.append(struct.pack("<i", len(name) + 1) + name.encode() + b"\0")
+        out.append(struct.pack("<i", length))
+    return gzip.compress(b"".join(out))
+
+
+def bai(references):
+    """BAI from per-reference ({bin: [(beg, end)]}, mapped) pairs."""
+    out = [b"BAI\1", struct.pack("<i", len(references))]
+    for bins, mapped in references:
+        bins = dict(bins)
+        if mapped:
+            bins[PSEUDO_BIN] = [(0, 1000 << 16), (mapped, 0)]
+        out.append(struct.pack("<i", len(bins)))
+        for bin_id, chunks in bins.items():
+            out.append(struct.pack("<Ii", bin_id, len(chunks)))
+            for chunk in chunks:
+                out.append(struct.pack("<QQ", *chunk))
+        out.append(struct.pack("<iQ", 1, 0))
+    return b"".join(out)
+
+
+# __END__
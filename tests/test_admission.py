@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+
+import unittest
+from unittest import mock
+
+from muse_tool import admission as MOD
+from muse_tool.dispatch import ChildRegistry
+
+MiB = 1 << 20
+
+
+class Test_parse_size(unittest.TestCase):
+    def test_suffixes(self):
+        self.assertEqual(MOD.parse_size("512"), 512)
+        self.assertEqual(MOD.parse_size("1.5G"), 3 << 29)
+        self.assertEqual(MOD.parse_size("64mb"), 64 * MiB)
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            MOD.parse_size("lots")
+
+
+class Test_MemoryAdmission(unittest.TestCase):
+    def setUp(self):
+        self.registry = mock.MagicMock(spec_set=ChildRegistry)
+        self.registry.pids.return_value = []
+        for name, value in (
+            ('read_rss', lambda pid: pid * MiB),
+            ('read_meminfo', lambda: {'MemAvailable': 1 << 40}),
+            ('read_pressure', lambda: None),
+        ):
+            patcher = mock.patch.object(MOD, name, side_effect=value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_first_child_always_admitted(self):
+        admission = MOD.MemoryAdmission(MiB, self.registry, 10 * MiB)
+        self.assertTrue(admission.admit(0))
+
+    def test_unspawned_children_count_as_predicted(self):
+        admission = MOD.MemoryAdmission(25 * MiB, self.registry, 10 * MiB)
+        self.assertTrue(admission.admit(1))
+        self.assertFalse(admission.admit(2))
+        self.assertEqual(admission.throttled, 1)
+
+    def test_throttled_counts_hold_backs_not_checks(self):
+        admission = MOD.MemoryAdmission(25 * MiB, self.registry, 10 * MiB)
+        for in_flight in (2, 2, 2, 1, 2, 2):
+            admission.admit(in_flight)
+        self.assertEqual(admission.throttled, 2)
+
+    def test_prediction_grows_with_observed_rss(self):
+        self.registry.pids.return_value = [25]
+        admission = MOD.MemoryAdmission(40 * MiB, self.registry, 10 * MiB)
+        self.assertFalse(admission.admit(1))
+        self.assertEqual(admission.predicted, 25 * MiB)
+        self.assertEqual(admission.peak_rss, 25 * MiB)
+
+    def test_peak_rss_is_observed_not_estimated(self):
+        admission = MOD.MemoryAdmission(40 * MiB, self.registry, 10 * MiB)
+        admission.admit(1)
+        self.assertEqual(admission.peak_rss, 0)
+        admission.observe_peak(3 * MiB)
+        self.assertEqual((admission.peak_rss, admission.predicted), (3 * MiB, 10 * MiB))
+
+    def test_pressure_holds_back(self):
+        admission = MOD.MemoryAdmission(1 << 40, self.registry, MiB, max_pressure=5)
+        with mock.patch.object(MOD, 'read_pressure', return_value=12.5):
+            self.assertFalse(admission.admit(1))
+
+
+# __END__
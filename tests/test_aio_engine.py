@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+
+import sys
+import unittest
+from unittest import mock
+
+from muse_tool import aio_engine as MOD
+from muse_tool.dispatch import PopenReturnNT
+
+PYTHON = sys.executable
+
+
+class Test_aio_submit_commands(unittest.TestCase):
+    def test_commands_run_and_report_success(self):
+        on_success = mock.Mock()
+        cmds = ["{} -c 'print({})'".format(PYTHON, i) for i in range(4)]
+        exceptions = MOD.aio_submit_commands(cmds, 2, 10, on_success=on_success)
+        self.assertEqual(exceptions, [])
+        results = {c[0][0]: c[0][1] for c in on_success.call_args_list}
+        self.assertEqual(results[cmds[3]], PopenReturnNT(stdout='3\n', stderr=''))
+
+    def test_failed_command_returned(self):
+        cmd = "{} -c 'import sys; sys.exit(1)'".format(PYTHON)
+        self.assertEqual(MOD.aio_submit_commands([cmd], 1, 10), [cmd])
+
+    def test_timed_out_command_replaced(self):
+        slow = "{} -c 'import time; time.sleep(30)'".format(PYTHON)
+        fast = "{} -c 'pass'".format(PYTHON)
+        on_timeout = mock.Mock(return_value=[fast])
+        exceptions = MOD.aio_submit_commands(
+            [slow], 1, 0.5, on_timeout=on_timeout, grace=1
+        )
+        self.assertEqual(exceptions, [])
+        on_timeout.assert_called_once_with(slow)
+
+    def test_fail_fast_terminates_in_flight(self):
+        slow = "{} -c 'import time; time.sleep(30)'".format(PYTHON)
+        fail = "{} -c 'import sys; sys.exit(1)'".format(PYTHON)
+        exceptions = MOD.aio_submit_commands(
+            [slow, fail, slow + " ", slow + "  "], 2, 60, grace=1, max_failures=0
+        )
+        self.assertEqual(exceptions, [fail])
+
+
+# __END__
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+
+import pathlib
+import tempfile
+import unittest
+
+from muse_tool import bam as MOD
+from muse_tool.intervals import BedInterval
+from tests.fakes import bai, bam_header
+
+
+class Test_bam(unittest.TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.bam = str(pathlib.Path(tmpdir.name, "t.bam"))
+        with open(self.bam, "wb") as fh:
+            fh.write(bam_header([("chr1", 100000), ("chr2", 50000)]))
+        # chr1: 500 compressed bytes of reads in window 0, none in window 1,
+        # 100 in window 2; 1000 bytes and 2000 reads over the whole reference.
+        chr1 = {4681: [(0, 500 << 16)], 4683: [(500 << 16, 600 << 16)]}
+        with open(self.bam + ".bai", "wb") as fh:
+            fh.write(bai([(chr1, 2000), ({}, 0)]))
+
+    def test_read_bam_references(self):
+        self.assertEqual(
+            MOD.read_bam_references(self.bam), [("chr1", 100000), ("chr2", 50000)]
+        )
+
+    def test_not_a_bam(self):
+        with open(self.bam, "wb") as fh:
+            fh.write(b"plain text")
+        with self.assertRaises(ValueError):
+            MOD.read_bam_references(self.bam)
+
+    def test_estimates(self):
+        index = MOD.load_bam_index(self.bam)
+        whole_window = MOD.estimate_coverage(index, BedInterval("chr1", 0, 16384))
+        self.assertEqual(whole_window, MOD.CoverageEstimate(500, 1000))
+        half_window = MOD.estimate_coverage(index, BedInterval("chr1", 0, 8192))
+        self.assertEqual(half_window.bytes, 250)
+        for empty in (BedInterval("chr1", 16384, 32768), BedInterval("chr2", 0, 10)):
+            self.assertEqual(MOD.estimate_coverage(index, empty).reads, 0)
+
+    def test_weigh_and_skip(self):
+        index = MOD.load_bam_index(self.bam)
+        intervals = [BedInterval("chr1", 0, 100), BedInterval("chr1", 20000, 20100)]
+        kept, skipped = MOD.weigh_by_coverage(
+            intervals, [index, index], weight=True, min_reads=1
+        )
+        self.assertEqual([i.region for i in kept], ["chr1:1-100"])
+        self.assertAlmostEqual(kept[0].cost, 2 * 500 * 100 / 16384)
+        self.assertEqual([i for i, _ in skipped], intervals[1:])
+
+    def test_byte_range(self):
+        linear = (100 << 16, 100 << 16, 300 << 16, 500 << 16)
+        chr1 = MOD.ReferenceIndex({}, (100 << 16, 900 << 16), 10, linear)
+        index = MOD.BamIndex(self.bam, {"chr1": chr1})
+        block = MOD.MAX_BLOCK_SIZE
+        self.assertEqual(
+            MOD.byte_range(index, BedInterval("chr1", 0, 20000)), (100, 200 + block)
+        )
+        self.assertEqual(
+            MOD.byte_range(index, BedInterval("chr1", 50000, 50100)),
+            (500, 400 + block),
+        )
+        self.assertIsNone(MOD.byte_range(index, BedInterval("chr1", 70000, 70100)))
+        self.assertIsNone(MOD.byte_range(index, BedInterval("chr2", 0, 10)))
+
+    def test_missing_index(self):
+        pathlib.Path(self.bam + ".bai").unlink()
+        with self.assertRaises(ValueError):
+            MOD.load_bam_index(self.bam)
+
+
+# __END__
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+
+import os
+import pathlib
+import sys
+import tempfile
+import unittest
+
+from muse_tool import batch_muse as MOD
+from tests.fakes import FAKE_MUSE
+
+
+class Test_batch_muse(unittest.TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.tmpdir = pathlib.Path(tmpdir.name)
+        (self.tmpdir / "fake_muse.py").write_text(FAKE_MUSE)
+        (self.tmpdir / "regions.bed").write_text("chr1\t0\t10\nchr1\t20\t30\n")
+        cwd = os.getcwd()
+        os.chdir(str(self.tmpdir))
+        self.addCleanup(os.chdir, cwd)
+
+    def batch(self, lines, *args):
+        (self.tmpdir / "batch.tsv").write_text("".join(lines))
+        return MOD.get_args(
+            list(args)
+            + [
+                "-f",
+                "ref.fa",
+                "-r",
+                "regions.bed",
+                "-b",
+                "batch.tsv",
+                "-c",
+                "2",
+                "--muse-binary",
+                "{} fake_muse.py".format(sys.executable),
+                "--no-preflight",
+            ]
+        )
+
+    def test_round_robin(self):
+        self.assertEqual(MOD.round_robin([[1, 2, 3], [4], [5, 6]]), [1, 4, 5, 2, 6, 3])
+
+    def test_read_batch_rejects_duplicate_outputs(self):
+        args = self.batch(["# tumor\tnormal\toutput\n", "t\tn\tout\n", "t\tn\tout\n"])
+        with self.assertRaisesRegex(ValueError, "twice"):
+            MOD.read_batch(args.batch)
+
+    def test_each_pair_merged(self):
+        args = self.batch(["t1.bam\tn.bam\tout1\n", "t2.bam\tn.bam\tout2\n"])
+        self.assertEqual(MOD.run(args), [])
+        for name in ("t1", "t2"):
+            self.assertEqual(
+                (self.tmpdir / "out{}".format(name[1])).read_text(),
+                "#header\nchr1:1-10\t{0}.bam\nchr1:21-30\t{0}.bam\n".format(name),
+            )
+        self.assertEqual(
+            sorted(os.listdir(str(self.tmpdir))),
+            ["batch.tsv", "fake_muse.py", "out1", "out2", "regions.bed"],
+        )
+
+    def test_failed_pair_not_merged(self):
+        args = self.batch(
+            ["bad.bam\tn.bam\tout1\n", "t2.bam\tn.bam\tout2\n"],
+            "--scratch-dir",
+            "scratch",
+        )
+        failed = MOD.run(args)
+        self.assertEqual([pair_run.pair.output for pair_run in failed], ["out1"])
+        self.assertFalse((self.tmpdir / "out1").exists())
+        self.assertTrue((self.tmpdir / "out2").exists())
+        # Only the failed pair's shard outputs are kept.
+        self.assertEqual(os.listdir(str(self.tmpdir / "scratch")), ["shard-pair0"])
+
+
+# __END__
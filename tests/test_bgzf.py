@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+
+import gzip
+import pathlib
+import struct
+import tempfile
+import unittest
+
+from muse_tool import bgzf as MOD
+
+try:
+    import pysam
+except ImportError:
+    pysam = None
+
+
+def records(chroms=("chr1", "chr2"), count=20000, step=37):
+    lines = [b"##MuSE_Version=v1.0\n", b"#CHROM\tPOS\n"]
+    for chrom in chroms:
+        for i in range(count):
+            lines.append("{}\t{}\tA\tG\n".format(chrom, i * step + 1).encode())
+    return b"".join(lines)
+
+
+class Test_BgzfWriter(unittest.TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.path = str(pathlib.Path(tmpdir.name, "merged.MuSE.txt.gz"))
+        self.data = records()
+
+    def write(self, threads=1, index=True, data=None):
+        with MOD.BgzfWriter(self.path, threads=threads, index=index) as fh:
+            data = self.data if data is None else data
+            for i in range(0, len(data), 100000):
+                fh.write(data[i : i + 100000])
+
+    def test_round_trips_through_gzip(self):
+        self.write(threads=4)
+        with open(self.path, "rb") as fh:
+            raw = fh.read()
+        self.assertEqual(gzip.decompress(raw), self.data)
+        self.assertTrue(raw.endswith(MOD.EOF_BLOCK))
+
+    def test_parallel_output_matches_serial(self):
+        self.write(threads=1, index=False)
+        serial = pathlib.Path(self.path).read_bytes()
+        self.write(threads=4, index=False)
+        self.assertEqual(pathlib.Path(self.path).read_bytes(), serial)
+
+    def test_index_fetches_region(self):
+        self.write(threads=2)
+        got = list(MOD.fetch(self.path, "chr2", 370001, 370370))
+        expected = [
+            "chr2\t{}\tA\tG\n".format(pos).encode() for pos in range(370001, 370371, 37)
+        ]
+        self.assertEqual(got, expected)
+        self.assertEqual(list(MOD.fetch(self.path, "chr3", 1, 100)), [])
+
+    def test_index_header_matches_spec(self):
+        self.write()
+        data = gzip.decompress(pathlib.Path(self.path + ".tbi").read_bytes())
+        self.assertEqual(data[:4], b"TBI\1")
+        n_ref, fmt, col_seq, col_beg, col_end, meta, skip, l_nm = struct.unpack_from(
+            "<8i", data, 4
+        )
+        self.assertEqual((n_ref, fmt, skip), (2, 0, 0))
+        self.assertEqual((col_seq, col_beg, col_end), (1, 2, 2))
+        self.assertEqual(chr(meta), "#")
+        self.assertEqual(data[36 : 36 + l_nm], b"chr1\0chr2\0")
+
+    @unittest.skipUnless(pysam, "pysam not installed")
+    def test_tabix_reader_fetches_region(self):
+        self.write(threads=2)
+        with pysam.TabixFile(self.path) as tbx:
+            got = list(tbx.fetch("chr2", 370000, 370370))
+            self.assertEqual(tbx.header, ["##MuSE_Version=v1.0", "#CHROM\tPOS"])
+        expected = ["chr2\t{}\tA\tG".format(pos) for pos in range(370001, 370371, 37)]
+        self.assertEqual(got, expected)
+
+    def test_unsorted_records_are_not_indexed(self):
+        self.write(data=records(("chr1", "chr2", "chr1"), count=10))
+        self.assertFalse(pathlib.Path(self.path + ".tbi").exists())
+        self.assertTrue(pathlib.Path(self.path).exists())
+
+
+class Test_bins(unittest.TestCase):
+    def test_reg2bin_is_among_reg2bins(self):
+        for beg, end in ((0, 1), (16383, 16385), (1 << 20, 1 << 24)):
+            self.assertIn(MOD.reg2bin(beg, end), MOD.reg2bins(beg, end))
+        self.assertEqual(MOD.reg2bin(0, 1), 4681)
+        self.assertEqual(MOD.reg2bin(0, 1 << 29), 0)
+
+
+# __END__
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+
+import os
+import pathlib
+import tempfile
+import unittest
+
+from muse_tool import cache as MOD
+
+
+class Test_ShardCache(unittest.TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.tmpdir = pathlib.Path(tmpdir.name)
+        self.cache = MOD.ShardCache(str(self.tmpdir / "cache"), 1000, "inputs")
+
+    def output(self, name, text):
+        path = self.tmpdir / name
+        path.write_text(text)
+        return path
+
+    def test_round_trip(self):
+        self.assertFalse(self.cache.fetch(["chr1:1-10"], self.tmpdir / "out"))
+        self.cache.publish(["chr1:1-10"], self.output("a", "#h\nchr1\t5\n"))
+        self.assertTrue(self.cache.fetch(["chr1:1-10"], self.tmpdir / "out"))
+        self.assertEqual((self.tmpdir / "out").read_text(), "#h\nchr1\t5\n")
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+        self.assertEqual(os.listdir(str(self.cache.tmp)), [])
+
+    def test_key_depends_on_inputs(self):
+        other = MOD.ShardCache(str(self.tmpdir / "cache"), 1000, "other inputs")
+        self.cache.publish(["chr1:1-10"], self.output("a", "x"))
+        self.assertFalse(other.fetch(["chr1:1-10"], self.tmpdir / "out"))
+        self.assertFalse(self.cache.fetch(["chr1:1-11"], self.tmpdir / "out"))
+
+    def test_evicts_least_recently_used(self):
+        self.cache.max_bytes = 1300
+        for i, region in enumerate(["chr1:1-10", "chr2:1-10", "chr3:1-10"]):
+            self.cache.publish([region], self.output(str(i), "x" * 400))
+            path = self.cache._path(self.cache.key([region]))
+            os.utime(str(path), (i, i))
+        # A hit makes chr1 the most recently used.
+        self.cache.fetch(["chr1:1-10"], self.tmpdir / "out")
+        self.cache.publish(["chr4:1-10"], self.output("3", "x" * 400))
+        kept = [
+            region
+            for region in ["chr1:1-10", "chr2:1-10", "chr3:1-10", "chr4:1-10"]
+            if self.cache._path(self.cache.key([region])).exists()
+        ]
+        self.assertEqual(kept, ["chr1:1-10", "chr4:1-10"])
+        self.assertEqual(self.cache.size, 800)
+
+    def test_fingerprint_changes_with_inputs(self):
+        bam = self.output("t.bam", "reads")
+        before = MOD.input_fingerprint("ref.fa", str(bam), str(bam), "true")
+        os.utime(str(bam), ns=(0, 0))
+        after = MOD.input_fingerprint("ref.fa", str(bam), str(bam), "true")
+        self.assertNotEqual(before, after)
+
+
+# __END__
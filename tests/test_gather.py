@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+import io
+import json
+import os
+import pathlib
+import tempfile
+import unittest
+from unittest import mock
+
+from muse_tool import gather as MOD
+from muse_tool.intervals import BedInterval
+from muse_tool.plan import Shard, bisect_shard, partition_shards
+
+
+class Test_gather(unittest.TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.tmpdir = tmpdir.name
+        # chr2 comes first in the plan, but second in the reference.
+        self.plan = [
+            Shard(0, (BedInterval("chr2", 0, 100),)),
+            Shard(1, (BedInterval("chr1", 0, 300),)),
+            Shard(2, (BedInterval("chr1", 500, 600),)),
+        ]
+        self.paths = []
+        for node, shards in enumerate(partition_shards(self.plan, 2)):
+            if node == 0:
+                # Shard 1 timed out and was bisected.
+                shards = [s for s in shards if s.index != 1]
+                shards += bisect_shard(self.plan[1])
+            self.paths.append(self.write_partial(node, shards))
+
+    def write_partial(self, node, shards):
+        output, descriptor = (
+            os.path.join(self.tmpdir, path) for path in MOD.partial_paths(node, 2)
+        )
+        segments = []
+        with open(output, "wb") as fh:
+            for shard in sorted(shards, key=lambda s: s.name):
+                offset = fh.tell()
+                fh.write("#header\n".encode())
+                for interval in shard.intervals:
+                    fh.write("{}\t{}\n".format(interval.chrom, interval.end).encode())
+                segments.append((shard, offset, fh.tell() - offset))
+        MOD.write_descriptor(
+            descriptor, node, 2, self.plan, ["chr1", "chr2"], {}, output, segments
+        )
+        return descriptor
+
+    def test_merged_in_reference_order(self):
+        fh = io.BytesIO()
+        self.assertEqual(MOD.gather(self.paths, fh), 4)
+        self.assertEqual(
+            fh.getvalue(), b"#header\nchr1\t150\nchr1\t300\nchr1\t600\nchr2\t100\n"
+        )
+
+    def test_missing_partial(self):
+        with self.assertRaisesRegex(ValueError, "exactly once"):
+            MOD.gather(self.paths[:1], io.BytesIO())
+
+    def test_missing_segment(self):
+        with open(self.paths[0]) as fh:
+            descriptor = json.load(fh)
+        for shard in descriptor["shards"]:
+            shard["segments"] = shard["segments"][:1]
+        with open(self.paths[0], "w") as fh:
+            json.dump(descriptor, fh)
+        with self.assertRaisesRegex(ValueError, "does not cover"):
+            MOD.gather(self.paths, io.BytesIO())
+
+    def test_shifted_or_duplicated_segment(self):
+        with open(self.paths[0]) as fh:
+            original = json.load(fh)
+        # Each covers as many bp as shard 1's halves, chr1:1-150 and 151-300.
+        for regions in (["chr1:11-160", "chr1:161-310"], ["chr1:1-150"] * 2):
+            descriptor = json.loads(json.dumps(original))
+            (shard,) = [s for s in descriptor["shards"] if s["index"] == 1]
+            for segment, region in zip(shard["segments"], regions):
+                segment["regions"] = [region]
+            with open(self.paths[0], "w") as fh:
+                json.dump(descriptor, fh)
+            with self.assertRaisesRegex(ValueError, "Shard 1 does not cover"):
+                MOD.gather(self.paths, io.BytesIO())
+
+    def test_modified_partial(self):
+        output = pathlib.Path(self.tmpdir, MOD.partial_paths(1, 2)[0])
+        output.write_text(output.read_text().replace("chr", "Chr"))
+        with self.assertRaisesRegex(ValueError, "does not match"):
+            MOD.gather(self.paths, io.BytesIO())
+
+    def test_rejected_partials_leave_no_output(self):
+        merged = os.path.join(self.tmpdir, "merged.MuSE.txt")
+        argv = ["--partial", self.paths[0], "--merge_outname", merged]
+        with mock.patch.object(MOD, "setup_logger"):
+            self.assertEqual(MOD.main(argv), 1)
+            self.assertFalse(os.path.exists(merged))
+            self.assertEqual(MOD.main(argv + ["--partial", self.paths[1]]), 0)
+        with open(merged, "rb") as fh:
+            self.assertEqual(fh.read().count(b"#header"), 1)
+
+
+# __END__
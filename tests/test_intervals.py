@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+
+import gzip
+import pathlib
+import tempfile
+import unittest
+
+from muse_tool import intervals as MOD
+
+BED = """track name=targets
+browser position chr1:1-100
+# comment
+
+chr2\t0\t10\t2
+chr1\t50\t60\t1
+chr1\t0\t20\t1
+chr1\t20\t30\t3
+chr1\t100\t110\t1
+"""
+
+
+class Test_IntervalStore(unittest.TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.bed = pathlib.Path(tmpdir.name, "targets.bed")
+        self.bed.write_text(BED)
+
+    def test_load_skips_headers(self):
+        store = MOD.IntervalStore.from_bed(str(self.bed), weight_column=4)
+        self.assertEqual(
+            list(store)[:2],
+            [MOD.BedInterval("chr2", 0, 10, 2.0), MOD.BedInterval("chr1", 50, 60)],
+        )
+        self.assertEqual(store.stats(), MOD.IntervalStats(5, 60, 2, 10, 10, 20))
+
+    def test_load_gzipped(self):
+        gz = self.bed.with_suffix(".bed.gz")
+        gz.write_bytes(gzip.compress(BED.encode()))
+        self.assertEqual(
+            list(MOD.IntervalStore.from_bed(str(gz))),
+            list(MOD.yield_bed_intervals(str(self.bed))),
+        )
+
+    def test_malformed_line_reported(self):
+        self.bed.write_text(BED + "chr1\tten\t20\n")
+        with self.assertRaisesRegex(ValueError, ":10: not a BED interval"):
+            MOD.IntervalStore.from_bed(str(self.bed))
+
+    def test_sorted_and_merged(self):
+        store = MOD.IntervalStore.from_bed(str(self.bed), weight_column=4)
+        merged = store.sorted(["chr1", "chr2"]).merged()
+        self.assertEqual(
+            [(i.chrom, i.start, i.end) for i in merged],
+            [("chr1", 0, 30), ("chr1", 50, 60), ("chr1", 100, 110), ("chr2", 0, 10)],
+        )
+        # Costs are kept: 20 x 1 + 10 x 3 bp.
+        self.assertEqual(list(merged)[0].cost, 50)
+
+    def test_padding_joins_and_clips(self):
+        store = MOD.IntervalStore.from_bed(str(self.bed)).sorted(["chr1", "chr2"])
+        merged = store.merged(padding=20, lengths={"chr1": 115})
+        self.assertEqual(
+            [(i.chrom, i.start, i.end) for i in merged],
+            [("chr1", 0, 115), ("chr2", 0, 30)],
+        )
+
+
+# __END__
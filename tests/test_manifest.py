@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+
+import pathlib
+import tempfile
+import unittest
+
+from muse_tool import manifest as MOD
+
+
+class Test_manifest(unittest.TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.tmpdir = pathlib.Path(tmpdir.name)
+        self.output = self.tmpdir / "0.MuSE.txt"
+        self.output.write_text("#header\nrecord\n")
+        self.path = str(self.tmpdir / "manifest.jsonl")
+
+    def write_record(self, append=False):
+        record = MOD.make_record(0, ['chr1:1-10'], 'muse call', self.output, 1.5)
+        with MOD.RunManifest(self.path, append=append) as manifest:
+            manifest.write(record)
+        return record
+
+    def test_record_round_trips(self):
+        record = self.write_record()
+        self.assertEqual(MOD.load_manifest(self.path), {'muse call': record})
+        self.assertTrue(MOD.verify_record(record))
+
+    def test_torn_last_line_is_ignored(self):
+        record = self.write_record()
+        with open(self.path, 'a') as fh:
+            fh.write('{"index": 1, "regi')
+        self.assertEqual(MOD.load_manifest(self.path), {'muse call': record})
+
+    def test_split_records_load_apart(self):
+        record = self.write_record()
+        split = MOD.SplitRecord(1, 'muse call 1', ['muse call 1.0', 'muse call 1.1'])
+        with MOD.RunManifest(self.path, append=True) as manifest:
+            manifest.write(split)
+        self.assertEqual(MOD.load_manifest(self.path), {'muse call': record})
+        self.assertEqual(MOD.load_splits(self.path), {'muse call 1': split})
+
+    def test_modified_output_fails_verification(self):
+        record = self.write_record()
+        self.output.write_text("#header\nrecorD\n")
+        self.assertFalse(MOD.verify_record(record))
+        self.output.unlink()
+        self.assertFalse(MOD.verify_record(record))
+
+    def test_new_run_truncates_manifest(self):
+        self.write_record()
+        with MOD.RunManifest(self.path):
+            pass
+        self.assertEqual(MOD.load_manifest(self.path), {})
+
+
+# __END__
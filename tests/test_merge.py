@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+
+import io
+import pathlib
+import tempfile
+import unittest
+
+from muse_tool import merge as MOD
+
+EXPECTED = "#v\n#CHROM\nchr1\t1\n#not a header\nchr1\t2\nchr2\t1\n"
+
+
+class Test_merge_files(unittest.TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.tmpdir = pathlib.Path(tmpdir.name)
+        self.outputs = []
+        bodies = ("", "chr1\t1\n#not a header\nchr1\t2\n", "chr2\t1\n")
+        for i, body in enumerate(bodies):
+            path = self.tmpdir / "{}.MuSE.txt".format(i)
+            path.write_text("#v\n#CHROM\n" + body if i else "")
+            self.outputs.append(path)
+
+    def test_text_handle(self):
+        fh = io.StringIO()
+        self.assertEqual(MOD.merge_files(self.outputs, fh), 2)
+        self.assertEqual(fh.getvalue(), EXPECTED)
+
+    def test_binary_handle(self):
+        fh = io.BytesIO()
+        MOD.merge_files(self.outputs, fh)
+        self.assertEqual(fh.getvalue(), EXPECTED.encode())
+
+    def test_file_handle(self):
+        merged = self.tmpdir / "merged.MuSE.txt"
+        with merged.open("wb") as fh:
+            MOD.merge_files(self.outputs, fh)
+            fh.write(b"tail\n")
+        self.assertEqual(merged.read_text(), EXPECTED + "tail\n")
+
+    def test_header_only_output(self):
+        self.outputs[0].write_text("#v\n")
+        fh = io.BytesIO()
+        MOD.merge_files(self.outputs, fh)
+        self.assertEqual(fh.getvalue(), EXPECTED.replace("#CHROM\n", "").encode())
+
+
+# __END__
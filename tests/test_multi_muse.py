@@ -1,12 +1,19 @@
 #!/usr/bin/env python3
 
+import functools
+import io
+import os
 import pathlib
 import subprocess
+import sys
+import tempfile
+import time
 import unittest
 from types import SimpleNamespace
 from unittest import mock
 
 from muse_tool import multi_muse as MOD
+from tests.fakes import FAKE_MUSE
 
 
 class ThisTestCase(unittest.TestCase):
@@ -16,6 +23,7 @@ class ThisTestCase(unittest.TestCase):
             subprocess=mock.MagicMock(spec_set=subprocess),
             futures=mock.MagicMock(spec_set=MOD.concurrent.futures),
         )
+        self.mocks.futures.wait.side_effect = lambda fs, **kwargs: (set(fs), set())
 
     def setup_popen(self, stdout=None, stderr=None, returncode=0):
         stdout = stdout or b''
@@ -39,7 +47,10 @@ class Test_subprocess_commands_pipe(ThisTestCase):
         cmd = MOD.CMD_STR
         MOD.subprocess_commands_pipe(cmd, timeout=3600, di=self.mocks)
         self.mocks.subprocess.Popen.assert_called_once_with(
-            MOD.shlex.split(cmd), stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            MOD.shlex.split(cmd),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            preexec_fn=None,
         )
         mock_popen.communicate.assert_called_once_with(timeout=3600)
 
@@ -53,7 +64,10 @@ class Test_subprocess_commands_pipe(ThisTestCase):
         with self.assertRaises(ValueError):
             MOD.subprocess_commands_pipe(cmd, timeout=3600, di=self.mocks)
         self.mocks.subprocess.Popen.assert_called_once_with(
-            MOD.shlex.split(cmd), stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            MOD.shlex.split(cmd),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            preexec_fn=None,
         )
         expected_calls = [
             mock.call(timeout=3600),
@@ -62,6 +76,39 @@ class Test_subprocess_commands_pipe(ThisTestCase):
         mock_popen.communicate.assert_has_calls(expected_calls)
 
 
+class Test_subprocess_commands_logfile(ThisTestCase):
+    def setUp(self):
+        super().setUp()
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.log_path = pathlib.Path(tmpdir.name, "0.log")
+
+    def test_output_written_to_log_not_returned(self):
+        cmd = MOD.CMD_STR
+        popen = self.setup_popen()
+        popen.wait.return_value = 0
+        result = MOD.subprocess_commands_logfile(
+            cmd, timeout=3600, log_path=str(self.log_path), di=self.mocks
+        )
+        self.assertEqual(result, MOD.PopenReturnNT(stdout='', stderr=''))
+        _, kwargs = self.mocks.subprocess.Popen.call_args
+        self.assertEqual(kwargs['stdout'].name, str(self.log_path))
+        self.assertEqual(kwargs['stderr'], subprocess.STDOUT)
+        popen.wait.assert_called_once_with(timeout=3600)
+
+    def test_failure_reports_log_tail(self):
+        self.log_path.write_text("x" * 100 + "last words")
+        self.setup_popen(returncode=1)
+        with self.assertRaisesRegex(ValueError, "^x{6}last words$"):
+            MOD.subprocess_commands_logfile(
+                MOD.CMD_STR,
+                timeout=3600,
+                log_path=str(self.log_path),
+                tail_bytes=16,
+                di=self.mocks,
+            )
+
+
 class Test_ThreadPoolExecutor(ThisTestCase):
     def setUp(self):
         return super().setUp()
@@ -95,6 +142,99 @@ class Test_ThreadPoolExecutor(ThisTestCase):
             max_workers=max_workers
         )
 
+    def test_on_success_called_with_result(self):
+        commands = ['foo', 'bar']
+        on_success = mock.Mock()
+        MOD.tpe_submit_commands(
+            commands,
+            thread_count=2,
+            timeout=10,
+            fn=lambda cmd, timeout: MOD.PopenReturnNT(stdout=cmd, stderr=''),
+            on_success=on_success,
+        )
+        on_success.assert_has_calls(
+            [
+                mock.call('foo', MOD.PopenReturnNT(stdout='foo', stderr=''), mock.ANY),
+                mock.call('bar', MOD.PopenReturnNT(stdout='bar', stderr=''), mock.ANY),
+            ],
+            any_order=True,
+        )
+
+    def test_failed_command_retried(self):
+        fn = mock.Mock(
+            side_effect=[ValueError('boom'), MOD.PopenReturnNT(stdout='', stderr='')]
+        )
+        exceptions = MOD.tpe_submit_commands(
+            ['foo'], thread_count=1, timeout=10, fn=fn, retries=1
+        )
+        self.assertEqual(exceptions, [])
+        self.assertEqual(fn.call_count, 2)
+
+    def test_retries_exhausted(self):
+        fn = mock.Mock(side_effect=ValueError('boom'))
+        exceptions = MOD.tpe_submit_commands(
+            ['foo'], thread_count=1, timeout=10, fn=fn, retries=2
+        )
+        self.assertEqual(exceptions, ['foo'])
+        self.assertEqual(fn.call_count, 3)
+
+    def test_timed_out_command_replaced(self):
+        def fn(cmd, timeout):
+            if cmd == 'whole':
+                raise MOD.CommandTimeoutError('timeout')
+            return MOD.PopenReturnNT(stdout=cmd, stderr='')
+
+        on_success = mock.Mock()
+        exceptions = MOD.tpe_submit_commands(
+            ['whole', 'next'],
+            thread_count=1,
+            timeout=10,
+            fn=fn,
+            on_success=on_success,
+            on_timeout=lambda cmd: ['half0', 'half1'],
+        )
+        self.assertEqual(exceptions, [])
+        self.assertEqual(
+            [c[0][0] for c in on_success.call_args_list], ['half0', 'half1', 'next']
+        )
+
+    def test_fail_fast_cancels_and_terminates(self):
+        registry = MOD.ChildRegistry()
+        fn = functools.partial(MOD.subprocess_commands_pipe, registry=registry)
+        cmds = ['sleep 30', 'false', 'sleep 30', 'sleep 30']
+        start = time.time()
+        exceptions = MOD.tpe_submit_commands(
+            cmds, thread_count=2, timeout=60, fn=fn, max_failures=0, registry=registry
+        )
+        self.assertEqual(exceptions, ['false'])
+        self.assertLess(time.time() - start, 10)
+        self.assertEqual(len(registry), 0)
+
+    def test_abort_kills_children_ignoring_sigterm(self):
+        registry = MOD.ChildRegistry(grace=0.5)
+        fn = functools.partial(MOD.subprocess_commands_pipe, registry=registry)
+        stubborn = "sh -c 'trap \"\" TERM; exec sleep 30'"
+        start = time.time()
+        exceptions = MOD.tpe_submit_commands(
+            [stubborn, "false"], 2, 60, fn=fn, max_failures=0, registry=registry
+        )
+        self.assertEqual(exceptions, ["false"])
+        self.assertLess(time.time() - start, 10)
+
+    def test_failures_tolerated_up_to_limit(self):
+        fn = mock.Mock(side_effect=ValueError('boom'))
+        exceptions = MOD.tpe_submit_commands(
+            list('abcd'), thread_count=1, timeout=10, fn=fn, max_failures=1
+        )
+        self.assertEqual(exceptions, ['a', 'b'])
+
+    def test_parse_failure_policy(self):
+        self.assertIsNone(MOD.parse_failure_policy('run-all'))
+        self.assertEqual(MOD.parse_failure_policy('fail-fast'), 0)
+        self.assertEqual(MOD.parse_failure_policy('3'), 3)
+        with self.assertRaises(ValueError):
+            MOD.parse_failure_policy('some')
+
     @unittest.skip("Skipping for testing purposes")
     def test_submit_returns_futures(self):
         commands = list('abcde')
@@ -116,4 +256,195 @@ class Test_ThreadPoolExecutor(ThisTestCase):
                 future.result.assert_called_once_with()
 
 
+class Test_yield_bed_intervals(ThisTestCase):
+    def write_bed(self, text):
+        fh = tempfile.NamedTemporaryFile('w', suffix='.bed', delete=False)
+        self.addCleanup(pathlib.Path(fh.name).unlink)
+        with fh:
+            fh.write(text)
+        return fh.name
+
+    def test_regions_are_one_based(self):
+        bed = self.write_bed("chr1\t0\t100\nchr2\t9\t20\n")
+        regions = list(MOD.yield_bed_regions(bed))
+        self.assertEqual(regions, ['chr1:1-100', 'chr2:10-20'])
+
+    def test_weight_column_scales_cost(self):
+        bed = self.write_bed("chr1\t0\t100\tname\t2.5\n")
+        (interval,) = MOD.yield_bed_intervals(bed, weight_column=5)
+        self.assertEqual(interval.cost, 250)
+
+    def test_invalid_weight_raises(self):
+        bed = self.write_bed("chr1\t0\t100\tname\n")
+        with self.assertRaises(ValueError):
+            list(MOD.yield_bed_intervals(bed, weight_column=5))
+
+
+class Test_longest_first(ThisTestCase):
+    def test_order_longest_first(self):
+        cmds = ['a', 'b', 'c', 'd']
+        costs = [1, 5, 3, 5]
+        self.assertEqual(MOD.order_longest_first(cmds, costs), ['b', 'd', 'c', 'a'])
+
+    def test_longest_first_shrinks_makespan(self):
+        costs = [1, 1, 1, 1, 4]
+        self.assertEqual(MOD.predict_makespan(costs, 2), 6)
+        self.assertEqual(MOD.predict_makespan(sorted(costs, reverse=True), 2), 4)
+
+
+class Test_OrderedMerger(ThisTestCase):
+    def setUp(self):
+        super().setUp()
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.outputs = []
+        for i in range(3):
+            path = pathlib.Path(tmpdir.name, "{}.MuSE.txt".format(i))
+            path.write_text("#header\nrecord{}\n".format(i))
+            self.outputs.append(path)
+
+    def test_outputs_merged_in_order_as_prefix_completes(self):
+        fh = io.StringIO()
+        merger = MOD.OrderedMerger(self.outputs, fh)
+        merger.complete(self.outputs[2])
+        merger.complete(self.outputs[1])
+        self.assertEqual(fh.getvalue(), "")
+        merger.complete(self.outputs[0])
+        self.assertEqual(fh.getvalue(), "#header\nrecord0\nrecord1\nrecord2\n")
+        self.assertTrue(merger.finished)
+
+    def test_replaced_output_merged_in_place(self):
+        fh = io.StringIO()
+        merger = MOD.OrderedMerger(self.outputs[:2], fh)
+        merger.replace(self.outputs[0], [self.outputs[2], self.outputs[0]])
+        for output in self.outputs:
+            merger.complete(output)
+        self.assertEqual(fh.getvalue(), "#header\nrecord2\nrecord0\nrecord1\n")
+
+
+SLOW_ONCE = """
+import os, sys, time
+if "chr1:31-40" in sys.argv and not os.path.exists("slow.started"):
+    open("slow.started", "w").close()
+    time.sleep(60)
+"""
+
+# Calls on chr1:1-40 hang, and on chr1:21-40 fail while "fail.flag" exists.
+# Each call that gets through is appended to "calls".
+HANG_WHOLE = """
+import os, sys, time
+if "chr1:1-40" in sys.argv:
+    time.sleep(60)
+if "chr1:21-40" in sys.argv and os.path.exists("fail.flag"):
+    sys.exit("failed")
+with open("calls", "a") as fh:
+    fh.write(sys.argv[sys.argv.index("-r") + 1] + "\\n")
+"""
+
+
+class Test_run(unittest.TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.tmpdir = pathlib.Path(tmpdir.name)
+        (self.tmpdir / "fake_muse.py").write_text(FAKE_MUSE)
+        (self.tmpdir / "regions.bed").write_text("chr1\t0\t10\nchr1\t20\t30\n")
+        cwd = os.getcwd()
+        os.chdir(str(self.tmpdir))
+        self.addCleanup(os.chdir, cwd)
+
+    def run_muse(self, tumor_bam, *args, threads=2):
+        MOD.run(
+            MOD.process_argv(
+                [
+                    "-f",
+                    "ref.fa",
+                    "-r",
+                    "regions.bed",
+                    "-t",
+                    tumor_bam,
+                    "-n",
+                    "n.bam",
+                    "-c",
+                    str(threads),
+                    "--muse-binary",
+                    "{} fake_muse.py".format(sys.executable),
+                    "--no-preflight",
+                    "--scratch-dir",
+                    "scratch",
+                ]
+                + list(args)
+            )
+        )
+
+    def test_only_merged_output_published(self):
+        self.run_muse("t.bam")
+        self.assertEqual(
+            sorted(os.listdir(str(self.tmpdir))),
+            [
+                "fake_muse.py",
+                "multi_muse_call_merged.MuSE.txt",
+                "regions.bed",
+            ],
+        )
+        self.assertEqual(
+            (self.tmpdir / "multi_muse_call_merged.MuSE.txt").read_text(),
+            "#header\nchr1:1-10\tt.bam\nchr1:21-30\tt.bam\n",
+        )
+
+    def test_entry_point_logs_info(self):
+        env = dict(os.environ, PYTHONPATH=str(pathlib.Path(__file__).parents[1]))
+        proc = subprocess.run(
+            [sys.executable, "-m", "muse_tool.multi_muse"]
+            + ["-f", "ref.fa", "-r", "regions.bed", "-t", "t.bam", "-n", "n.bam"]
+            + ["--muse-binary", "{} fake_muse.py".format(sys.executable)]
+            + ["-c", "2", "--no-preflight"],
+            env=env,
+            stderr=subprocess.PIPE,
+            check=True,
+        )
+        stderr = proc.stderr.decode()
+        self.assertIn("[muse_tool.multi_muse] - Loaded 2 intervals", stderr)
+        self.assertIn("Finished, took", stderr)
+
+    def test_straggler_duplicate_wins(self):
+        # The first call on chr1:31-40 hangs, as on a stalled filesystem.
+        (self.tmpdir / "fake_muse.py").write_text(SLOW_ONCE + FAKE_MUSE)
+        (self.tmpdir / "regions.bed").write_text(
+            "".join("chr1\t{}\t{}\n".format(i, i + 10) for i in (0, 10, 20, 30))
+        )
+        start = time.time()
+        self.run_muse("t.bam", "--speculate", "2", threads=4)
+        self.assertLess(time.time() - start, 30)
+        records = (self.tmpdir / "multi_muse_call_merged.MuSE.txt").read_text()
+        self.assertEqual(
+            [line.split("\t")[0] for line in records.splitlines()[1:]],
+            ["chr1:1-10", "chr1:11-20", "chr1:21-30", "chr1:31-40"],
+        )
+        self.assertFalse((self.tmpdir / "scratch").exists())
+
+    def test_resume_runs_unfinished_half_of_bisected_shard(self):
+        (self.tmpdir / "fake_muse.py").write_text(HANG_WHOLE + FAKE_MUSE)
+        (self.tmpdir / "regions.bed").write_text("chr1\t0\t40\n")
+        (self.tmpdir / "fail.flag").touch()
+        args = ["--timeout", "1", "--bisect-depth", "1", "--shard-padding", "0"]
+        with self.assertRaisesRegex(ValueError, "1 shards failed"):
+            self.run_muse("t.bam", *args, threads=1)
+        self.assertEqual((self.tmpdir / "calls").read_text(), "chr1:1-20\n")
+        (self.tmpdir / "fail.flag").unlink()
+        (self.tmpdir / "calls").unlink()
+        self.run_muse("t.bam", *args, "--resume", threads=1)
+        self.assertEqual((self.tmpdir / "calls").read_text(), "chr1:21-40\n")
+        self.assertEqual(
+            (self.tmpdir / "multi_muse_call_merged.MuSE.txt").read_text(),
+            "#header\nchr1:1-20\tt.bam\nchr1:21-40\tt.bam\n",
+        )
+
+    def test_scratch_kept_on_failure(self):
+        with self.assertRaisesRegex(ValueError, "2 shards failed"):
+            self.run_muse("bad.bam")
+        self.assertFalse((self.tmpdir / "multi_muse_call_merged.MuSE.txt").exists())
+        self.assertTrue((self.tmpdir / "scratch" / "shard-manifest.jsonl").exists())
+
+
 # __END__
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+
+import os
+import pathlib
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from muse_tool import placement as MOD
+
+
+class Test_placement(unittest.TestCase):
+    def test_cpulist_round_trip(self):
+        self.assertEqual(MOD.parse_cpulist("0-3,8,10-11\n"), [0, 1, 2, 3, 8, 10, 11])
+        self.assertEqual(MOD.format_cpulist([11, 0, 1, 2, 3, 8, 10]), "0-3,8,10-11")
+
+    def test_split_cpus(self):
+        self.assertEqual(
+            MOD.split_cpus(list(range(8)), 3),
+            [([0, 1], None), ([2, 3, 4], None), ([5, 6, 7], None)],
+        )
+        self.assertEqual(
+            MOD.split_cpus([0, 1], 3), [([0], None), ([1], None), ([0], None)]
+        )
+
+    def test_split_cpus_over_numa_nodes(self):
+        nodes = {0: [0, 1, 2, 3], 1: [4, 5, 6, 7], 2: [8, 9]}
+        # Node 2 is outside this process's CPUs, so gets no slots.
+        self.assertEqual(
+            MOD.split_cpus(list(range(8)), 4, nodes),
+            [([0, 1], 0), ([4, 5], 1), ([2, 3], 0), ([6, 7], 1)],
+        )
+
+    def test_read_numa_nodes(self):
+        with tempfile.TemporaryDirectory() as root:
+            for node, cpulist in ((0, "0-1"), (1, "2-3")):
+                path = pathlib.Path(root, "node{}".format(node))
+                path.mkdir()
+                (path / "cpulist").write_text(cpulist + "\n")
+            self.assertEqual(MOD.read_numa_nodes(root), {0: [0, 1], 1: [2, 3]})
+
+    def test_parse_ionice(self):
+        self.assertEqual(MOD.parse_ionice("idle"), 3 << 13 | 4)
+        self.assertEqual(MOD.parse_ionice("best-effort:7"), 2 << 13 | 7)
+        with self.assertRaisesRegex(ValueError, "Unknown I/O class"):
+            MOD.parse_ionice("low")
+
+    def test_slots_held_while_running(self):
+        placement = MOD.Placement([([0], None), ([1], None)])
+        with placement.slot(), placement.slot():
+            self.assertEqual(placement._free, [])
+        self.assertEqual(sorted(placement._free), [0, 1])
+
+    @unittest.skipUnless(hasattr(os, "sched_setaffinity"), "Linux only")
+    def test_child_placed(self):
+        cpu = min(os.sched_getaffinity(0))
+        nice = os.getpriority(os.PRIO_PROCESS, 0) + 1
+        placement = MOD.Placement([([cpu], None)], nice=nice)
+        with placement.slot() as preexec_fn:
+            out = subprocess.check_output(
+                [
+                    sys.executable,
+                    "-c",
+                    "import os; print(sorted(os.sched_getaffinity(0)), "
+                    "os.getpriority(os.PRIO_PROCESS, 0))",
+                ],
+                preexec_fn=preexec_fn,
+            )
+        self.assertEqual(out.decode().split(), ["[{}]".format(cpu), str(nice)])
+
+
+# __END__
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+
+import io
+import unittest
+
+from muse_tool import plan as MOD
+from muse_tool.intervals import BedInterval, FaiRecord
+
+CONTIGS = [FaiRecord('chr1', 10000), FaiRecord('chr2', 5000)]
+
+
+class Test_plan_shards(unittest.TestCase):
+    def test_coarse_interval_is_split_evenly(self):
+        intervals = [BedInterval('chr1', 0, 10000)]
+        shards = MOD.plan_shards(intervals, CONTIGS, 4, padding=100)
+        self.assertEqual([shard.bp for shard in shards], [2500] * 4)
+
+    def test_small_intervals_are_coalesced(self):
+        intervals = [BedInterval('chr1', i * 100, i * 100 + 10) for i in range(40)]
+        shards = MOD.plan_shards(intervals, CONTIGS, 4)
+        self.assertEqual(len(shards), 4)
+        self.assertTrue(all(len(shard.intervals) == 10 for shard in shards))
+
+    def test_reference_order_and_clipping(self):
+        intervals = [BedInterval('chr2', 0, 9000), BedInterval('chr1', 0, 10)]
+        shards = MOD.plan_shards(intervals, CONTIGS, 1)
+        self.assertEqual(
+            list(shards[0].intervals),
+            [BedInterval('chr1', 0, 10), BedInterval('chr2', 0, 5000)],
+        )
+
+    def test_never_split_within_padding(self):
+        intervals = [BedInterval('chr1', 0, 150), BedInterval('chr1', 200, 400)]
+        shards = MOD.plan_shards(intervals, CONTIGS, 2, padding=100)
+        edges = {(i.start, i.end) for s in shards for i in s.intervals}
+        self.assertEqual(edges, {(0, 150), (200, 400)})
+
+    def test_unknown_contig_raises(self):
+        with self.assertRaises(ValueError):
+            MOD.plan_shards([BedInterval('chrX', 0, 10)], CONTIGS, 1)
+
+
+class Test_bisect_shard(unittest.TestCase):
+    def test_single_interval_split_at_midpoint(self):
+        shard = MOD.Shard(3, (BedInterval('chr1', 0, 1000),))
+        children = MOD.bisect_shard(shard, padding=100)
+        self.assertEqual([c.name for c in children], ['3.0', '3.1'])
+        self.assertEqual([c.bp for c in children], [500, 500])
+
+    def test_interval_within_padding_not_split(self):
+        shard = MOD.Shard(0, (BedInterval('chr1', 0, 150),))
+        self.assertEqual(MOD.bisect_shard(shard, padding=100), [])
+
+    def test_interval_list_split_between_intervals(self):
+        intervals = tuple(BedInterval('chr1', i * 10, i * 10 + 5) for i in range(4))
+        children = MOD.bisect_shard(MOD.Shard(0, intervals))
+        self.assertEqual(
+            [c.intervals for c in children], [intervals[:2], intervals[2:]]
+        )
+
+
+class Test_partition_shards(unittest.TestCase):
+    def test_balanced_and_complete(self):
+        lengths = [900, 100, 400, 500, 300, 200, 600]
+        shards = MOD.shards_from_intervals(
+            BedInterval('chr1', i * 1000, i * 1000 + n) for i, n in enumerate(lengths)
+        )
+        nodes = MOD.partition_shards(shards, 3)
+        self.assertEqual(sorted(s for node in nodes for s in node), sorted(shards))
+        loads = [sum(s.bp for s in node) for node in nodes]
+        self.assertLessEqual(max(loads) - min(loads), 200)
+        for node in nodes:
+            self.assertEqual(node, sorted(node, key=lambda s: s.index))
+        self.assertEqual(MOD.partition_shards(shards, 3), nodes)
+
+
+class Test_pack_intervals(unittest.TestCase):
+    def setUp(self):
+        self.contigs = [FaiRecord('chr1', 10000), FaiRecord('chr2', 10000)]
+        # 10 intervals of 100 bp, and one of 1000 bp, out of order.
+        self.intervals = [BedInterval('chr2', 0, 1000)] + [
+            BedInterval('chr1', i * 200, i * 200 + 100) for i in range(10)
+        ]
+
+    def test_packed_by_bp_in_reference_order(self):
+        shards = MOD.pack_intervals(self.intervals, self.contigs, target_bp=300)
+        self.assertEqual([len(s.intervals) for s in shards], [3, 3, 3, 1, 1])
+        self.assertEqual(shards[-1].intervals, (BedInterval('chr2', 0, 1000),))
+        packed = [i for s in shards for i in s.intervals]
+        self.assertEqual(packed, self.intervals[1:] + self.intervals[:1])
+
+    def test_packed_by_count(self):
+        shards = MOD.pack_intervals(self.intervals, self.contigs, target_count=4)
+        self.assertEqual([len(s.intervals) for s in shards], [4, 4, 3])
+
+    def test_targets_lowered_to_keep_min_shards(self):
+        shards = MOD.pack_intervals(
+            self.intervals, self.contigs, target_count=100, min_shards=4
+        )
+        self.assertEqual([len(s.intervals) for s in shards], [3, 3, 3, 2])
+
+
+class Test_write_plan(unittest.TestCase):
+    def test_plan_is_bed(self):
+        shards = MOD.shards_from_intervals([BedInterval('chr1', 0, 10)])
+        fh = io.StringIO()
+        MOD.write_plan(shards, fh)
+        self.assertEqual(fh.getvalue(), "chr1\t0\t10\t0\n")
+
+
+# __END__
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+
+import pathlib
+import tempfile
+import threading
+import time
+import unittest
+
+from muse_tool import prefetch as MOD
+from muse_tool.bam import MAX_BLOCK_SIZE, BamIndex, ReferenceIndex
+from muse_tool.intervals import BedInterval
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            raise AssertionError("Timed out")
+        time.sleep(0.01)
+
+
+class Test_prefetch(unittest.TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.path = str(pathlib.Path(tmpdir.name, "t.bam"))
+        pathlib.Path(self.path).write_bytes(b"\0" * 100)
+
+    def test_bam_ranges_coalesced_and_capped(self):
+        linear = (100 << 16, 200 << 16, 300 << 16)
+        index = BamIndex(
+            self.path, {"chr1": ReferenceIndex({}, (100 << 16, 900 << 16), 1, linear)}
+        )
+        intervals = [BedInterval("chr1", 0, 10), BedInterval("chr1", 16384, 16394)]
+        self.assertEqual(
+            MOD.bam_ranges([index], intervals, 1 << 30),
+            [MOD.ByteRange(self.path, 100, 200 + MAX_BLOCK_SIZE)],
+        )
+        self.assertEqual(
+            MOD.bam_ranges([index, index], intervals, 50),
+            [MOD.ByteRange(self.path, 100, 50)] * 2,
+        )
+
+    def test_advised_and_late_dispatch(self):
+        gate = threading.Event()
+
+        def ranges(cmd):
+            if cmd == "slow":
+                gate.wait()
+            return [MOD.ByteRange(self.path, 0, 4)]
+
+        with MOD.Prefetcher(ranges, depth=2) as prefetcher:
+            prefetcher.ahead(["fast"])
+            wait_for(lambda: prefetcher.state.get("fast") == MOD.WARM)
+            prefetcher.dispatched("fast")
+            prefetcher.ahead(["slow", "queued"])
+            wait_for(lambda: prefetcher.state.get("slow") == MOD.WARMING)
+            prefetcher.dispatched("slow")
+            prefetcher.dispatched("queued")
+            gate.set()
+        self.assertEqual(
+            (prefetcher.advised, prefetcher.late, prefetcher.missed), (1, 2, 0)
+        )
+        # Both late commands were queued in one window: one doubling.
+        self.assertEqual(prefetcher.depth, 4)
+        self.assertEqual(prefetcher.warmed_bytes, 8)
+
+    def test_missed_dispatch_deepens(self):
+        prefetcher = MOD.Prefetcher(lambda cmd: [], depth=2, max_depth=3)
+        prefetcher.dispatched("unseen")
+        self.assertEqual((prefetcher.missed, prefetcher.depth), (1, 3))
+
+
+# __END__
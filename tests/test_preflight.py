@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+
+import os
+import pathlib
+import tempfile
+import unittest
+
+from muse_tool import preflight as MOD
+from muse_tool.intervals import BedInterval
+from tests.fakes import bai, bam_header
+
+
+class Test_preflight(unittest.TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.tmpdir = pathlib.Path(tmpdir.name)
+        self.reference = str(self.tmpdir / "ref.fa")
+        pathlib.Path(self.reference + ".fai").write_text(
+            "chr1\t1000\t0\t60\t61\nchr2\t500\t0\t60\t61\n"
+        )
+        self.bams = [self.write_bam(name) for name in ("t.bam", "n.bam")]
+
+    def write_bam(self, name, references=(("chr1", 1000), ("chr2", 500))):
+        path = self.tmpdir / name
+        path.write_bytes(bam_header(list(references)))
+        pathlib.Path(str(path) + ".bai").write_bytes(bai([({}, 0)] * len(references)))
+        return str(path)
+
+    def test_valid_inputs(self):
+        dictionaries = MOD.preflight(
+            self.reference, self.bams, [BedInterval("chr1", 0, 1000)]
+        )
+        self.assertEqual([d.lengths["chr2"] for d in dictionaries], [500] * 3)
+
+    def test_contig_naming_mismatch(self):
+        self.bams[1] = self.write_bam("n.bam", [("1", 1000), ("2", 500)])
+        with self.assertRaises(MOD.PreflightError) as cm:
+            MOD.preflight(self.reference, self.bams, [BedInterval("chr1", 0, 10)])
+        self.assertEqual(
+            cm.exception.problems,
+            [
+                "1 intervals on chr1, which is not in {} (did you mean 1?)".format(
+                    self.bams[1]
+                )
+            ],
+        )
+
+    def test_intervals_beyond_contig(self):
+        intervals = [BedInterval("chr2", 0, 501), BedInterval("chr2", 10, 10)]
+        with self.assertRaisesRegex(MOD.PreflightError, "2 intervals empty"):
+            MOD.preflight(self.reference, self.bams, intervals)
+
+    def test_missing_index(self):
+        os.unlink(self.bams[0] + ".bai")
+        with self.assertRaisesRegex(MOD.PreflightError, "No .bai index"):
+            MOD.preflight(self.reference, self.bams, [])
+
+    def test_contig_lengths_differ(self):
+        self.bams[0] = self.write_bam("t.bam", [("chr1", 999), ("chr2", 500)])
+        with self.assertRaisesRegex(MOD.PreflightError, "chr1 has different"):
+            MOD.preflight(self.reference, self.bams, [BedInterval("chr1", 0, 10)])
+
+
+# __END__
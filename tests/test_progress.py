@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+
+import pathlib
+import tempfile
+import unittest
+from unittest import mock
+
+from muse_tool import progress as MOD
+from muse_tool.intervals import BedInterval
+from muse_tool.plan import Shard, bisect_shard
+
+
+class Test_ProgressTracker(unittest.TestCase):
+    def setUp(self):
+        self.shards = [
+            Shard(0, (BedInterval("chr1", 0, 1000), BedInterval("chr1", 2000, 3000))),
+            Shard(1, (BedInterval("chr2", 0, 2000),)),
+        ]
+        self.tracker = MOD.ProgressTracker(self.shards, interval=0)
+
+    def test_bisected_parts_count_towards_planned_shard(self):
+        first, second = bisect_shard(self.shards[1], padding=0)
+        self.tracker.complete(first)
+        self.assertEqual((self.tracker.done_bp, self.tracker.done_intervals), (1000, 0))
+        self.tracker.complete(second)
+        self.assertEqual((self.tracker.done_bp, self.tracker.done_intervals), (2000, 1))
+
+    def test_eta_excludes_skipped(self):
+        self.tracker.start -= 10
+        self.tracker.complete(self.shards[0], skipped=True)
+        self.assertIsNone(self.tracker.eta)
+        first, second = bisect_shard(self.shards[1], padding=0)
+        self.tracker.complete(first)
+        # 1000 bp called in 10 s, 1000 bp to go.
+        self.assertAlmostEqual(self.tracker.eta, 10, delta=0.5)
+        self.tracker.complete(second)
+        self.assertEqual(self.tracker.eta, 0)
+        self.assertIn("3/3 intervals", self.tracker.status())
+
+    def test_textfile(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = pathlib.Path(tmpdir, "muse.prom")
+            tracker = MOD.ProgressTracker(
+                self.shards,
+                interval=0,
+                textfile=str(path),
+                running=mock.Mock(return_value=3),
+                labels=dict(output="out"),
+            )
+            with tracker:
+                tracker.complete(self.shards[1])
+            text = path.read_text()
+            self.assertIn('muse_tool_bp_done{output="out"} 2000\n', text)
+            self.assertIn('muse_tool_running{output="out"} 3\n', text)
+            self.assertEqual(list(pathlib.Path(tmpdir).iterdir()), [path])
+
+    def test_format_duration(self):
+        self.assertEqual(MOD.format_duration(3725.5), "1:02:05")
+        self.assertEqual(MOD.format_duration(None), "?")
+        self.assertEqual(MOD.format_bp(1500000), "1.5 Mbp")
+
+
+# __END__
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+
+import unittest
+
+from muse_tool import speculate as MOD
+
+
+class Test_Speculator(unittest.TestCase):
+    def setUp(self):
+        self.promoted = []
+        self.discarded = []
+        self.speculator = MOD.Speculator(
+            cost=len,
+            duplicate=lambda cmd: cmd + "'",
+            promote=lambda cmd, dup: self.promoted.append((cmd, dup)),
+            discard=self.discarded.append,
+            factor=2,
+            min_observed=2,
+        )
+
+    def observe(self):
+        # 1 unit per second, and a 1 second floor.
+        self.speculator.observe("a", 1.0)
+        self.speculator.observe("bbbb", 4.0)
+
+    def test_no_estimate_until_observed(self):
+        self.speculator.observe("a", 1.0)
+        self.assertIsNone(self.speculator.expected("a"))
+        self.assertEqual(self.speculator.launch({"aa": 100.0}, 1), [])
+
+    def test_launches_most_overdue_first(self):
+        self.observe()
+        self.assertEqual(self.speculator.expected("aaa"), 3.0)
+        running = {"aaa": 5.0, "aaaa": 8.5, "b": 3.0}
+        self.assertEqual(self.speculator.launch(running, 1), ["b'"])
+        self.assertEqual(self.speculator.launch(running, 2), ["aaaa'"])
+
+    def test_duplicate_wins_once_original_exits(self):
+        self.observe()
+        self.speculator.launch({"b": 3.0}, 1)
+        self.assertIsNone(self.speculator.settle("b'", None, "result", 1.0))
+        self.assertEqual(self.speculator.doomed, {"b"})
+        outcome = self.speculator.settle("b", ValueError("killed"), None, 9.0)
+        self.assertEqual(outcome, ("b", None, "result", 1.0))
+        self.assertEqual(self.promoted, [("b", "b'")])
+        self.assertEqual(self.speculator.doomed, set())
+
+    def test_original_wins(self):
+        self.observe()
+        self.speculator.launch({"b": 3.0}, 1)
+        outcome = self.speculator.settle("b", None, "result", 4.0)
+        self.assertEqual(outcome, ("b", None, "result", 4.0))
+        self.assertIsNone(self.speculator.settle("b'", ValueError(), None, 1.0))
+        self.assertEqual(self.discarded, ["b'"])
+        self.assertEqual((self.speculator.wins, self.speculator.losses), (0, 1))
+
+    def test_duplicate_takes_over_from_failed_original(self):
+        self.observe()
+        self.speculator.launch({"b": 3.0}, 1)
+        self.assertIsNone(self.speculator.settle("b", ValueError(), None, 4.0))
+        self.assertEqual(self.speculator.launch({"b'": 5.0}, 1), [])
+        outcome = self.speculator.settle("b'", None, "result", 2.0)
+        self.assertEqual(outcome, ("b", None, "result", 2.0))
+        self.assertEqual(self.promoted, [("b", "b'")])
+        self.assertEqual(self.speculator.doomed, set())
+        self.assertEqual(self.speculator.failed, {})
+
+    def test_original_fails_after_duplicate_fails(self):
+        self.observe()
+        self.speculator.launch({"b": 3.0}, 1)
+        error = ValueError("original")
+        self.assertIsNone(self.speculator.settle("b", error, None, 4.0))
+        outcome = self.speculator.settle("b'", ValueError("duplicate"), None, 2.0)
+        self.assertEqual(outcome, ("b", error, None, 4.0))
+        self.assertEqual(self.discarded, ["b'"])
+        self.assertEqual((self.speculator.wins, self.speculator.losses), (0, 1))
+
+
+# __END__
@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+
+import io
+import subprocess
+import sys
+import unittest
+
+from muse_tool import telemetry as MOD
+
+
+class Test_wait_child(unittest.TestCase):
+    def test_usage_and_returncode_collected(self):
+        proc = subprocess.Popen(
+            [sys.executable, '-c', 'x = bytearray(32 << 20); raise SystemExit(3)']
+        )
+        usage = MOD.wait_child(proc, timeout=30)
+        self.assertEqual(proc.returncode, 3)
+        self.assertGreater(usage.max_rss_kb, 32 << 10)
+        self.assertGreater(usage.user_cpu_s + usage.sys_cpu_s, 0)
+
+    def test_timeout_raised(self):
+        proc = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(30)'])
+        self.addCleanup(proc.wait)
+        self.addCleanup(proc.kill)
+        with self.assertRaises(subprocess.TimeoutExpired):
+            MOD.wait_child(proc, timeout=0.2)
+
+
+class Test_write_report_tsv(unittest.TestCase):
+    def test_missing_io_left_blank(self):
+        usage = MOD.ChildUsage(1.5, 1.0, 0.25, 2048)
+        row = dict(shard='0', regions=['chr1:1-10'], bp=10, **usage._asdict())
+        fh = io.StringIO()
+        MOD.write_report_tsv([row], fh)
+        header, line = fh.getvalue().splitlines()
+        self.assertEqual(line, "0\tchr1:1-10\t10\t1.5\t1.0\t0.25\t2048\t\t\t\t")
+
+
+# __END__
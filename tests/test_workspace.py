@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+
+import errno
+import os
+import pathlib
+import tempfile
+import unittest
+from unittest import mock
+
+from muse_tool import workspace as MOD
+
+
+class Test_workspace(unittest.TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.tmpdir = pathlib.Path(tmpdir.name)
+
+    def test_publish_across_filesystems(self):
+        src, dest = self.tmpdir / "src", self.tmpdir / "dest"
+        src.write_text("new")
+        dest.write_text("old")
+        replace = os.replace
+
+        def cross_device(a, b):
+            if a == str(src):
+                raise OSError(errno.EXDEV, "Invalid cross-device link")
+            replace(a, b)
+
+        with mock.patch.object(MOD.os, "replace", side_effect=cross_device):
+            MOD.publish(str(src), str(dest))
+        self.assertEqual(dest.read_text(), "new")
+        self.assertEqual(os.listdir(str(self.tmpdir)), ["dest"])
+
+    def test_publish_indexed_removes_stale_index(self):
+        src, dest = self.tmpdir / "src.gz", self.tmpdir / "dest.gz"
+        src.write_text("new")
+        pathlib.Path(str(dest) + ".tbi").write_text("old index")
+        MOD.publish_indexed(str(src), str(dest))
+        self.assertEqual(os.listdir(str(self.tmpdir)), ["dest.gz"])
+
+    def test_private_workspace_removed(self):
+        workspace = MOD.Workspace()
+        pathlib.Path(workspace.join("shard-0.MuSE.txt")).write_text("x")
+        workspace.cleanup()
+        self.assertFalse(os.path.exists(workspace.path))
+
+    def test_given_workspace_keeps_other_files(self):
+        scratch = self.tmpdir / "scratch"
+        scratch.mkdir()
+        (scratch / "notes.txt").write_text("x")
+        workspace = MOD.Workspace(str(scratch))
+        (scratch / "shard-0.regions.txt").write_text("x")
+        workspace.cleanup()
+        self.assertEqual(os.listdir(str(scratch)), ["notes.txt"])
+
+    def test_created_workspace_removed_when_empty(self):
+        workspace = MOD.Workspace(str(self.tmpdir / "a" / "b"))
+        pathlib.Path(workspace.join("shard-0.MuSE.txt")).write_text("x")
+        workspace.cleanup()
+        self.assertEqual(os.listdir(str(self.tmpdir / "a")), [])
+
+
+# __END__